@@ -12,12 +12,29 @@ import json
 import os
 from dotenv import load_dotenv
 
+from audit_writer import get_audit_writer, make_row
+from audit_rollup import AuditRollup, summarize
+
 load_dotenv()
 
+# Events written synchronously even in async mode: account state and credential
+# changes must be on disk before the response goes out
+DURABLE_ACTIONS = {
+    "account_locked",
+    "account_unlocked",
+    "password_change_success",
+    "password_reset_success",
+    "token_revoked",
+    "suspicious_activity",
+}
+
 class AuditLogger:
     def __init__(self, db_connection):
         self.db_connection = db_connection
         self.retention_days = int(os.getenv("AUDIT_LOG_RETENTION_DAYS", 90))
+        # async: batched background writes (default); sync: every event committed inline
+        self.mode = os.getenv("AUDIT_LOG_MODE", "async").lower()
+        self.writer = get_audit_writer()
     
     def _get_cursor(self):
         """Get database cursor with proper error handling"""
@@ -54,46 +71,47 @@ class AuditLogger:
                    action: str, 
                    success: bool, 
                    request: Optional[Request] = None,
-                   details: Optional[Dict[str, Any]] = None) -> int:
-        """Log an audit event to the database"""
-        cursor = self._get_cursor()
+                   details: Optional[Dict[str, Any]] = None,
+                   durable: bool = False) -> Optional[int]:
+        """Log an audit event.
+
+        Events are queued for the batched writer and None is returned; durable
+        events (and every event when AUDIT_LOG_MODE=sync) are committed before
+        returning and their log_id is returned.
+        """
+        client_info = self._extract_client_info(request) if request else {}
+        
+        # Prepare details JSON
+        log_details = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "client_info": client_info,
+            "details": details or {}
+        }
+        
+        row = make_row(
+            user_id,
+            user_type,
+            action,
+            client_info.get("ip_address"),
+            client_info.get("user_agent"),
+            success,
+            log_details,
+            # Promoted to its own column so lockout lookups can use an index
+            (details or {}).get("username")
+        )
+        
+        if self.mode == "async" and not durable and action not in DURABLE_ACTIONS:
+            self.writer.enqueue(row)
+            return None
+        
         try:
-            client_info = self._extract_client_info(request) if request else {}
-            
-            # Prepare details JSON
-            log_details = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "client_info": client_info,
-                "details": details or {}
-            }
-            
-            cursor.execute("""
-                INSERT INTO auth_audit_log (user_id, user_type, action, ip_address, user_agent, success, details)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING log_id
-            """, (
-                user_id,
-                user_type,
-                action,
-                client_info.get("ip_address"),
-                client_info.get("user_agent"),
-                success,
-                json.dumps(log_details)
-            ))
-            
-            log_id = cursor.fetchone()['log_id']
-            self.db_connection.commit()
-            return log_id
-            
-        except psycopg2.Error as e:
-            self.db_connection.rollback()
+            return self.writer.write_sync(row, self.db_connection)
+        except Exception as e:
             raise Exception(f"Failed to log audit event: {e}")
-        finally:
-            cursor.close()
     
     # Authentication Events
     def log_login_attempt(self, username: str, user_type: str, success: bool, request: Request, 
-                         user_id: Optional[int] = None, failure_reason: str = None) -> int:
+                         user_id: Optional[int] = None, failure_reason: str = None) -> Optional[int]:
         """Log login attempt"""
         details = {
             "username": username,
@@ -102,13 +120,13 @@ class AuditLogger:
         return self._log_event(user_id, user_type, "login_attempt", success, request, details)
     
     def log_successful_login(self, user_id: int, user_type: str, request: Request, 
-                           username: str = None) -> int:
+                           username: str = None) -> Optional[int]:
         """Log successful login"""
         details = {"username": username} if username else {}
         return self._log_event(user_id, user_type, "login_success", True, request, details)
     
     def log_failed_login(self, username: str, user_type: str, request: Request, 
-                        reason: str = "invalid_credentials") -> int:
+                        reason: str = "invalid_credentials") -> Optional[int]:
         """Log failed login attempt"""
         details = {
             "username": username,
@@ -117,7 +135,7 @@ class AuditLogger:
         return self._log_event(None, user_type, "login_failed", False, request, details)
     
     def log_logout(self, user_id: int, user_type: str, request: Request, 
-                  username: str = None, logout_type: str = "manual") -> int:
+                  username: str = None, logout_type: str = "manual") -> Optional[int]:
         """Log logout event"""
         details = {
             "username": username,
@@ -127,7 +145,7 @@ class AuditLogger:
     
     def log_registration_attempt(self, username: str, user_type: str, success: bool, 
                                request: Request, user_id: Optional[int] = None, 
-                               failure_reason: str = None) -> int:
+                               failure_reason: str = None) -> Optional[int]:
         """Log registration attempt"""
         details = {
             "username": username,
@@ -136,13 +154,13 @@ class AuditLogger:
         return self._log_event(user_id, user_type, "registration_attempt", success, request, details)
     
     def log_successful_registration(self, user_id: int, user_type: str, request: Request, 
-                                  username: str = None) -> int:
+                                  username: str = None) -> Optional[int]:
         """Log successful registration"""
         details = {"username": username} if username else {}
         return self._log_event(user_id, user_type, "registration_success", True, request, details)
     
     def log_failed_registration(self, username: str, user_type: str, request: Request, 
-                              reason: str = "validation_failed") -> int:
+                              reason: str = "validation_failed") -> Optional[int]:
         """Log failed registration attempt"""
         details = {
             "username": username,
@@ -152,21 +170,21 @@ class AuditLogger:
     
     # Password Events
     def log_password_change(self, user_id: int, user_type: str, request: Request, 
-                          success: bool, username: str = None) -> int:
+                          success: bool, username: str = None) -> Optional[int]:
         """Log password change attempt"""
         details = {"username": username} if username else {}
         action = "password_change_success" if success else "password_change_failed"
         return self._log_event(user_id, user_type, action, success, request, details)
     
     def log_password_reset_request(self, username: str, user_type: str, request: Request, 
-                                 success: bool) -> int:
+                                 success: bool) -> Optional[int]:
         """Log password reset request"""
         details = {"username": username}
         action = "password_reset_request" if success else "password_reset_request_failed"
         return self._log_event(None, user_type, action, success, request, details)
     
     def log_password_reset_complete(self, user_id: int, user_type: str, request: Request, 
-                                  success: bool, username: str = None) -> int:
+                                  success: bool, username: str = None) -> Optional[int]:
         """Log password reset completion"""
         details = {"username": username} if username else {}
         action = "password_reset_success" if success else "password_reset_failed"
@@ -174,32 +192,32 @@ class AuditLogger:
     
     # Token Events
     def log_token_creation(self, user_id: int, user_type: str, request: Request, 
-                         token_type: str = "access") -> int:
+                         token_type: str = "access") -> Optional[int]:
         """Log token creation"""
         details = {"token_type": token_type}
         return self._log_event(user_id, user_type, "token_created", True, request, details)
     
     def log_token_refresh(self, user_id: int, user_type: str, request: Request, 
-                        success: bool) -> int:
+                        success: bool) -> Optional[int]:
         """Log token refresh attempt"""
         action = "token_refresh_success" if success else "token_refresh_failed"
         return self._log_event(user_id, user_type, action, success, request)
     
     def log_token_revocation(self, user_id: int, user_type: str, request: Request, 
-                           reason: str = "logout") -> int:
+                           reason: str = "logout") -> Optional[int]:
         """Log token revocation"""
         details = {"reason": reason}
         return self._log_event(user_id, user_type, "token_revoked", True, request, details)
     
     def log_token_blacklist(self, jti: str, user_id: int, user_type: str, request: Request, 
-                          reason: str = "logout") -> int:
+                          reason: str = "logout") -> Optional[int]:
         """Log token blacklisting"""
         details = {"jti": jti, "reason": reason}
         return self._log_event(user_id, user_type, "token_blacklisted", True, request, details)
     
     # Security Events
     def log_suspicious_activity(self, user_id: Optional[int], user_type: Optional[str], 
-                              request: Request, activity_type: str, details: Dict[str, Any]) -> int:
+                              request: Request, activity_type: str, details: Dict[str, Any]) -> Optional[int]:
         """Log suspicious activity"""
         log_details = {
             "activity_type": activity_type,
@@ -208,7 +226,7 @@ class AuditLogger:
         return self._log_event(user_id, user_type, "suspicious_activity", False, request, log_details)
     
     def log_rate_limit_exceeded(self, identifier: str, endpoint: str, request: Request, 
-                              user_id: Optional[int] = None) -> int:
+                              user_id: Optional[int] = None) -> Optional[int]:
         """Log rate limit exceeded"""
         details = {
             "identifier": identifier,
@@ -217,13 +235,13 @@ class AuditLogger:
         return self._log_event(user_id, "user", "rate_limit_exceeded", False, request, details)
     
     def log_account_locked(self, user_id: int, user_type: str, request: Request, 
-                         reason: str = "too_many_failed_attempts") -> int:
+                         reason: str = "too_many_failed_attempts") -> Optional[int]:
         """Log account lockout"""
         details = {"reason": reason}
         return self._log_event(user_id, user_type, "account_locked", False, request, details)
     
     def log_account_unlocked(self, user_id: int, user_type: str, request: Request, 
-                           reason: str = "automatic_unlock") -> int:
+                           reason: str = "automatic_unlock") -> Optional[int]:
         """Log account unlock"""
         details = {"reason": reason}
         return self._log_event(user_id, user_type, "account_unlocked", True, request, details)
@@ -231,23 +249,27 @@ class AuditLogger:
     # General Events
     def log_security_event(self, user_id: Optional[int], user_type: Optional[str], 
                          action: str, success: bool, request: Request, 
-                         details: Optional[Dict[str, Any]] = None) -> int:
+                         details: Optional[Dict[str, Any]] = None, durable: bool = False) -> Optional[int]:
         """Log general security event"""
-        return self._log_event(user_id, user_type, action, success, request, details)
+        return self._log_event(user_id, user_type, action, success, request, details, durable)
     
     # Query Methods
+    # auth_audit_log is range-partitioned on created_at (a plain TIMESTAMP).
+    # Bounds are written against LOCALTIMESTAMP rather than CURRENT_TIMESTAMP:
+    # comparing with a timestamptz casts the partition key and disables pruning.
     def get_user_audit_logs(self, user_id: int, user_type: str, limit: int = 100, 
                           offset: int = 0) -> List[Dict[str, Any]]:
-        """Get audit logs for a specific user"""
+        """Get audit logs for a specific user within the retention period"""
         cursor = self._get_cursor()
         try:
             cursor.execute("""
                 SELECT log_id, action, ip_address, user_agent, success, details, created_at
                 FROM auth_audit_log
                 WHERE user_id = %s AND user_type = %s
+                AND created_at > LOCALTIMESTAMP - make_interval(days => %s)
                 ORDER BY created_at DESC
                 LIMIT %s OFFSET %s
-            """, (user_id, user_type, limit, offset))
+            """, (user_id, user_type, self.retention_days, limit, offset))
             
             return cursor.fetchall()
             
@@ -261,16 +283,17 @@ class AuditLogger:
         """Get failed login attempts for a user in the last N hours"""
         cursor = self._get_cursor()
         try:
+            # Served by the partial index idx_audit_log_failed_login
             cursor.execute("""
                 SELECT log_id, ip_address, user_agent, details, created_at
                 FROM auth_audit_log
-                WHERE user_type = %s 
+                WHERE username = %s
+                AND user_type = %s 
                 AND action IN ('login_failed', 'login_attempt')
                 AND success = FALSE
-                AND details->>'username' = %s
-                AND created_at > CURRENT_TIMESTAMP - INTERVAL '%s hours'
+                AND created_at > LOCALTIMESTAMP - make_interval(hours => %s)
                 ORDER BY created_at DESC
-            """, (user_type, username, hours))
+            """, (username, user_type, hours))
             
             return cursor.fetchall()
             
@@ -287,7 +310,7 @@ class AuditLogger:
                 SELECT log_id, user_id, user_type, action, ip_address, user_agent, details, created_at
                 FROM auth_audit_log
                 WHERE action IN ('suspicious_activity', 'rate_limit_exceeded', 'account_locked')
-                AND created_at > CURRENT_TIMESTAMP - INTERVAL '%s hours'
+                AND created_at > LOCALTIMESTAMP - make_interval(hours => %s)
                 ORDER BY created_at DESC
             """, (hours,))
             
@@ -298,16 +321,35 @@ class AuditLogger:
         finally:
             cursor.close()
     
+    def ensure_partitions(self, months_ahead: int = 3) -> int:
+        """Create the monthly auth_audit_log partitions for the coming months"""
+        cursor = self._get_cursor()
+        try:
+            cursor.execute("SELECT ensure_auth_audit_log_partitions(%s) AS created", (months_ahead,))
+            created = cursor.fetchone()["created"]
+            self.db_connection.commit()
+            return created
+            
+        except psycopg2.Error as e:
+            self.db_connection.rollback()
+            raise Exception(f"Failed to create audit log partitions: {e}")
+        finally:
+            cursor.close()
+    
     def cleanup_old_logs(self) -> int:
-        """Clean up old audit logs based on retention policy"""
+        """Drop audit log partitions that are entirely past the retention period"""
         cursor = self._get_cursor()
         try:
+            # Whole partitions are detached and dropped instead of DELETEing rows,
+            # so a partially expired month is kept until its last day ages out.
+            # Only the default partition is DELETEd from; the count is an estimate.
+            cursor.execute("SELECT drop_auth_audit_log_partitions(%s) AS dropped", (self.retention_days,))
+            
+            deleted_count = cursor.fetchone()["dropped"]
             cursor.execute("""
-                DELETE FROM auth_audit_log 
-                WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '%s days'
+                DELETE FROM auth_audit_daily_rollup
+                WHERE day < (LOCALTIMESTAMP - make_interval(days => %s))::DATE
             """, (self.retention_days,))
-            
-            deleted_count = cursor.rowcount
             self.db_connection.commit()
             return deleted_count
             
@@ -318,46 +360,61 @@ class AuditLogger:
             cursor.close()
     
     def get_audit_statistics(self, days: int = 30) -> Dict[str, Any]:
-        """Get audit statistics for the last N days"""
+        """Get audit statistics for the last N days.
+
+        Read from auth_audit_daily_rollup (one row per day/action/outcome), so
+        the period is whole days and unique_users/unique_ips are HyperLogLog
+        estimates (within a few percent; near-exact for small counts).
+        """
         cursor = self._get_cursor()
         try:
             cursor.execute("""
-                SELECT 
-                    action,
-                    success,
-                    COUNT(*) as count,
-                    COUNT(DISTINCT user_id) as unique_users,
-                    COUNT(DISTINCT ip_address) as unique_ips
-                FROM auth_audit_log
-                WHERE created_at > CURRENT_TIMESTAMP - INTERVAL '%s days'
-                GROUP BY action, success
-                ORDER BY count DESC
+                SELECT day, action, success, event_count, user_sketch, ip_sketch
+                FROM auth_audit_daily_rollup
+                WHERE day >= (LOCALTIMESTAMP - make_interval(days => %s))::DATE
             """, (days,))
             
-            stats = cursor.fetchall()
+            stats = summarize(cursor.fetchall())
+            stats["period_days"] = days
+            return stats
             
-            # Get daily breakdown
+        except psycopg2.Error as e:
+            raise Exception(f"Failed to get audit statistics: {e}")
+        finally:
+            cursor.close()
+    
+    def rebuild_rollups(self, days: int = 30) -> int:
+        """Recompute the daily rollups for the last N days from auth_audit_log.
+
+        Used to backfill after the rollup table is first created. Audit writers
+        wait on the table lock until the rebuild commits.
+        """
+        cursor = self._get_cursor()
+        try:
+            cursor.execute("LOCK TABLE auth_audit_daily_rollup IN EXCLUSIVE MODE")
             cursor.execute("""
-                SELECT 
-                    DATE(created_at) as date,
-                    COUNT(*) as total_events,
-                    COUNT(CASE WHEN success = TRUE THEN 1 END) as successful_events,
-                    COUNT(CASE WHEN success = FALSE THEN 1 END) as failed_events
+                DELETE FROM auth_audit_daily_rollup
+                WHERE day >= (LOCALTIMESTAMP - make_interval(days => %s))::DATE
+            """, (days,))
+            cursor.execute("""
+                SELECT DATE(created_at) AS day, action, success, user_id,
+                       host(ip_address) AS ip_address, COUNT(*) AS count
                 FROM auth_audit_log
-                WHERE created_at > CURRENT_TIMESTAMP - INTERVAL '%s days'
-                GROUP BY DATE(created_at)
-                ORDER BY date DESC
+                WHERE created_at >= (LOCALTIMESTAMP - make_interval(days => %s))::DATE
+                GROUP BY 1, 2, 3, 4, 5
             """, (days,))
             
-            daily_stats = cursor.fetchall()
-            
-            return {
-                "summary": stats,
-                "daily_breakdown": daily_stats,
-                "period_days": days
-            }
+            rollup = AuditRollup()
+            for row in cursor.fetchall():
+                rollup.add(row['day'], row['action'], row['success'],
+                           row['user_id'], row['ip_address'], row['count'])
+            groups = len(rollup.groups)
+            rollup.apply(cursor)
+            self.db_connection.commit()
+            return groups
             
         except psycopg2.Error as e:
-            raise Exception(f"Failed to get audit statistics: {e}")
+            self.db_connection.rollback()
+            raise Exception(f"Failed to rebuild audit rollups: {e}")
         finally:
             cursor.close()
@@ -0,0 +1,131 @@
+"""
+Audit Log Rollups for CertCheck
+Per-day event counts and distinct user/IP sketches maintained alongside auth_audit_log
+"""
+
+from datetime import date
+from typing import Optional, Dict, Any, List, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from hyperloglog import HyperLogLog
+
+RollupKey = Tuple[date, str, bool]
+
+
+class AuditRollup:
+    """
+    Accumulates audit rows into auth_audit_daily_rollup deltas.
+
+    Each (day, action, success) group carries an event count and two
+    HyperLogLog sketches (user_id, ip_address). apply() merges the deltas into
+    the table inside the caller's transaction, so the rollup commits or rolls
+    back together with the audit rows it describes.
+    """
+
+    def __init__(self):
+        self.groups: Dict[RollupKey, List[Any]] = {}
+
+    def add(self, day: date, action: str, success: bool,
+            user_id: Optional[int], ip_address: Optional[str], count: int = 1):
+        """Count one (or count) events for a group"""
+        key = (day, action, bool(success))
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = [0, HyperLogLog(), HyperLogLog()]
+        group[0] += count
+        # Matches COUNT(DISTINCT ...), which ignores NULLs
+        if user_id is not None:
+            group[1].add(user_id)
+        if ip_address:
+            group[2].add(ip_address)
+
+    def add_rows(self, rows):
+        """Count AuditRow tuples as built by audit_writer.make_row"""
+        for row in rows:
+            user_id, _user_type, action, ip_address, _user_agent, success, _details, created_at = row[:8]
+            self.add(created_at.date(), action, success, user_id, ip_address)
+
+    def apply(self, cursor):
+        """Merge the accumulated groups into auth_audit_daily_rollup (no commit)"""
+        if not self.groups:
+            return
+        # A fixed lock order keeps concurrent writers from deadlocking
+        keys = sorted(self.groups)
+        execute_values(cursor, """
+            INSERT INTO auth_audit_daily_rollup (day, action, success)
+            VALUES %s
+            ON CONFLICT (day, action, success) DO NOTHING
+        """, keys)
+        cursor.execute("""
+            SELECT day, action, success, user_sketch, ip_sketch
+            FROM auth_audit_daily_rollup
+            WHERE (day, action, success) IN %s
+            ORDER BY day, action, success
+            FOR UPDATE
+        """, (tuple(keys),))
+
+        updates = []
+        for row in cursor.fetchall():
+            key = (row['day'], row['action'], row['success'])
+            event_count, users, ips = self.groups[key]
+            if row['user_sketch'] is not None:
+                users.merge(HyperLogLog.from_bytes(row['user_sketch']))
+            if row['ip_sketch'] is not None:
+                ips.merge(HyperLogLog.from_bytes(row['ip_sketch']))
+            updates.append((row['day'], row['action'], row['success'], event_count,
+                            psycopg2.Binary(users.to_bytes()), psycopg2.Binary(ips.to_bytes())))
+
+        execute_values(cursor, """
+            UPDATE auth_audit_daily_rollup AS r
+            SET event_count = r.event_count + v.event_count,
+                user_sketch = v.user_sketch,
+                ip_sketch = v.ip_sketch,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(day, action, success, event_count, user_sketch, ip_sketch)
+            WHERE r.day = v.day AND r.action = v.action AND r.success = v.success
+        """, updates, template="(%s::date, %s, %s::boolean, %s::bigint, %s::bytea, %s::bytea)")
+        self.groups.clear()
+
+
+def summarize(rows) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Fold rollup rows into the get_audit_statistics shape:
+    per-(action, success) totals with distinct estimates, and per-day totals.
+    """
+    summary: Dict[Tuple[str, bool], List[Any]] = {}
+    daily: Dict[date, Dict[str, Any]] = {}
+    for row in rows:
+        key = (row['action'], row['success'])
+        group = summary.get(key)
+        if group is None:
+            group = summary[key] = [0, HyperLogLog(), HyperLogLog()]
+        group[0] += row['event_count']
+        if row['user_sketch'] is not None:
+            group[1].merge(HyperLogLog.from_bytes(row['user_sketch']))
+        if row['ip_sketch'] is not None:
+            group[2].merge(HyperLogLog.from_bytes(row['ip_sketch']))
+
+        day = daily.setdefault(row['day'], {
+            "date": row['day'],
+            "total_events": 0,
+            "successful_events": 0,
+            "failed_events": 0,
+        })
+        day["total_events"] += row['event_count']
+        day["successful_events" if row['success'] else "failed_events"] += row['event_count']
+
+    stats = [
+        {
+            "action": action,
+            "success": success,
+            "count": event_count,
+            "unique_users": users.count(),
+            "unique_ips": ips.count(),
+        }
+        for (action, success), (event_count, users, ips) in summary.items()
+    ]
+    stats.sort(key=lambda s: s["count"], reverse=True)
+    daily_stats = sorted(daily.values(), key=lambda d: d["date"], reverse=True)
+    return {"summary": stats, "daily_breakdown": daily_stats}
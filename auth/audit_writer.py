@@ -0,0 +1,271 @@
+"""
+Buffered Audit Log Writer for CertCheck
+Moves auth_audit_log INSERTs off the request path into batched background writes
+"""
+
+import os
+import json
+import queue
+import atexit
+import ipaddress
+import threading
+import time
+import logging
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values, RealDictCursor
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+from dotenv import load_dotenv
+
+from db_pool import get_pool
+from audit_rollup import AuditRollup
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# (user_id, user_type, action, ip_address, user_agent, success, details_json, created_at, username)
+AuditRow = Tuple[Optional[int], Optional[str], str, Optional[str], Optional[str], bool, str, datetime, Optional[str]]
+
+INSERT_COLUMNS = "(user_id, user_type, action, ip_address, user_agent, success, details, created_at, username)"
+
+
+class AuditWriter:
+    """
+    Bounded queue of audit rows drained by a background thread.
+
+    Rows are flushed with one multi-row INSERT (execute_values) whenever
+    AUDIT_BATCH_SIZE rows are waiting or AUDIT_FLUSH_INTERVAL_MS has passed,
+    on a pooled connection of its own. enqueue() never blocks, since it is
+    called from async handlers: when the queue is full it wakes the writer
+    for an early flush and drops the row (counted). write_sync() is the durable path for events that must be on disk
+    before the request returns; on the caller's connection it never commits
+    or rolls back the caller's own work (see write_sync). Both paths update
+    auth_audit_daily_rollup in the same transaction as the rows themselves.
+    """
+
+    MAX_FLUSH_ATTEMPTS = 3
+
+    def __init__(self,
+                 queue_size: Optional[int] = None,
+                 batch_size: Optional[int] = None,
+                 flush_interval_ms: Optional[int] = None):
+        self.queue_size = queue_size or int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+        self.batch_size = batch_size or int(os.getenv("AUDIT_BATCH_SIZE", "200"))
+        self.flush_interval = (flush_interval_ms or int(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "250"))) / 1000.0
+
+        self._queue: "queue.Queue[AuditRow]" = queue.Queue(maxsize=self.queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+        self._stats_lock = threading.Lock()
+        self._counters = {
+            "enqueued": 0,
+            "written": 0,
+            "written_sync": 0,
+            "dropped_queue_full": 0,
+            "dropped_write_failed": 0,
+            "batches": 0,
+            "flush_errors": 0,
+        }
+        self._last_flush_ms = 0.0
+
+    def _count(self, name: str, delta: int = 1):
+        with self._stats_lock:
+            self._counters[name] += delta
+
+    def start(self):
+        """Start the background flush thread (idempotent)"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def enqueue(self, row: AuditRow) -> bool:
+        """Queue a row for the next batch; returns False if it had to be dropped"""
+        self.start()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._wakeup.set()
+            self._count("dropped_queue_full")
+            logger.warning("Audit log queue full; dropping event %s", row[2])
+            return False
+        self._count("enqueued")
+        # Wake the writer early once a full batch is waiting
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _drain(self) -> List[AuditRow]:
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_batch(self, rows: List[AuditRow]):
+        start = time.monotonic()
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                execute_values(cursor,
+                               f"INSERT INTO auth_audit_log {INSERT_COLUMNS} VALUES %s",
+                               rows, page_size=len(rows))
+                rollup = AuditRollup()
+                rollup.add_rows(rows)
+                rollup.apply(cursor)
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        with self._stats_lock:
+            self._counters["written"] += len(rows)
+            self._counters["batches"] += 1
+            self._last_flush_ms = (time.monotonic() - start) * 1000
+
+    def flush(self):
+        """Write everything currently queued"""
+        with self._flush_lock:
+            while True:
+                rows = self._drain()
+                if not rows:
+                    return
+                for attempt in range(1, self.MAX_FLUSH_ATTEMPTS + 1):
+                    try:
+                        self._write_batch(rows)
+                        break
+                    except Exception as e:
+                        self._count("flush_errors")
+                        logger.error(f"Audit log batch write failed (attempt {attempt}): {e}")
+                        if attempt == self.MAX_FLUSH_ATTEMPTS:
+                            self._count("dropped_write_failed", len(rows))
+                            return
+                        time.sleep(0.1 * attempt)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the writer and flush what is left"""
+        self._stop.set()
+        self._wakeup.set()
+        self.flush()
+
+    def write_sync(self, row: AuditRow, db_connection=None) -> int:
+        """Durable path: insert the row and return the new log_id.
+
+        Pass the request's connection to write on it; checking a second one out
+        of the pool while holding the first can exhaust the pool under load.
+        With no transaction open on it the row is committed on its own. Inside
+        the caller's transaction it is written under a savepoint and committed
+        with that transaction: the caller's pending work is never committed or
+        rolled back here, so callers that need the event durable commit first.
+        Connections in a failed transaction fall back to the pool.
+        """
+        status = db_connection.get_transaction_status() if db_connection is not None else None
+        if status == TRANSACTION_STATUS_IDLE:
+            log_id = self._insert_sync(db_connection, row)
+        elif status == TRANSACTION_STATUS_INTRANS:
+            log_id = self._insert_in_savepoint(db_connection, row)
+        else:
+            with get_pool().connection() as conn:
+                log_id = self._insert_sync(conn, row)
+        self._count("written_sync")
+        return log_id
+
+    @staticmethod
+    def _insert_row(cursor, row: AuditRow) -> int:
+        cursor.execute(f"""
+            INSERT INTO auth_audit_log {INSERT_COLUMNS}
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING log_id
+        """, row)
+        log_id = cursor.fetchone()['log_id']
+        rollup = AuditRollup()
+        rollup.add_rows([row])
+        rollup.apply(cursor)
+        return log_id
+
+    def _insert_sync(self, conn, row: AuditRow) -> int:
+        """Insert and commit in a transaction of its own (conn has none open)"""
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            log_id = self._insert_row(cursor, row)
+            conn.commit()
+            return log_id
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _insert_in_savepoint(self, conn, row: AuditRow) -> int:
+        """Insert inside the caller's open transaction; a failure undoes only the audit row"""
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute("SAVEPOINT audit_write_sync")
+            try:
+                log_id = self._insert_row(cursor, row)
+            except psycopg2.Error:
+                cursor.execute("ROLLBACK TO SAVEPOINT audit_write_sync")
+                raise
+            cursor.execute("RELEASE SAVEPOINT audit_write_sync")
+            return log_id
+        finally:
+            cursor.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth plus write/drop counters"""
+        with self._stats_lock:
+            return {
+                **self._counters,
+                "queued": self._queue.qsize(),
+                "queue_size": self.queue_size,
+                "batch_size": self.batch_size,
+                "flush_interval_ms": int(self.flush_interval * 1000),
+                "last_flush_ms": round(self._last_flush_ms, 3),
+            }
+
+
+def make_row(user_id: Optional[int], user_type: Optional[str], action: str,
+             ip_address: Optional[str], user_agent: Optional[str], success: bool,
+             details: Dict[str, Any], username: Optional[str] = None) -> AuditRow:
+    """Build an insertable row; created_at is taken now, not at flush time"""
+    # ip_address is an INET column: one unparseable value would fail the whole batch
+    try:
+        ip_address = str(ipaddress.ip_address(ip_address)) if ip_address else None
+    except ValueError:
+        ip_address = None
+    return (user_id, user_type, action, ip_address, user_agent, success,
+            json.dumps(details), datetime.utcnow(), username[:255] if username else None)
+
+
+_audit_writer: Optional[AuditWriter] = None
+_audit_writer_lock = threading.Lock()
+
+
+def get_audit_writer() -> AuditWriter:
+    """Return the process-wide audit writer"""
+    global _audit_writer
+    if _audit_writer is None:
+        with _audit_writer_lock:
+            if _audit_writer is None:
+                _audit_writer = AuditWriter()
+    return _audit_writer
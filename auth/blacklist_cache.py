@@ -0,0 +1,290 @@
+"""
+Token Blacklist Cache for CertCheck
+Answers token revocation checks from memory (or Redis) instead of PostgreSQL
+"""
+
+import os
+import time
+import threading
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Iterable, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+
+from db_pool import get_pool, PoolTimeoutError
+from redis_client import get_redis
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class BlacklistCache:
+    """
+    Versioned copy of the unexpired rows of token_blacklist.
+
+    Nearly every JTI checked is *not* revoked, so the cache holds the complete
+    set of revoked JTIs and answers both positive and negative lookups without
+    I/O. It is kept current three ways:
+
+    - write-through: TokenManager.blacklist_token / revoke_user_tokens call add()
+    - polling: a daemon thread fetches rows revoked since the previous poll
+      every BLACKLIST_REFRESH_SECONDS (covers other processes and services)
+    - pruning: expired entries are dropped on every poll and by prune(), which
+      the token cleanup job calls
+
+    Modes (TOKEN_BLACKLIST_CACHE):
+    - local: per-process dict (default)
+    - redis: entries live in the Celery Redis instance so every uvicorn worker
+      sees a write-through revocation immediately; keys expire with the token
+    - off:   every check queries PostgreSQL
+
+    Until the set has been loaded, when Redis is unreachable, or when no poll
+    has succeeded for 3x BLACKLIST_REFRESH_SECONDS (at least 15 s), lookups
+    fall through to the table and count as misses.
+    """
+
+    # Re-read rows revoked this long before the last high-water mark, since
+    # revoked_at is the inserting transaction's start time, not its commit time
+    POLL_OVERLAP = timedelta(seconds=60)
+
+    REDIS_PREFIX = "token_blacklist:"
+    REDIS_SYNCED_KEY = "token_blacklist:synced"
+
+    def __init__(self, mode: Optional[str] = None, refresh_interval: Optional[float] = None):
+        self.mode = (mode or os.getenv("TOKEN_BLACKLIST_CACHE", "local")).lower()
+        self.refresh_interval = (refresh_interval if refresh_interval is not None
+                                 else float(os.getenv("BLACKLIST_REFRESH_SECONDS", "5")))
+        self._entries: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self._high_water: Optional[datetime] = None
+        self._loaded = False
+        # time.monotonic() of the last successful poll; local answers expire with it
+        self._refreshed_at: Optional[float] = None
+        # Set when a poll could not be written to Redis: the next sync sends every entry
+        self._redis_stale = False
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._redis = get_redis() if self.mode == "redis" else None
+        if self.mode == "redis" and self._redis is None:
+            logger.warning("TOKEN_BLACKLIST_CACHE=redis but Redis is unavailable; using local mode")
+            self.mode = "local"
+
+        # Hit/miss counters: a hit is answered without touching PostgreSQL
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revoked_hits = 0
+        self.redis_errors = 0
+
+    def start(self):
+        """Start the background refresh thread (idempotent)"""
+        if self._thread is not None or self.mode == "off":
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="blacklist-cache", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background refresh thread"""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Blacklist cache refresh failed: {e}")
+            self._stop.wait(self.refresh_interval)
+
+    def refresh(self):
+        """Pull newly revoked JTIs and drop expired ones"""
+        since = self._high_water - self.POLL_OVERLAP if self._high_water else None
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Track the high-water mark on the database clock, not ours
+                cursor.execute("SELECT LOCALTIMESTAMP AS polled_at")
+                polled_at = cursor.fetchone()['polled_at']
+                if since is None:
+                    cursor.execute("""
+                        SELECT jti, expires_at FROM token_blacklist
+                        WHERE expires_at > CURRENT_TIMESTAMP
+                    """)
+                else:
+                    cursor.execute("""
+                        SELECT jti, expires_at FROM token_blacklist
+                        WHERE expires_at > CURRENT_TIMESTAMP AND revoked_at >= %s
+                    """, (since,))
+                rows = cursor.fetchall()
+                conn.rollback()
+            finally:
+                cursor.close()
+
+        entries = [(row['jti'], row['expires_at']) for row in rows]
+        # Local state first: it is the fallback when Redis is down, so it must
+        # keep polling through an outage
+        with self._lock:
+            for jti, expires_at in entries:
+                self._entries[jti] = expires_at
+            self._high_water = polled_at
+            self._loaded = True
+            self._refreshed_at = time.monotonic()
+        self.prune()
+        if self._redis is not None:
+            if self._redis_stale:
+                with self._lock:
+                    entries = list(self._entries.items())
+            try:
+                self._redis_add(entries)
+                # Marker outlives a few missed polls; if it lapses, checks fall back to the table
+                self._redis.set(self.REDIS_SYNCED_KEY, polled_at.isoformat(),
+                                ex=int(self.max_staleness))
+                self._redis_stale = False
+            except Exception as e:
+                self._redis_stale = True
+                self._count(redis_errors=1)
+                logger.warning(f"Failed to sync blacklist entries to Redis: {e}")
+
+    @property
+    def max_staleness(self) -> float:
+        """Seconds a poll vouches for the cached set; outlives a few missed polls"""
+        return max(self.refresh_interval * 3, 15)
+
+    def _redis_add(self, entries: Iterable[Tuple[str, datetime]]):
+        """Store entries in Redis, each expiring with its token"""
+        now = datetime.utcnow()
+        pipe = self._redis.pipeline(transaction=False)
+        for jti, expires_at in entries:
+            ttl = int((expires_at - now).total_seconds())
+            if ttl > 0:
+                pipe.set(f"{self.REDIS_PREFIX}{jti}", 1, ex=ttl)
+        pipe.execute()
+
+    def add(self, jti: str, expires_at: datetime):
+        """Write-through a revocation so it takes effect before the next poll"""
+        with self._lock:
+            self._entries[jti] = expires_at
+        if self._redis is not None:
+            try:
+                self._redis_add([(jti, expires_at)])
+            except Exception as e:
+                self._count(redis_errors=1)
+                logger.warning(f"Failed to write blacklist entry to Redis: {e}")
+
+    def add_many(self, entries: Iterable[Tuple[str, datetime]]):
+        """Write-through several revocations"""
+        for jti, expires_at in entries:
+            self.add(jti, expires_at)
+
+    def prune(self) -> int:
+        """Drop expired entries (Redis keys expire on their own)"""
+        # expires_at is written as naive UTC (datetime.utcnow()) by TokenManager
+        now = datetime.utcnow()
+        with self._lock:
+            expired = [jti for jti, expires_at in self._entries.items() if expires_at <= now]
+            for jti in expired:
+                del self._entries[jti]
+        return len(expired)
+
+    def _query_blacklist(self, jti: str, db_connection=None) -> bool:
+        """Direct table lookup, on the caller's connection if it has one"""
+        query = """
+            SELECT 1 FROM token_blacklist
+            WHERE jti = %s AND expires_at > CURRENT_TIMESTAMP
+        """
+        if db_connection is not None:
+            cursor = db_connection.cursor()
+            try:
+                cursor.execute(query, (jti,))
+                return cursor.fetchone() is not None
+            finally:
+                cursor.close()
+        with get_pool().connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, (jti,))
+                found = cursor.fetchone() is not None
+                conn.rollback()
+                return found
+            finally:
+                cursor.close()
+
+    def _cached_lookup(self, jti: str) -> Optional[bool]:
+        """Answer from the cache, or None if the cache can't answer authoritatively"""
+        if self.mode == "off":
+            return None
+        if self._redis is not None:
+            try:
+                synced, revoked = self._redis.pipeline(transaction=False) \
+                    .exists(self.REDIS_SYNCED_KEY) \
+                    .exists(f"{self.REDIS_PREFIX}{jti}") \
+                    .execute()
+                if synced:
+                    return bool(revoked)
+            except Exception as e:
+                self._count(redis_errors=1)
+                logger.warning(f"Redis blacklist lookup failed: {e}")
+        # Without a recent poll the set may be missing revocations made elsewhere
+        if not self._loaded or time.monotonic() - self._refreshed_at > self.max_staleness:
+            return None
+        expires_at = self._entries.get(jti)
+        return expires_at is not None and expires_at > datetime.utcnow()
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def is_blacklisted(self, jti: str, db_connection=None) -> bool:
+        """Check if a JTI has been revoked"""
+        self.start()
+        revoked = self._cached_lookup(jti)
+        if revoked is not None:
+            self._count(hits=1, revoked_hits=1 if revoked else 0)
+            return revoked
+
+        self._count(misses=1)
+        try:
+            return self._query_blacklist(jti, db_connection)
+        except (psycopg2.Error, PoolTimeoutError) as e:
+            raise Exception(f"Failed to check token blacklist: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and cache size"""
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "loaded": self._loaded,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "revoked_hits": self.revoked_hits,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "redis_errors": self.redis_errors,
+                "last_poll": self._high_water.isoformat() if self._high_water else None,
+                "seconds_since_refresh": (round(time.monotonic() - self._refreshed_at, 1)
+                                          if self._refreshed_at is not None else None),
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_blacklist_cache: Optional[BlacklistCache] = None
+_blacklist_cache_lock = threading.Lock()
+
+
+def get_blacklist_cache() -> BlacklistCache:
+    """Return the process-wide blacklist cache"""
+    global _blacklist_cache
+    if _blacklist_cache is None:
+        with _blacklist_cache_lock:
+            if _blacklist_cache is None:
+                _blacklist_cache = BlacklistCache()
+    return _blacklist_cache
@@ -89,6 +89,10 @@ class CleanupManager:
         try:
             logger.info("Starting audit log cleanup...")
             
+            partitions_created = self.audit_logger.ensure_partitions()
+            if partitions_created:
+                logger.info(f"Created {partitions_created} audit log partitions")
+            
             audit_logs_cleaned = self.audit_logger.cleanup_old_logs()
             logger.info(f"Cleaned up {audit_logs_cleaned} old audit log entries")
             
@@ -98,6 +102,20 @@ class CleanupManager:
             logger.error(f"Error during audit log cleanup: {e}")
             return 0
     
+    def rebuild_audit_rollups(self, days: int = 30):
+        """Recompute auth_audit_daily_rollup from the raw audit log"""
+        try:
+            logger.info(f"Rebuilding audit rollups for the last {days} days...")
+            
+            groups = self.audit_logger.rebuild_rollups(days)
+            logger.info(f"Rebuilt {groups} audit rollup rows")
+            
+            return groups
+            
+        except Exception as e:
+            logger.error(f"Error during audit rollup rebuild: {e}")
+            return 0
+    
     def cleanup_account_locks(self):
         """Unlock accounts that have exceeded their lockout period"""
         try:
@@ -240,7 +258,7 @@ class CleanupManager:
             # Old audit logs
             cursor.execute("""
                 SELECT COUNT(*) as count FROM auth_audit_log 
-                WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '90 days'
+                WHERE created_at < LOCALTIMESTAMP - INTERVAL '90 days'
             """)
             stats["old_audit_logs"] = cursor.fetchone()["count"]
             
@@ -353,8 +371,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="CertCheck Cleanup Jobs")
     parser.add_argument("--mode", choices=["run", "schedule", "stats"], default="run",
                        help="Mode: run (one-time), schedule (background), or stats (show statistics)")
-    parser.add_argument("--type", choices=["full", "quick", "audit"], default="full",
-                       help="Type of cleanup to run")
+    parser.add_argument("--type", choices=["full", "quick", "audit", "rollup"], default="full",
+                       help="Type of cleanup to run (rollup: rebuild audit statistics rollups)")
+    parser.add_argument("--days", type=int, default=30,
+                       help="Days of audit rollups to rebuild (with --type rollup)")
     
     args = parser.parse_args()
     
@@ -368,6 +388,8 @@ if __name__ == "__main__":
                 run_quick_cleanup()
             elif args.type == "audit":
                 run_audit_cleanup()
+            elif args.type == "rollup":
+                cleanup_manager.rebuild_audit_rollups(args.days)
         finally:
             cleanup_manager.close()
     
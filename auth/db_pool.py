@@ -0,0 +1,259 @@
+"""
+Shared Database Connection Pool for CertCheck
+Pooled PostgreSQL connections with statement timeouts, health checks and saturation metrics
+"""
+
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Optional, Dict, Any
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection became free within the acquire timeout"""
+    pass
+
+
+class DatabasePool:
+    """
+    Process-wide pool of psycopg2 connections.
+
+    Checkout is bounded by a semaphore sized to maxconn, so callers queue for a
+    free connection instead of the underlying pool raising PoolError. Every
+    connection is opened with a server-side statement_timeout, and connections
+    that have sat idle longer than the health check interval are pinged before
+    being handed out.
+    """
+
+    def __init__(self,
+                 minconn: Optional[int] = None,
+                 maxconn: Optional[int] = None,
+                 statement_timeout_ms: Optional[int] = None,
+                 acquire_timeout: Optional[float] = None,
+                 health_check_interval: Optional[float] = None):
+        self.minconn = minconn if minconn is not None else int(os.getenv("DB_MIN_CONN", "1"))
+        self.maxconn = maxconn if maxconn is not None else int(os.getenv("DB_MAX_CONN", "10"))
+        self.statement_timeout_ms = (statement_timeout_ms if statement_timeout_ms is not None
+                                     else int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000")))
+        self.acquire_timeout = (acquire_timeout if acquire_timeout is not None
+                                else float(os.getenv("DB_POOL_TIMEOUT", "30")))
+        self.health_check_interval = (health_check_interval if health_check_interval is not None
+                                      else float(os.getenv("DB_HEALTH_CHECK_INTERVAL", "30")))
+
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._init_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.maxconn)
+        self._last_used: Dict[int, float] = {}
+
+        # Saturation metrics
+        self._stats_lock = threading.Lock()
+        self._in_use = 0
+        self._waiting = 0
+        self._acquired_total = 0
+        self._timeouts_total = 0
+        self._discarded_total = 0
+        self._wait_seconds_total = 0.0
+        self._max_wait_seconds = 0.0
+
+    def _ensure_pool(self) -> ThreadedConnectionPool:
+        """Create the underlying pool on first use"""
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = ThreadedConnectionPool(
+                        minconn=self.minconn,
+                        maxconn=self.maxconn,
+                        dbname=os.getenv("DB_NAME"),
+                        user=os.getenv("DB_USER"),
+                        password=os.getenv("DB_PASSWORD"),
+                        host=os.getenv("DB_HOST"),
+                        port=os.getenv("DB_PORT"),
+                        options=f"-c statement_timeout={self.statement_timeout_ms}",
+                        cursor_factory=RealDictCursor,
+                    )
+        return self._pool
+
+    def _is_healthy(self, conn) -> bool:
+        """Ping connections that have been idle longer than the health check interval"""
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: Optional[float] = None):
+        """Check out a healthy connection, waiting up to timeout seconds for a free slot"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+
+        with self._stats_lock:
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=timeout)
+        finally:
+            with self._stats_lock:
+                self._waiting -= 1
+
+        waited = time.monotonic() - start
+        if not acquired:
+            with self._stats_lock:
+                self._timeouts_total += 1
+            logger.warning(f"Database pool exhausted: no connection free after {waited:.2f}s "
+                           f"(max {self.maxconn})")
+            raise PoolTimeoutError(f"No database connection available after {waited:.2f}s")
+
+        try:
+            pool = self._ensure_pool()
+            conn = pool.getconn()
+            while not self._is_healthy(conn):
+                self._last_used.pop(id(conn), None)
+                pool.putconn(conn, close=True)
+                with self._stats_lock:
+                    self._discarded_total += 1
+                conn = pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._in_use += 1
+            self._acquired_total += 1
+            self._wait_seconds_total += waited
+            self._max_wait_seconds = max(self._max_wait_seconds, waited)
+        return conn
+
+    def putconn(self, conn, close: bool = False):
+        """Return a connection to the pool; broken connections are closed instead"""
+        try:
+            close = close or conn.closed != 0
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._ensure_pool().putconn(conn, close=close)
+        finally:
+            with self._stats_lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """Context manager yielding a pooled connection"""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except psycopg2.InterfaceError:
+            self.putconn(conn, close=True)
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self.putconn(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool saturation metrics"""
+        with self._stats_lock:
+            acquired = self._acquired_total
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "available": self.maxconn - self._in_use,
+                "waiting": self._waiting,
+                "utilization": round(self._in_use / self.maxconn, 3) if self.maxconn else 0.0,
+                "acquired_total": acquired,
+                "timeouts_total": self._timeouts_total,
+                "discarded_total": self._discarded_total,
+                "avg_wait_ms": round(self._wait_seconds_total / acquired * 1000, 3) if acquired else 0.0,
+                "max_wait_ms": round(self._max_wait_seconds * 1000, 3),
+                "statement_timeout_ms": self.statement_timeout_ms,
+            }
+
+    def health_check(self) -> Dict[str, Any]:
+        """Round-trip a query through the pool and report latency alongside pool stats"""
+        start = time.monotonic()
+        try:
+            with self.connection(timeout=min(self.acquire_timeout, 5.0)) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            healthy = True
+            error = None
+        except (psycopg2.Error, PoolTimeoutError) as e:
+            healthy = False
+            error = str(e)
+        return {
+            "healthy": healthy,
+            "latency_ms": round((time.monotonic() - start) * 1000, 3),
+            "error": error,
+            "pool": self.stats(),
+        }
+
+    def close(self):
+        """Close every connection held by the pool"""
+        with self._init_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+
+_default_pool: Optional[DatabasePool] = None
+_default_pool_lock = threading.Lock()
+
+
+def get_pool() -> DatabasePool:
+    """Return the process-wide database pool"""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = DatabasePool()
+    return _default_pool
+
+
+def get_db():
+    """FastAPI dependency yielding a pooled connection.
+
+    This is a plain generator, so FastAPI runs checkout and return in its
+    threadpool rather than on the event loop.
+    """
+    pool = get_pool()
+    try:
+        conn = pool.getconn()
+    except PoolTimeoutError as e:
+        raise HTTPException(status_code=503, detail=f"Database busy, please retry: {e}")
+    except psycopg2.Error as e:
+        raise HTTPException(status_code=500, detail=f"Error connecting to database: {e}")
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+def close_pool():
+    """Close the process-wide pool (for shutdown hooks)"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is not None:
+            _default_pool.close()
+            _default_pool = None
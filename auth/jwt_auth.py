@@ -0,0 +1,151 @@
+"""
+Local JWT Authentication for CertCheck services
+Verifies access tokens in-process instead of calling the login service's /user/me
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from fastapi import HTTPException, status
+from jose import JWTError, jwt
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+from db_pool import get_pool
+from blacklist_cache import get_blacklist_cache
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class JWTAuthenticator:
+    """
+    Verifies access tokens issued by TokenManager (and the legacy login API).
+
+    Signature, expiry and revocation are checked locally: the revoked JTIs come
+    from the process-wide BlacklistCache. Current tokens carry user_id and
+    username claims, so no database lookup is needed; tokens issued before
+    those claims existed are resolved once against the users table and the
+    result is cached for USER_CLAIMS_CACHE_TTL seconds.
+    """
+
+    def __init__(self,
+                 secret_key: Optional[str] = None,
+                 algorithm: Optional[str] = None,
+                 user_cache_ttl: Optional[float] = None,
+                 user_cache_size: int = 10000):
+        self.secret_key = secret_key or os.getenv("SECRET_KEY")
+        self.algorithm = algorithm or os.getenv("ALGORITHM", "HS256")
+        self.user_cache_ttl = (user_cache_ttl if user_cache_ttl is not None
+                               else float(os.getenv("USER_CLAIMS_CACHE_TTL", "300")))
+        self.user_cache_size = user_cache_size
+        self.blacklist = get_blacklist_cache()
+        self._user_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._user_cache_lock = threading.Lock()
+
+    def _lookup_user(self, subject: str, db_connection=None) -> Optional[Dict[str, Any]]:
+        """Resolve a legacy token subject (user_id or username) to both identifiers"""
+        now = time.monotonic()
+        with self._user_cache_lock:
+            cached = self._user_cache.get(subject)
+            if cached and cached[0] > now:
+                self._user_cache.move_to_end(subject)
+                return cached[1]
+
+        column = "user_id" if subject.isdigit() else "username"
+        query = f"SELECT user_id, username FROM users WHERE {column} = %s"
+        params = (int(subject) if column == "user_id" else subject,)
+        if db_connection is not None:
+            cursor = db_connection.cursor(cursor_factory=RealDictCursor)
+            try:
+                cursor.execute(query, params)
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
+        else:
+            with get_pool().connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(query, params)
+                    row = cursor.fetchone()
+                    conn.rollback()
+                finally:
+                    cursor.close()
+        if not row:
+            return None
+
+        user = {"user_id": row["user_id"], "username": row["username"]}
+        with self._user_cache_lock:
+            self._user_cache[subject] = (now + self.user_cache_ttl, user)
+            self._user_cache.move_to_end(subject)
+            while len(self._user_cache) > self.user_cache_size:
+                self._user_cache.popitem(last=False)
+        return user
+
+    def authenticate(self, token: str, db_connection=None) -> Optional[Dict[str, Any]]:
+        """Return {"user_id", "username"} for a valid, unrevoked access token, else None
+
+        Lookups that miss the caches run on db_connection when given (the
+        request's own connection), otherwise on a pooled one.
+        """
+        try:
+            payload = jwt.decode(token, self.secret_key, algorithms=[self.algorithm])
+        except JWTError as e:
+            logger.info(f"Rejected token: {e}")
+            return None
+
+        # Password reset links are signed like access tokens but are not sessions
+        if payload.get("purpose") or payload.get("token_type", "access") != "access":
+            return None
+
+        jti = payload.get("jti")
+        if jti and self.blacklist.is_blacklisted(jti, db_connection):
+            return None
+
+        user_id = payload.get("user_id")
+        username = payload.get("username")
+        if user_id is not None and username:
+            return {"user_id": int(user_id), "username": username}
+
+        subject = payload.get("sub")
+        if not subject:
+            return None
+        return self._lookup_user(str(subject), db_connection)
+
+    def require_user(self, token: Optional[str], db_connection=None) -> Dict[str, Any]:
+        """FastAPI-facing wrapper: authenticate or raise 401"""
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        if token is None:
+            logger.error("No token provided in Authorization header")
+            raise credentials_exception
+        try:
+            user = self.authenticate(token, db_connection)
+        except Exception as e:
+            logger.error(f"Error in get_current_user: {str(e)}")
+            raise credentials_exception
+        if user is None:
+            raise credentials_exception
+        return user
+
+
+_authenticator: Optional[JWTAuthenticator] = None
+_authenticator_lock = threading.Lock()
+
+
+def get_authenticator() -> JWTAuthenticator:
+    """Return the process-wide authenticator"""
+    global _authenticator
+    if _authenticator is None:
+        with _authenticator_lock:
+            if _authenticator is None:
+                _authenticator = JWTAuthenticator()
+    return _authenticator
@@ -0,0 +1,170 @@
+"""
+KDF Worker Pool for CertCheck
+Runs password hashing off the event loop on a bounded pool, shedding load when it is full
+"""
+
+import os
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, TypeVar
+
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class KDFPoolSaturated(Exception):
+    """Raised when the KDF queue is already at its depth limit"""
+    pass
+
+
+class KDFPool:
+    """
+    Dedicated thread pool for password hashing (bcrypt and friends).
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism
+    without the pickling cost of a process pool. Work is kept off both the
+    event loop and Starlette's shared threadpool, so a burst of logins cannot
+    starve ordinary requests. At most KDF_POOL_WORKERS jobs run at once and at
+    most KDF_POOL_MAX_QUEUE wait behind them; further submissions are rejected
+    immediately rather than queueing for longer than the client will wait.
+
+    Queue time (submit to start) and compute time (start to finish) are
+    tracked separately so saturation is distinguishable from a slow KDF.
+    """
+
+    SAMPLE_SIZE = 1000
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: Optional[int] = None):
+        # Empty values in the env file mean "use the default"
+        self.max_workers = max_workers or int(os.getenv("KDF_POOL_WORKERS") or os.cpu_count() or 2)
+        self.max_queue = (max_queue if max_queue is not None
+                          else int(os.getenv("KDF_POOL_MAX_QUEUE") or self.max_workers * 8))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="kdf")
+
+        self._lock = threading.Lock()
+        self._pending = 0  # queued + running
+        self._running = 0
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._queue_ms: "deque[float]" = deque(maxlen=self.SAMPLE_SIZE)
+        self._compute_ms: "deque[float]" = deque(maxlen=self.SAMPLE_SIZE)
+
+    def _reserve(self):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise KDFPoolSaturated(
+                    f"KDF pool saturated ({self._pending} pending, limit {self.max_workers + self.max_queue})")
+            self._pending += 1
+            self._submitted += 1
+
+    def _timed(self, fn: Callable[..., T], submitted_at: float, *args) -> T:
+        started_at = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            self._queue_ms.append((started_at - submitted_at) * 1000)
+        ok = False
+        try:
+            result = fn(*args)
+            ok = True
+            return result
+        finally:
+            finished_at = time.perf_counter()
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                self._compute_ms.append((finished_at - started_at) * 1000)
+                if ok:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+
+    def submit(self, fn: Callable[..., T], *args):
+        """Queue fn(*args); raises KDFPoolSaturated if the queue is full"""
+        self._reserve()
+        try:
+            return self._executor.submit(self._timed, fn, time.perf_counter(), *args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    async def run(self, fn: Callable[..., T], *args) -> T:
+        """Run fn(*args) on the pool from async code"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def call(self, fn: Callable[..., T], *args) -> T:
+        """Run fn(*args) on the pool from a worker thread (never from the event loop)"""
+        return self.submit(fn, *args).result()
+
+    @staticmethod
+    def _summary(samples) -> Dict[str, float]:
+        if not samples:
+            return {"avg": 0.0, "p95": 0.0, "max": 0.0}
+        ordered = sorted(samples)
+        return {
+            "avg": round(sum(ordered) / len(ordered), 3),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+            "max": round(ordered[-1], 3),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, rejection counters and queue vs compute time (ms, recent samples)"""
+        with self._lock:
+            queue_ms = list(self._queue_ms)
+            compute_ms = list(self._compute_ms)
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "queue_ms": self._summary(queue_ms),
+                "compute_ms": self._summary(compute_ms),
+            }
+
+    def shutdown(self):
+        """Stop accepting work and wait for running jobs"""
+        self._executor.shutdown(wait=True)
+
+
+_kdf_pool: Optional[KDFPool] = None
+_kdf_pool_lock = threading.Lock()
+
+
+def get_kdf_pool() -> KDFPool:
+    """Return the process-wide KDF pool"""
+    global _kdf_pool
+    if _kdf_pool is None:
+        with _kdf_pool_lock:
+            if _kdf_pool is None:
+                _kdf_pool = KDFPool()
+    return _kdf_pool
+
+
+async def run_kdf(fn: Callable[..., T], *args) -> T:
+    """Run password hashing work on the KDF pool; sheds load with 503 when it is full"""
+    try:
+        return await get_kdf_pool().run(fn, *args)
+    except KDFPoolSaturated as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy, please try again shortly",
+            headers={"Retry-After": "1"},
+        )
@@ -1,8 +1,12 @@
 """
 Rate Limiting System for CertCheck
-Implements sliding window rate limiting using PostgreSQL
+Implements sliding window rate limiting in Redis, with PostgreSQL as a fallback backend
 """
 
+import math
+import time
+import uuid
+import logging
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime, timedelta
@@ -11,21 +15,220 @@ from fastapi import HTTPException, Request
 import os
 from dotenv import load_dotenv
 
+from redis_client import get_redis
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    "user-login": {"limit": 5, "window_minutes": 15},
+    "admin-login": {"limit": 3, "window_minutes": 15},
+    "user-register": {"limit": 3, "window_minutes": 60},
+    "admin-register": {"limit": 2, "window_minutes": 60},
+    "forgot-password": {"limit": 3, "window_minutes": 60},
+    "reset-password": {"limit": 5, "window_minutes": 15},
+    "refresh-token": {"limit": 10, "window_minutes": 15},
+    "default": {"limit": 100, "window_minutes": 15}
+}
+
+# Sliding-window log in one atomic step: drop attempts older than the window,
+# count what is left, and record this attempt only if it is under the limit.
+# Uses the Redis server clock so every worker agrees on "now".
+# Returns {allowed (0/1), remaining, reset_ms, now_ms}.
+SLIDING_WINDOW_LUA = """
+local key = KEYS[1]
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+if count >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    return {0, 0, tonumber(oldest[2]) + window, now}
+end
+redis.call('ZADD', key, now, ARGV[3])
+redis.call('PEXPIRE', key, window)
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+return {1, limit - count - 1, tonumber(oldest[2]) + window, now}
+"""
+
+
+class RedisRateLimitBackend:
+    """True sliding-window counter: one sorted set of attempt timestamps per identifier/endpoint"""
+
+    KEY_PREFIX = "rate_limit:"
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._script = redis_client.register_script(SLIDING_WINDOW_LUA)
+
+    def _key(self, identifier: str, endpoint: str) -> str:
+        return f"{self.KEY_PREFIX}{endpoint}:{identifier}"
+
+    def check(self, identifier: str, endpoint: str, limit: int, window_minutes: int) -> Dict[str, Any]:
+        window_ms = window_minutes * 60 * 1000
+        allowed, remaining, reset_ms, now_ms = self._script(
+            keys=[self._key(identifier, endpoint)],
+            args=[window_ms, limit, uuid.uuid4().hex]
+        )
+        reset_time = datetime.utcfromtimestamp(int(reset_ms) / 1000)
+        if not int(allowed):
+            return {
+                "allowed": False,
+                "remaining": 0,
+                "reset_time": reset_time,
+                "retry_after": max(0, math.ceil((int(reset_ms) - int(now_ms)) / 1000))
+            }
+        return {
+            "allowed": True,
+            "remaining": int(remaining),
+            "reset_time": reset_time,
+            "retry_after": 0
+        }
+
+    def status(self, identifier: str, endpoint: str, limit: int, window_minutes: int) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        now_ms = int((now - datetime(1970, 1, 1)).total_seconds() * 1000)
+        window_ms = window_minutes * 60 * 1000
+        key = self._key(identifier, endpoint)
+        used = self.redis.zcount(key, now_ms - window_ms, "+inf")
+        oldest = self.redis.zrangebyscore(key, now_ms - window_ms, "+inf", start=0, num=1, withscores=True)
+        if oldest:
+            reset_time = datetime.utcfromtimestamp((oldest[0][1] + window_ms) / 1000)
+        else:
+            reset_time = now + timedelta(minutes=window_minutes)
+        return {"used": used, "remaining": max(0, limit - used), "reset_time": reset_time}
+
+    def reset(self, identifier: str, endpoint: str) -> bool:
+        return self.redis.delete(self._key(identifier, endpoint)) > 0
+
+
+class PostgresRateLimitBackend:
+    """Fixed-window counter in the rate_limits table, updated by a single atomic upsert"""
+
+    def __init__(self, rate_limiter: "RateLimiter"):
+        self.rate_limiter = rate_limiter
+
+    @property
+    def db_connection(self):
+        return self.rate_limiter.db_connection
+
+    @staticmethod
+    def _window_start(now: datetime, window_minutes: int) -> datetime:
+        return now.replace(minute=(now.minute // window_minutes) * window_minutes, second=0, microsecond=0)
+
+    def check(self, identifier: str, endpoint: str, limit: int, window_minutes: int) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        window_start = self._window_start(now, window_minutes)
+        expires_at = window_start + timedelta(minutes=window_minutes)
+
+        cursor = self.rate_limiter._get_cursor()
+        try:
+            # Insert-or-increment in one statement; the row lock on conflict
+            # serialises concurrent attempts, and the WHERE stops counting at the limit
+            cursor.execute("""
+                INSERT INTO rate_limits (identifier, endpoint, attempt_count, window_start, expires_at)
+                VALUES (%s, %s, 1, %s, %s)
+                ON CONFLICT (identifier, endpoint, window_start) DO UPDATE
+                SET attempt_count = rate_limits.attempt_count + 1, last_attempt = CURRENT_TIMESTAMP
+                WHERE rate_limits.attempt_count < %s
+                RETURNING attempt_count
+            """, (identifier, endpoint, window_start, expires_at, limit))
+
+            row = cursor.fetchone()
+            self.db_connection.commit()
+
+            if row is None:
+                # Rate limit exceeded
+                retry_after = int((expires_at - now).total_seconds())
+                return {
+                    "allowed": False,
+                    "remaining": 0,
+                    "reset_time": expires_at,
+                    "retry_after": max(0, retry_after)
+                }
+
+            return {
+                "allowed": True,
+                "remaining": limit - row['attempt_count'],
+                "reset_time": expires_at,
+                "retry_after": 0
+            }
+
+        except psycopg2.Error as e:
+            self.db_connection.rollback()
+            raise Exception(f"Failed to check rate limit: {e}")
+        finally:
+            cursor.close()
+
+    def status(self, identifier: str, endpoint: str, limit: int, window_minutes: int) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        window_start = self._window_start(now, window_minutes)
+
+        cursor = self.rate_limiter._get_cursor()
+        try:
+            cursor.execute("""
+                SELECT attempt_count, window_start
+                FROM rate_limits
+                WHERE identifier = %s AND endpoint = %s AND window_start = %s
+            """, (identifier, endpoint, window_start))
+
+            current_record = cursor.fetchone()
+            used = current_record['attempt_count'] if current_record else 0
+            return {
+                "used": used,
+                "remaining": max(0, limit - used),
+                "reset_time": window_start + timedelta(minutes=window_minutes)
+            }
+
+        except psycopg2.Error as e:
+            raise Exception(f"Failed to get rate limit status: {e}")
+        finally:
+            cursor.close()
+
+    def reset(self, identifier: str, endpoint: str) -> bool:
+        cursor = self.rate_limiter._get_cursor()
+        try:
+            cursor.execute("""
+                DELETE FROM rate_limits 
+                WHERE identifier = %s AND endpoint = %s
+            """, (identifier, endpoint))
+
+            self.db_connection.commit()
+            return cursor.rowcount > 0
+
+        except psycopg2.Error as e:
+            self.db_connection.rollback()
+            raise Exception(f"Failed to reset rate limit: {e}")
+        finally:
+            cursor.close()
+
+
+_redis_backend: Optional[RedisRateLimitBackend] = None
+# After a Redis failure, go straight to PostgreSQL for this many seconds
+REDIS_RETRY_SECONDS = 30
+_redis_down_until = 0.0
+
+
+def _get_redis_backend() -> Optional[RedisRateLimitBackend]:
+    """Process-wide Redis backend (the Lua script is registered once)"""
+    global _redis_backend
+    if _redis_backend is None:
+        redis_client = get_redis()
+        if redis_client is not None:
+            _redis_backend = RedisRateLimitBackend(redis_client)
+    return _redis_backend
+
+
 class RateLimiter:
-    def __init__(self, db_connection):
+    def __init__(self, db_connection, backend: Optional[str] = None):
         self.db_connection = db_connection
-        self.default_limits = {
-            "user-login": {"limit": 5, "window_minutes": 15},
-            "admin-login": {"limit": 3, "window_minutes": 15},
-            "user-register": {"limit": 3, "window_minutes": 60},
-            "admin-register": {"limit": 2, "window_minutes": 60},
-            "forgot-password": {"limit": 3, "window_minutes": 60},
-            "reset-password": {"limit": 5, "window_minutes": 15},
-            "refresh-token": {"limit": 10, "window_minutes": 15},
-            "default": {"limit": 100, "window_minutes": 15}
-        }
+        self.default_limits = DEFAULT_LIMITS
+        self.postgres_backend = PostgresRateLimitBackend(self)
+        self.backend_name = (backend or os.getenv("RATE_LIMIT_BACKEND", "redis")).lower()
+        self.redis_backend = _get_redis_backend() if self.backend_name == "redis" else None
     
     def _get_cursor(self):
         """Get database cursor with proper error handling"""
@@ -55,20 +258,16 @@ class RateLimiter:
         """Get rate limit configuration for endpoint"""
         return self.default_limits.get(endpoint, self.default_limits["default"])
     
-    def _cleanup_old_entries(self, identifier: str, endpoint: str):
-        """Clean up old rate limit entries"""
-        cursor = self._get_cursor()
-        try:
-            cursor.execute("""
-                DELETE FROM rate_limits 
-                WHERE identifier = %s AND endpoint = %s AND expires_at < CURRENT_TIMESTAMP
-            """, (identifier, endpoint))
-            self.db_connection.commit()
-        except psycopg2.Error as e:
-            self.db_connection.rollback()
-            raise Exception(f"Failed to cleanup rate limit entries: {e}")
-        finally:
-            cursor.close()
+    def _call_backend(self, method: str, *args):
+        """Run against Redis when configured, falling back to PostgreSQL if Redis fails"""
+        global _redis_down_until
+        if self.redis_backend is not None and time.monotonic() >= _redis_down_until:
+            try:
+                return getattr(self.redis_backend, method)(*args)
+            except Exception as e:
+                _redis_down_until = time.monotonic() + REDIS_RETRY_SECONDS
+                logger.warning(f"Redis rate limiter unavailable, using PostgreSQL for {REDIS_RETRY_SECONDS}s: {e}")
+        return getattr(self.postgres_backend, method)(*args)
     
     def check_rate_limit(self, request: Request, endpoint: str, user_id: Optional[int] = None) -> Dict[str, Any]:
         """
@@ -82,76 +281,7 @@ class RateLimiter:
         """
         identifier = self._get_identifier(request, user_id)
         config = self._get_rate_limit_config(endpoint)
-        limit = config["limit"]
-        window_minutes = config["window_minutes"]
-        
-        cursor = self._get_cursor()
-        try:
-            # Clean up old entries first
-            self._cleanup_old_entries(identifier, endpoint)
-            
-            # Get current window start time
-            now = datetime.utcnow()
-            window_start = now.replace(minute=(now.minute // window_minutes) * window_minutes, second=0, microsecond=0)
-            expires_at = window_start + timedelta(minutes=window_minutes)
-            
-            # Check current attempts in this window
-            cursor.execute("""
-                SELECT attempt_count, window_start
-                FROM rate_limits
-                WHERE identifier = %s AND endpoint = %s AND window_start = %s
-            """, (identifier, endpoint, window_start))
-            
-            current_record = cursor.fetchone()
-            
-            if current_record:
-                # Update existing record
-                current_attempts = current_record['attempt_count']
-                
-                if current_attempts >= limit:
-                    # Rate limit exceeded
-                    reset_time = current_record['window_start'] + timedelta(minutes=window_minutes)
-                    retry_after = int((reset_time - now).total_seconds())
-                    
-                    return {
-                        "allowed": False,
-                        "remaining": 0,
-                        "reset_time": reset_time,
-                        "retry_after": max(0, retry_after)
-                    }
-                
-                # Increment attempt count
-                cursor.execute("""
-                    UPDATE rate_limits 
-                    SET attempt_count = attempt_count + 1, last_attempt = CURRENT_TIMESTAMP
-                    WHERE identifier = %s AND endpoint = %s AND window_start = %s
-                """, (identifier, endpoint, window_start))
-                
-                remaining = limit - current_attempts - 1
-                
-            else:
-                # Create new record
-                cursor.execute("""
-                    INSERT INTO rate_limits (identifier, endpoint, attempt_count, window_start, expires_at)
-                    VALUES (%s, %s, 1, %s, %s)
-                """, (identifier, endpoint, window_start, expires_at))
-                
-                remaining = limit - 1
-            
-            self.db_connection.commit()
-            
-            return {
-                "allowed": True,
-                "remaining": remaining,
-                "reset_time": expires_at,
-                "retry_after": 0
-            }
-            
-        except psycopg2.Error as e:
-            self.db_connection.rollback()
-            raise Exception(f"Failed to check rate limit: {e}")
-        finally:
-            cursor.close()
+        return self._call_backend("check", identifier, endpoint, config["limit"], config["window_minutes"])
     
     def get_rate_limit_status(self, request: Request, endpoint: str, user_id: Optional[int] = None) -> Dict[str, Any]:
         """Get current rate limit status without incrementing counter"""
@@ -160,63 +290,22 @@ class RateLimiter:
         limit = config["limit"]
         window_minutes = config["window_minutes"]
         
-        cursor = self._get_cursor()
-        try:
-            now = datetime.utcnow()
-            window_start = now.replace(minute=(now.minute // window_minutes) * window_minutes, second=0, microsecond=0)
-            
-            cursor.execute("""
-                SELECT attempt_count, window_start
-                FROM rate_limits
-                WHERE identifier = %s AND endpoint = %s AND window_start = %s
-            """, (identifier, endpoint, window_start))
-            
-            current_record = cursor.fetchone()
-            
-            if current_record:
-                current_attempts = current_record['attempt_count']
-                remaining = max(0, limit - current_attempts)
-                reset_time = current_record['window_start'] + timedelta(minutes=window_minutes)
-            else:
-                current_attempts = 0
-                remaining = limit
-                reset_time = window_start + timedelta(minutes=window_minutes)
-            
-            return {
-                "limit": limit,
-                "remaining": remaining,
-                "used": current_attempts,
-                "reset_time": reset_time,
-                "window_minutes": window_minutes
-            }
-            
-        except psycopg2.Error as e:
-            raise Exception(f"Failed to get rate limit status: {e}")
-        finally:
-            cursor.close()
+        status = self._call_backend("status", identifier, endpoint, limit, window_minutes)
+        return {
+            "limit": limit,
+            "remaining": status["remaining"],
+            "used": status["used"],
+            "reset_time": status["reset_time"],
+            "window_minutes": window_minutes
+        }
     
     def reset_rate_limit(self, request: Request, endpoint: str, user_id: Optional[int] = None) -> bool:
         """Reset rate limit for identifier (admin function)"""
         identifier = self._get_identifier(request, user_id)
-        
-        cursor = self._get_cursor()
-        try:
-            cursor.execute("""
-                DELETE FROM rate_limits 
-                WHERE identifier = %s AND endpoint = %s
-            """, (identifier, endpoint))
-            
-            self.db_connection.commit()
-            return cursor.rowcount > 0
-            
-        except psycopg2.Error as e:
-            self.db_connection.rollback()
-            raise Exception(f"Failed to reset rate limit: {e}")
-        finally:
-            cursor.close()
+        return self._call_backend("reset", identifier, endpoint)
     
     def cleanup_expired_limits(self) -> int:
-        """Clean up expired rate limit entries"""
+        """Clean up expired rate limit entries (Redis keys expire on their own)"""
         cursor = self._get_cursor()
         try:
             cursor.execute("DELETE FROM rate_limits WHERE expires_at < CURRENT_TIMESTAMP")
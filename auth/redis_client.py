@@ -0,0 +1,68 @@
+"""
+Shared Redis Client for CertCheck auth modules
+Connects to REDIS_URL, falling back to the Redis instance Celery already uses
+"""
+
+import os
+import threading
+import logging
+from typing import Optional
+from urllib.parse import urlparse, parse_qs
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+try:
+    from redis import Redis
+except ImportError:  # redis is optional for services that never enable a Redis mode
+    Redis = None
+
+_redis_client = None
+_redis_lock = threading.Lock()
+
+
+def get_redis_url() -> Optional[str]:
+    """REDIS_URL if set, otherwise the Celery broker URL"""
+    return os.getenv("REDIS_URL") or os.getenv("CELERY_BROKER_URL")
+
+
+def _build_client(url: str):
+    """Build a client the same way tasks_scheduling/tasks.py does for rediss:// broker URLs"""
+    parsed_url = urlparse(url)
+    query = parse_qs(parsed_url.query)
+    kwargs = {
+        "host": parsed_url.hostname,
+        "port": parsed_url.port or 6379,
+        "username": parsed_url.username,
+        "password": parsed_url.password,
+        "db": parsed_url.path.strip('/') or '0',
+        "decode_responses": True,
+        # Auth checks sit on the request path: fail fast and fall back rather than hang
+        "socket_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5")),
+        "socket_connect_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5")),
+    }
+    if parsed_url.scheme == "rediss":
+        kwargs.update({
+            "ssl": True,
+            "ssl_cert_reqs": query.get("ssl_cert_reqs", ["required"])[0],
+            "ssl_ca_certs": query.get("ssl_ca_certs", ["/etc/ssl/certs/aws-global-bundle.pem"])[0],
+            "ssl_check_hostname": query.get("ssl_check_hostname", ["false"])[0].lower() == "true",
+        })
+    return Redis(**kwargs)
+
+
+def get_redis():
+    """Return the process-wide Redis client, or None if Redis is unavailable or unconfigured"""
+    global _redis_client
+    if _redis_client is None:
+        with _redis_lock:
+            if _redis_client is None:
+                url = get_redis_url()
+                if Redis is None or not url:
+                    logger.warning("Redis requested but the redis package or REDIS_URL/CELERY_BROKER_URL is missing")
+                    return None
+                _redis_client = _build_client(url)
+    return _redis_client
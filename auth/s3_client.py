@@ -0,0 +1,107 @@
+"""
+Shared S3 client for CertCheck services
+One process-wide boto3 client with a sized connection pool, and a helper to run its
+blocking calls off the event loop
+"""
+import os
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+import boto3                                    # type: ignore
+from botocore.config import Config              # type: ignore
+from dotenv import load_dotenv                  # type: ignore
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "50"))
+
+_s3_client = None
+_s3_executor: Optional[ThreadPoolExecutor] = None
+_s3_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Return the process-wide S3 client.
+
+    boto3 clients are thread-safe, so one client (one credential resolution,
+    one keep-alive connection pool of S3_MAX_POOL_CONNECTIONS) serves every
+    request. S3_ENDPOINT_URL points it at MinIO or moto for local runs.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_lock:
+            if _s3_client is None:
+                _s3_client = boto3.client(
+                    "s3",
+                    config=Config(
+                        signature_version="s3v4",
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True,
+                        retries={"max_attempts": 3, "mode": "standard"},
+                    ),
+                    region_name=os.getenv("S3_REGION", "eu-north-1"),
+                    endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+                    aws_access_key_id=os.getenv("AWS_ACCESS_KEY"),
+                    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                )
+    return _s3_client
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Threads for blocking S3 calls, one per pooled connection"""
+    global _s3_executor
+    if _s3_executor is None:
+        with _s3_lock:
+            if _s3_executor is None:
+                _s3_executor = ThreadPoolExecutor(max_workers=S3_MAX_POOL_CONNECTIONS,
+                                                  thread_name_prefix="s3")
+    return _s3_executor
+
+
+async def s3_call(fn, *args, **kwargs):
+    """
+    Run a blocking S3 client call on the S3 executor.
+
+    A dedicated executor keeps slow S3 traffic from occupying Starlette's
+    shared threadpool, which sync dependencies such as get_db also use.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(fn, *args, **kwargs))
+
+
+def download_to_file(bucket: str, key: str, fileobj, max_bytes: Optional[int] = None,
+                     chunk_size: int = 1024 * 1024) -> int:
+    """
+    Stream an object into fileobj in chunks (blocking; run in a thread).
+
+    Raises ValueError without reading the body if the object is larger than
+    max_bytes. Returns the number of bytes written.
+    """
+    response = get_s3_client().get_object(Bucket=bucket, Key=key)
+    body = response["Body"]
+    try:
+        if max_bytes is not None and response["ContentLength"] > max_bytes:
+            raise ValueError(f"Object is larger than {max_bytes} bytes")
+        written = 0
+        for chunk in body.iter_chunks(chunk_size):
+            fileobj.write(chunk)
+            written += len(chunk)
+        return written
+    finally:
+        body.close()
+
+
+def close_s3():
+    """Shut down the S3 executor (for shutdown hooks)"""
+    global _s3_executor
+    with _s3_lock:
+        if _s3_executor is not None:
+            _s3_executor.shutdown(wait=False)
+            _s3_executor = None
@@ -4,6 +4,9 @@ Handles JWT tokens, refresh tokens, and blacklisting using PostgreSQL
 """
 
 import uuid
+import hmac
+import hashlib
+import secrets
 import bcrypt
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, Tuple
@@ -13,6 +16,9 @@ from psycopg2.extras import RealDictCursor
 import os
 from dotenv import load_dotenv
 
+from blacklist_cache import get_blacklist_cache
+from kdf_pool import get_kdf_pool, KDFPoolSaturated
+
 load_dotenv()
 
 class TokenManager:
@@ -22,6 +28,12 @@ class TokenManager:
         self.algorithm = os.getenv("ALGORITHM", "HS256")
         self.access_token_expire_minutes = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 15))
         self.refresh_token_expire_days = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+        # Key for the refresh token verifier HMAC; falls back to the JWT secret
+        self.refresh_token_pepper = (os.getenv("REFRESH_TOKEN_PEPPER") or self.secret_key or "").encode('utf-8')
+        # Accept pre-selector (bcrypt-hashed) refresh tokens until they have all expired
+        self.legacy_refresh_tokens = os.getenv("REFRESH_TOKEN_LEGACY_FALLBACK", "true").lower() == "true"
+        # Process-wide revocation cache in front of token_blacklist
+        self.blacklist_cache = get_blacklist_cache()
     
     def _get_cursor(self):
         """Get database cursor with proper error handling"""
@@ -30,30 +42,54 @@ class TokenManager:
         except psycopg2.Error as e:
             raise Exception(f"Database connection error: {e}")
     
-    def _hash_refresh_token(self, token: str) -> str:
-        """Hash refresh token for secure storage"""
-        token_bytes = token.encode('utf-8')
-        salt = bcrypt.gensalt()
-        hashed = bcrypt.hashpw(token_bytes, salt)
-        return hashed.decode('utf-8')
+    def _hash_refresh_token(self, verifier: str) -> str:
+        """Hash the verifier half of a refresh token for secure storage.
+
+        The verifier is 256 bits of randomness, so a keyed HMAC-SHA256 is
+        enough; a slow KDF only matters for low-entropy secrets like passwords.
+        """
+        return hmac.new(self.refresh_token_pepper, verifier.encode('utf-8'), hashlib.sha256).hexdigest()
+    
+    def _verify_refresh_token(self, verifier: str, hashed_token: str) -> bool:
+        """Verify refresh token verifier against stored hash in constant time"""
+        return hmac.compare_digest(self._hash_refresh_token(verifier), hashed_token)
     
-    def _verify_refresh_token(self, token: str, hashed_token: str) -> bool:
-        """Verify refresh token against stored hash"""
+    def _verify_legacy_refresh_token(self, token: str, hashed_token: str) -> bool:
+        """Verify a legacy (pre-selector) refresh token against its bcrypt hash.
+
+        Runs on the KDF pool; call from a worker thread, not the event loop.
+        """
         try:
             token_bytes = token.encode('utf-8')
             hashed_bytes = hashed_token.encode('utf-8')
-            return bcrypt.checkpw(token_bytes, hashed_bytes)
+            return get_kdf_pool().call(bcrypt.checkpw, token_bytes, hashed_bytes)
+        except KDFPoolSaturated:
+            raise
         except Exception:
             return False
     
-    def create_access_token(self, user_id: int, user_type: str, additional_claims: Dict[str, Any] = None) -> str:
-        """Create a new access token with JTI for tracking"""
+    @staticmethod
+    def _split_refresh_token(token: str) -> Tuple[Optional[str], Optional[str]]:
+        """Split a "selector.verifier" refresh token; legacy tokens have no selector"""
+        selector, sep, verifier = token.partition('.')
+        if not sep or not selector or not verifier:
+            return None, None
+        return selector, verifier
+    
+    def create_access_token(self, user_id: int, user_type: str, additional_claims: Dict[str, Any] = None,
+                            username: str = None) -> str:
+        """Create a new access token with JTI for tracking.
+
+        user_id and username are embedded as claims so other services can
+        authenticate the token locally (see jwt_auth.JWTAuthenticator).
+        """
         jti = str(uuid.uuid4())
         now = datetime.utcnow()
         expire = now + timedelta(minutes=self.access_token_expire_minutes)
         
         payload = {
             "sub": str(user_id),
+            "user_id": user_id,
             "type": user_type,
             "token_type": "access",
             "jti": jti,
@@ -61,31 +97,43 @@ class TokenManager:
             "exp": expire
         }
         
+        if username:
+            payload["username"] = username
+        
         if additional_claims:
             payload.update(additional_claims)
         
         return jwt.encode(payload, self.secret_key, algorithm=self.algorithm)
     
-    def create_refresh_token(self, user_id: int, user_type: str, ip_address: str = None, user_agent: str = None) -> str:
-        """Create a new refresh token and store it in database"""
+    def create_refresh_token(self, user_id: int, user_type: str, ip_address: str = None, user_agent: str = None,
+                             commit: bool = True) -> str:
+        """Create a new refresh token and store it in database.
+
+        With commit=False the INSERT joins the caller's open transaction and
+        the caller commits.
+        """
         jti = str(uuid.uuid4())
         now = datetime.utcnow()
         expire = now + timedelta(days=self.refresh_token_expire_days)
         
-        # Generate refresh token
-        refresh_token = str(uuid.uuid4()) + str(uuid.uuid4())  # 64 character token
-        token_hash = self._hash_refresh_token(refresh_token)
+        # Generate refresh token as "selector.verifier": the selector is an
+        # indexed lookup key, only the verifier is secret
+        selector = secrets.token_hex(12)
+        verifier = secrets.token_urlsafe(32)
+        refresh_token = f"{selector}.{verifier}"
+        token_hash = self._hash_refresh_token(verifier)
         
         # Store in database
         cursor = self._get_cursor()
         try:
             cursor.execute("""
-                INSERT INTO refresh_tokens (user_id, user_type, token_hash, jti, expires_at, ip_address, user_agent)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                INSERT INTO refresh_tokens (user_id, user_type, selector, token_hash, jti, expires_at, ip_address, user_agent)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                 RETURNING token_id
-            """, (user_id, user_type, token_hash, jti, expire, ip_address, user_agent))
+            """, (user_id, user_type, selector, token_hash, jti, expire, ip_address, user_agent))
             
-            self.db_connection.commit()
+            if commit:
+                self.db_connection.commit()
             return refresh_token
             
         except psycopg2.Error as e:
@@ -94,10 +142,11 @@ class TokenManager:
         finally:
             cursor.close()
     
-    def create_token_pair(self, user_id: int, user_type: str, ip_address: str = None, user_agent: str = None) -> Dict[str, Any]:
+    def create_token_pair(self, user_id: int, user_type: str, ip_address: str = None, user_agent: str = None,
+                          username: str = None, commit: bool = True) -> Dict[str, Any]:
         """Create both access and refresh tokens"""
-        access_token = self.create_access_token(user_id, user_type)
-        refresh_token = self.create_refresh_token(user_id, user_type, ip_address, user_agent)
+        access_token = self.create_access_token(user_id, user_type, username=username)
+        refresh_token = self.create_refresh_token(user_id, user_type, ip_address, user_agent, commit=commit)
         
         return {
             "access_token": access_token,
@@ -123,34 +172,54 @@ class TokenManager:
     
     def verify_refresh_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Verify refresh token and mark as used"""
+        selector, verifier = self._split_refresh_token(token)
+        if selector is None:
+            if not self.legacy_refresh_tokens:
+                return None
+            return self._verify_legacy_refresh_token_scan(token)
+        
         cursor = self._get_cursor()
         try:
-            # Find token in database
+            # Single indexed lookup by selector
             cursor.execute("""
-                SELECT token_id, user_id, user_type, token_hash, jti, expires_at, is_used
-                FROM refresh_tokens
-                WHERE expires_at > CURRENT_TIMESTAMP AND is_used = FALSE
-                ORDER BY created_at DESC
-            """)
+                SELECT rt.token_id, rt.user_id, rt.user_type, rt.token_hash, rt.jti, u.username
+                FROM refresh_tokens rt
+                LEFT JOIN users u ON rt.user_type = 'user' AND u.user_id = rt.user_id
+                WHERE rt.selector = %s AND rt.expires_at > CURRENT_TIMESTAMP AND rt.is_used = FALSE
+            """, (selector,))
             
-            tokens = cursor.fetchall()
+            token_record = cursor.fetchone()
+            if not token_record or not self._verify_refresh_token(verifier, token_record['token_hash']):
+                return None
             
-            for token_record in tokens:
-                if self._verify_refresh_token(token, token_record['token_hash']):
-                    # Mark token as used
-                    cursor.execute("""
-                        UPDATE refresh_tokens 
-                        SET is_used = TRUE, last_used_at = CURRENT_TIMESTAMP
-                        WHERE token_id = %s
-                    """, (token_record['token_id'],))
-                    
-                    self.db_connection.commit()
-                    
-                    return {
-                        "user_id": token_record['user_id'],
-                        "user_type": token_record['user_type'],
-                        "jti": token_record['jti']
-                    }
+            return self._mark_refresh_token_used(cursor, token_record)
+            
+        except psycopg2.Error as e:
+            self.db_connection.rollback()
+            raise Exception(f"Failed to verify refresh token: {e}")
+        finally:
+            cursor.close()
+    
+    def _verify_legacy_refresh_token_scan(self, token: str) -> Optional[Dict[str, Any]]:
+        """Verify a refresh token issued before selectors existed.
+
+        Legacy rows carry no lookup key, so this still bcrypt-checks each live
+        legacy row; the set shrinks to nothing once REFRESH_TOKEN_EXPIRE_DAYS
+        have passed, after which REFRESH_TOKEN_LEGACY_FALLBACK can be disabled.
+        """
+        cursor = self._get_cursor()
+        try:
+            cursor.execute("""
+                SELECT rt.token_id, rt.user_id, rt.user_type, rt.token_hash, rt.jti, u.username
+                FROM refresh_tokens rt
+                LEFT JOIN users u ON rt.user_type = 'user' AND u.user_id = rt.user_id
+                WHERE rt.selector IS NULL AND rt.expires_at > CURRENT_TIMESTAMP AND rt.is_used = FALSE
+                ORDER BY rt.created_at DESC
+            """)
+            
+            for token_record in cursor.fetchall():
+                if self._verify_legacy_refresh_token(token, token_record['token_hash']):
+                    return self._mark_refresh_token_used(cursor, token_record)
             
             return None
             
@@ -160,6 +229,27 @@ class TokenManager:
         finally:
             cursor.close()
     
+    def _mark_refresh_token_used(self, cursor, token_record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Mark a verified refresh token as used; returns None if it was raced by another refresh"""
+        cursor.execute("""
+            UPDATE refresh_tokens 
+            SET is_used = TRUE, last_used_at = CURRENT_TIMESTAMP
+            WHERE token_id = %s AND is_used = FALSE
+        """, (token_record['token_id'],))
+        
+        if cursor.rowcount == 0:
+            self.db_connection.rollback()
+            return None
+        
+        self.db_connection.commit()
+        
+        return {
+            "user_id": token_record['user_id'],
+            "user_type": token_record['user_type'],
+            "jti": token_record['jti'],
+            "username": token_record.get('username')
+        }
+    
     def blacklist_token(self, jti: str, user_id: int, user_type: str, reason: str = "logout") -> bool:
         """Add token to blacklist"""
         cursor = self._get_cursor()
@@ -175,6 +265,7 @@ class TokenManager:
             """, (jti, user_id, user_type, expires_at, reason))
             
             self.db_connection.commit()
+            self.blacklist_cache.add(jti, expires_at)
             return cursor.rowcount > 0
             
         except psycopg2.Error as e:
@@ -184,44 +275,36 @@ class TokenManager:
             cursor.close()
     
     def is_token_blacklisted(self, jti: str) -> bool:
-        """Check if token is blacklisted"""
-        cursor = self._get_cursor()
-        try:
-            cursor.execute("""
-                SELECT 1 FROM token_blacklist 
-                WHERE jti = %s AND expires_at > CURRENT_TIMESTAMP
-            """, (jti,))
-            
-            return cursor.fetchone() is not None
-            
-        except psycopg2.Error as e:
-            raise Exception(f"Failed to check token blacklist: {e}")
-        finally:
-            cursor.close()
+        """Check if token is blacklisted (answered from the blacklist cache when it is loaded)"""
+        return self.blacklist_cache.is_blacklisted(jti, self.db_connection)
     
     def revoke_user_tokens(self, user_id: int, user_type: str) -> int:
         """Revoke all tokens for a specific user"""
         cursor = self._get_cursor()
         try:
-            # Mark all refresh tokens as used
+            # Add all active refresh tokens to blacklist (before they are marked used below)
             cursor.execute("""
-                UPDATE refresh_tokens 
-                SET is_used = TRUE, last_used_at = CURRENT_TIMESTAMP
+                INSERT INTO token_blacklist (jti, user_id, user_type, expires_at, reason)
+                SELECT jti, user_id, user_type, expires_at, 'user_revocation'
+                FROM refresh_tokens
                 WHERE user_id = %s AND user_type = %s AND is_used = FALSE
+                ON CONFLICT (jti) DO NOTHING
+                RETURNING jti, expires_at
             """, (user_id, user_type))
             
-            revoked_count = cursor.rowcount
+            blacklisted = [(row['jti'], row['expires_at']) for row in cursor.fetchall()]
             
-            # Add all active refresh tokens to blacklist
+            # Mark all refresh tokens as used
             cursor.execute("""
-                INSERT INTO token_blacklist (jti, user_id, user_type, expires_at, reason)
-                SELECT jti, user_id, user_type, expires_at, 'user_revocation'
-                FROM refresh_tokens
+                UPDATE refresh_tokens 
+                SET is_used = TRUE, last_used_at = CURRENT_TIMESTAMP
                 WHERE user_id = %s AND user_type = %s AND is_used = FALSE
-                ON CONFLICT (jti) DO NOTHING
             """, (user_id, user_type))
             
+            revoked_count = cursor.rowcount
+            
             self.db_connection.commit()
+            self.blacklist_cache.add_many(blacklisted)
             return revoked_count
             
         except psycopg2.Error as e:
@@ -243,6 +326,7 @@ class TokenManager:
             blacklist_cleaned = cursor.rowcount
             
             self.db_connection.commit()
+            self.blacklist_cache.prune()
             return refresh_cleaned + blacklist_cleaned
             
         except psycopg2.Error as e:
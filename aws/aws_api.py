@@ -1,7 +1,7 @@
 import boto3                    # type: ignore
 from dotenv import load_dotenv   # type: ignore
 import os
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File  # type: ignore
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request  # type: ignore
 from fastapi.middleware.cors import CORSMiddleware  # type: ignore
 from typing import Optional, List
 from pydantic import BaseModel
@@ -19,6 +19,7 @@ import psycopg2  # type: ignore
 from psycopg2 import connect, Error as psycopg2Error  # type: ignore
 from psycopg2.extras import RealDictCursor  # type: ignore
 import uuid
+import json
 from fastapi import Header, Depends  # type: ignore
 from jose import ExpiredSignatureError      #type: ignore
 from fastapi.responses import StreamingResponse  # type: ignore
@@ -26,6 +27,20 @@ from botocore.config import Config                          # type: ignore
 from fastapi import Query  # type: ignore
 # from datetime import datetime, timedelta
 from datetime import date
+from fastapi.concurrency import run_in_threadpool  # type: ignore
+import sys
+
+# Add the shared auth directory to the Python path
+auth_path = os.path.join(os.path.dirname(__file__), 'auth')
+sys.path.append(auth_path)
+
+from db_pool import get_db, get_pool
+from jwt_auth import get_authenticator
+from s3_client import get_s3_client, s3_call, close_s3
+from presign_cache import get_presign_cache
+from s3_uploads import stream_upload, iter_upload_file, upload_part, UPLOAD_PART_SIZE
+
+authenticator = get_authenticator()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -44,6 +59,7 @@ if not AWS_ACCESS_KEY or not AWS_SECRET_ACCESS_KEY:
     raise HTTPException(status_code=500, detail="AWS credentials not found in .env file")
 
 app = FastAPI(title="ALL AWS API CALLS")
+app.add_event_handler("shutdown", close_s3)
 origins = [
     "https://54.159.160.253",
 ]
@@ -100,89 +116,42 @@ class CSCSCard(BaseModel):
 class ErrorResponse(BaseModel):
     message: str
 
+@app.get("/health/db")
+async def database_health():
+    """Database pool health and saturation metrics"""
+    result = await run_in_threadpool(get_pool().health_check)
+    return JSONResponse(status_code=200 if result["healthy"] else 503, content=result)
+
+@app.get("/health/presign")
+async def presign_cache_health():
+    """Presigned URL cache hit rate"""
+    return get_presign_cache().stats()
+
+
 # class EmailRequest(BaseModel):
 #     recipient: EmailStr
     # admin_email: EmailStr
 
 
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),  # Default PostgreSQL port
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Error connecting to database: {e}")
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Verify the bearer token locally: signature, revocation and user claims"""
+    return authenticator.require_user(token)
 
-def get_db():
-    conn = connect_db()
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    if token is None:
-        logger.error("No token provided in Authorization header")
-        raise credentials_exception
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            logger.error("JWT payload missing 'sub' claim")
-            raise credentials_exception
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {token}"}
-            logger.info(f"Calling /user/me with headers: {headers}")
-            response = await client.get("http://login_register_container:8000/user/me", headers=headers)
-            logger.info(f"/user/me response: {response.status_code}, {response.text}")
-            if response.status_code != 200:
-                raise credentials_exception
-            user_data = response.json()
-            print("username", username)
-            print("user_id", user_data["user_id"])
-            return {"username": username, "user_id": user_data["user_id"]}
-    except (JWTError, httpx.HTTPStatusError) as e:
-        logger.error(f"Error in get_current_user: {str(e)}")
-        raise credentials_exception
-    
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.pdf', '.json'}
 
 def validate_file_extension(filename: str) -> bool:
     return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
 
 def create_s3_client():
+    """The process-wide S3 client; its blocking calls go through s3_call"""
     try:
-        s3_client = boto3.client(
-            "s3",
-            config = Config(signature_version='s3v4'),
-            region_name='eu-north-1',
-            aws_access_key_id=AWS_ACCESS_KEY,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
-        return s3_client
+        return get_s3_client()
     except ClientError as e:
         raise HTTPException(status_code=500, detail=f"Failed to create S3 client: {e}")
 
 def generate_presigned_url(bucket_name: str, object_key: str, expiration: int = 3600) -> str:
     try:
-        s3_client = create_s3_client()
-        url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': object_key},
-            ExpiresIn=expiration
-        )
-        return url
+        return get_presign_cache().url(bucket_name, object_key, expiration)
     except ClientError as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate pre-signed URL: {str(e)}")
 
@@ -249,7 +218,7 @@ async def get_admin_email(token: Optional[str] = Depends(admin_oauth2_scheme)) -
     except JWTError:
         raise credentials_exception
 
-async def check_user_exists(email: str, db: psycopg2.extensions.connection):
+def check_user_exists(email: str, db: psycopg2.extensions.connection):
     cursor = db.cursor()
     cursor.execute("SELECT * FROM users WHERE username = %s", (email,))
     user = cursor.fetchone()
@@ -272,16 +241,11 @@ async def upload_file(file: UploadFile = File(...), user_id: Optional[int] = Non
     file_key = folder_name + file.filename
     
     try:
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=file_key,
-            Body=file.file,
-            ContentType=file.content_type
-        )
+        result = await stream_upload(s3_client, bucket_name, file_key, iter_upload_file(file), file.content_type)
         # get s3 path of the stored file
         s3_path = f"s3://{bucket_name}/{file_key}"
         return {"message": f"File '{file.filename}' uploaded successfully to '{folder_name}'.",
-                "s3_path": s3_path}
+                "s3_path": s3_path, "size": result["size"], "sha256": result["sha256"]}
     except ClientError as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload file: {e}")
 
@@ -302,19 +266,228 @@ async def upload_certificate(file: UploadFile = File(...), user_id: Optional[int
     file_key = folder_name + file.filename
     
     try:
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=file_key,
-            Body=file.file,
-            ContentType=file.content_type
-        )
+        result = await stream_upload(s3_client, bucket_name, file_key, iter_upload_file(file), file.content_type)
         s3_path = f"s3://{bucket_name}/{file_key}"
         return {"message": f"Certificate '{file.filename}' uploaded successfully to '{folder_name}'.",
-                "s3_path": s3_path}
+                "s3_path": s3_path, "size": result["size"], "sha256": result["sha256"]}
     except ClientError as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload certificate: {e}")
 
 
+# Content types and size limits per extension (matches FileValidator), for
+# uploads that bypass the form endpoints: resumable and presigned POST
+UPLOAD_TYPES = {
+    '.jpg': ('image/jpeg', 10 * 1024 * 1024),
+    '.jpeg': ('image/jpeg', 10 * 1024 * 1024),
+    '.png': ('image/png', 10 * 1024 * 1024),
+    '.pdf': ('application/pdf', 50 * 1024 * 1024),
+    '.json': ('application/json', 1 * 1024 * 1024),
+}
+
+
+def _upload_type(filename: str):
+    """(content type, max size) for a filename, 400 for anything FileValidator would reject"""
+    extension = Path(filename).suffix.lower()
+    if extension not in UPLOAD_TYPES or "/" in filename:
+        raise HTTPException(status_code=400, detail="Invalid file extension. Allowed extensions are: jpg, jpeg, png, pdf, json.")
+    return UPLOAD_TYPES[extension]
+
+
+# Resumable uploads: the client starts an upload, PUTs raw parts (retrying any
+# that fail), asks which parts S3 already holds after a dropped connection, and
+# completes. All state lives in the S3 multipart upload, so any worker can
+# serve any step. The content type is pinned by extension and the running
+# total is checked against the extension's limit on every part and on complete.
+
+class StartUploadRequest(BaseModel):
+    filename: str
+    folder: str = "files"  # "files" or "certificates"
+
+
+def _owned_upload_key(current_user: dict, key: str) -> str:
+    if not key.startswith(f"user_{current_user['user_id']}/"):
+        raise HTTPException(status_code=403, detail="Not authorized to access this upload")
+    return key
+
+
+def _upload_error(e: ClientError, action: str) -> HTTPException:
+    error_code = e.response['Error']['Code']
+    if error_code == 'NoSuchUpload':
+        return HTTPException(status_code=404, detail="Upload not found or already completed")
+    if error_code in ('BadDigest', 'InvalidDigest', 'InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+        return HTTPException(status_code=400, detail=f"Failed to {action}: {error_code}")
+    return HTTPException(status_code=500, detail=f"Failed to {action}: {str(e)}")
+
+
+async def _list_upload_parts(s3_client, bucket_name: str, key: str, upload_id: str) -> List[dict]:
+    parts = []
+    params = {"Bucket": bucket_name, "Key": key, "UploadId": upload_id}
+    while True:
+        response = await s3_call(s3_client.list_parts, **params)
+        parts.extend(response.get("Parts", []))
+        if not response.get("IsTruncated"):
+            return parts
+        params["PartNumberMarker"] = response["NextPartNumberMarker"]
+
+
+@app.post("/uploads/")
+async def start_upload(request: StartUploadRequest, current_user: dict = Depends(get_current_user)):
+    content_type, max_size = _upload_type(request.filename)
+    if request.folder not in ("files", "certificates"):
+        raise HTTPException(status_code=400, detail="folder must be 'files' or 'certificates'")
+
+    folder_name = f"user_{current_user['user_id']}/" + ("certificates/" if request.folder == "certificates" else "")
+    key = folder_name + request.filename
+    s3_client = create_s3_client()
+    try:
+        created = await s3_call(s3_client.create_multipart_upload, Bucket=os.getenv("BUCKET_NAME"), Key=key,
+                                ContentType=content_type, ChecksumAlgorithm="SHA256")
+    except ClientError as e:
+        raise _upload_error(e, "start upload")
+    return {"uploadId": created["UploadId"], "key": key, "partSize": UPLOAD_PART_SIZE, "maxSize": max_size}
+
+
+@app.put("/uploads/{upload_id}/parts/{part_number}")
+async def upload_part_endpoint(
+    upload_id: str,
+    part_number: int,
+    request: Request,
+    key: str = Query(...),
+    x_checksum_sha256: Optional[str] = Header(None, description="Base64 SHA-256 of the part, verified by S3"),
+    current_user: dict = Depends(get_current_user),
+):
+    """Upload one raw part (every part but the last must be exactly partSize)"""
+    _owned_upload_key(current_user, key)
+    _, max_size = _upload_type(Path(key).name)
+    if not 1 <= part_number <= 10000:
+        raise HTTPException(status_code=400, detail="part_number must be between 1 and 10000")
+
+    # Read the request body directly (no form parsing or disk spooling), capped at one part
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > UPLOAD_PART_SIZE:
+            raise HTTPException(status_code=413, detail=f"Parts may not exceed {UPLOAD_PART_SIZE} bytes")
+    if not body:
+        raise HTTPException(status_code=400, detail="Empty part")
+
+    s3_client = create_s3_client()
+    bucket_name = os.getenv("BUCKET_NAME")
+    try:
+        # A retried part replaces the stored one, so it does not count twice
+        stored = sum(p["Size"] for p in await _list_upload_parts(s3_client, bucket_name, key, upload_id)
+                     if p["PartNumber"] != part_number)
+        if stored + len(body) > max_size:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {max_size} byte limit for this type")
+        part = await s3_call(upload_part, s3_client, bucket_name, key, upload_id,
+                             part_number, bytes(body), x_checksum_sha256)
+    except ClientError as e:
+        raise _upload_error(e, "upload part")
+    return {"partNumber": part_number, "size": len(body), "etag": part["ETag"], "checksumSha256": part["ChecksumSHA256"]}
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str, key: str = Query(...), current_user: dict = Depends(get_current_user)):
+    """Parts S3 already holds, so a client can resume after a dropped connection"""
+    _owned_upload_key(current_user, key)
+    try:
+        parts = await _list_upload_parts(create_s3_client(), os.getenv("BUCKET_NAME"), key, upload_id)
+    except ClientError as e:
+        raise _upload_error(e, "read upload")
+    return {
+        "uploadId": upload_id,
+        "key": key,
+        "partSize": UPLOAD_PART_SIZE,
+        "parts": [{"partNumber": p["PartNumber"], "size": p["Size"], "checksumSha256": p.get("ChecksumSHA256")}
+                  for p in parts],
+    }
+
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, key: str = Query(...), current_user: dict = Depends(get_current_user)):
+    _owned_upload_key(current_user, key)
+    _, max_size = _upload_type(Path(key).name)
+    s3_client = create_s3_client()
+    bucket_name = os.getenv("BUCKET_NAME")
+    try:
+        parts = await _list_upload_parts(s3_client, bucket_name, key, upload_id)
+        if not parts:
+            raise HTTPException(status_code=400, detail="No parts uploaded")
+        if sum(p["Size"] for p in parts) > max_size:
+            # Concurrent part uploads can each pass the per-part check; never assemble an oversized object
+            await s3_call(s3_client.abort_multipart_upload, Bucket=bucket_name, Key=key, UploadId=upload_id)
+            raise HTTPException(status_code=413, detail=f"File exceeds the {max_size} byte limit for this type")
+        await s3_call(
+            s3_client.complete_multipart_upload, Bucket=bucket_name, Key=key, UploadId=upload_id,
+            MultipartUpload={"Parts": [
+                {"PartNumber": p["PartNumber"], "ETag": p["ETag"], "ChecksumSHA256": p["ChecksumSHA256"]}
+                for p in parts
+            ]},
+        )
+    except ClientError as e:
+        raise _upload_error(e, "complete upload")
+    return {"message": "Upload completed", "s3_path": f"s3://{bucket_name}/{key}",
+            "size": sum(p["Size"] for p in parts)}
+
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str, key: str = Query(...), current_user: dict = Depends(get_current_user)):
+    _owned_upload_key(current_user, key)
+    try:
+        await s3_call(create_s3_client().abort_multipart_upload, Bucket=os.getenv("BUCKET_NAME"), Key=key,
+                      UploadId=upload_id)
+    except ClientError as e:
+        raise _upload_error(e, "abort upload")
+    return {"message": "Upload aborted"}
+
+
+# Direct-to-S3 uploads: the client gets a presigned POST policy and sends the
+# file straight to S3, so the bytes do not pass through nginx or any service.
+
+PRESIGNED_POST_EXPIRY = int(os.getenv("PRESIGNED_POST_EXPIRY", "300"))
+
+class PresignedUploadRequest(BaseModel):
+    filename: str
+    folder: str = "certificates"  # "files" or "certificates"
+
+
+@app.post("/presigned-upload/")
+async def presigned_upload(request: PresignedUploadRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Presigned POST policy for one upload. S3 itself enforces the key, the
+    content type and the size range, and the policy expires after
+    PRESIGNED_POST_EXPIRY seconds.
+    """
+    content_type, max_size = _upload_type(request.filename)
+    if request.folder not in ("files", "certificates"):
+        raise HTTPException(status_code=400, detail="folder must be 'files' or 'certificates'")
+
+    bucket_name = os.getenv("BUCKET_NAME")
+    key = f"user_{current_user['user_id']}/" + ("certificates/" if request.folder == "certificates" else "") + request.filename
+    try:
+        # Signed locally, no S3 round trip
+        post = create_s3_client().generate_presigned_post(
+            Bucket=bucket_name,
+            Key=key,
+            Fields={"Content-Type": content_type},
+            Conditions=[
+                {"Content-Type": content_type},
+                ["content-length-range", 1, max_size],
+            ],
+            ExpiresIn=PRESIGNED_POST_EXPIRY,
+        )
+    except ClientError as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create upload policy: {e}")
+    return {
+        "url": post["url"],
+        "fields": post["fields"],
+        "key": key,
+        "s3_path": f"s3://{bucket_name}/{key}",
+        "maxSize": max_size,
+        "expiresIn": PRESIGNED_POST_EXPIRY,
+    }
+
+
 @app.get("/download-file/{file_key:path}")
 async def download_file(file_key: str, current_user: dict = Depends(get_current_user)):
     user_id = current_user.get("user_id")
@@ -326,12 +499,8 @@ async def download_file(file_key: str, current_user: dict = Depends(get_current_
     bucket_name = os.getenv("BUCKET_NAME")
     logger.info(f"File {file_key} found in S3")
     try : 
-        s3_client.head_object(Bucket=bucket_name, Key=file_key)
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': bucket_name, 'Key': file_key},
-            ExpiresIn=3600  # URL valid for 1 hour
-        )
+        await s3_call(s3_client.head_object, Bucket=bucket_name, Key=file_key)
+        presigned_url = get_presign_cache().url(bucket_name, file_key, 3600)  # URL valid for 1 hour
         logger.info(f"Generated pre-signed URL for file {file_key}")
         return {"downloadUrl": presigned_url}
     except ClientError as e:
@@ -349,87 +518,114 @@ async def download_file(file_key: str, current_user: dict = Depends(get_current_
 
 
 
-@app.get("/list-files/")
-async def list_files(current_user: dict = Depends(get_current_user)):
-    user_id = current_user.get("user_id")
-    if user_id != current_user["user_id"]:
-        logger.error(f"Unauthorized access attempt: user_id {user_id} does not match {current_user['user_id']}")
-        raise HTTPException(status_code=403, detail="Not authorized to access this user's files")
-    
+LIST_PAGE_SIZE = 1000  # S3 returns at most 1000 keys per list_objects_v2 call
+
+
+async def _iter_object_pages(bucket_name: str, prefix: str, page_size: int, cursor: Optional[str] = None):
+    """Yield list_objects_v2 pages for a prefix, following the continuation token"""
     s3_client = create_s3_client()
+    params = {"Bucket": bucket_name, "Prefix": prefix, "MaxKeys": page_size}
+    if cursor:
+        params["ContinuationToken"] = cursor
+    while True:
+        page = await s3_call(s3_client.list_objects_v2, **params)
+        yield page
+        if not page.get("IsTruncated"):
+            return
+        params["ContinuationToken"] = page["NextContinuationToken"]
+
+
+def _page_files(bucket_name: str, page: dict) -> List[dict]:
+    """File entries for one page, presigned in one batch"""
+    objects = page.get("Contents", [])
+    urls = get_presign_cache().urls(bucket_name, [obj['Key'] for obj in objects], 3600)
+    return [
+        {
+            "key": obj['Key'],
+            "lastModified": obj['LastModified'].isoformat(),
+            "size": obj['Size'],
+            "url": url
+        }
+        for obj, url in zip(objects, urls)
+    ]
+
+
+async def _list_user_objects(user_id: int, folder_name: str, limit: int, cursor: Optional[str], stream: bool):
+    """
+    One page of a user's folder ({"files", "nextCursor"}), or with stream=True the
+    whole folder as NDJSON, one file per line, holding a single S3 page at a time.
+    """
     bucket_name = os.getenv("BUCKET_NAME")
-    folder_name = f"user_{user_id}/"
-    
+    pages = _iter_object_pages(bucket_name, folder_name, limit, cursor)
     try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=folder_name)
-        if 'Contents' not in response:
-            logger.info(f"No files found for user_id: {user_id}")
-            return {"files": []}
-        
-        files = [
-            {
-                "key": obj['Key'],
-                "lastModified": obj['LastModified'].isoformat(),
-                "size": obj['Size'],
-                "url": s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': bucket_name, 'Key': obj['Key']},
-                    ExpiresIn=3600
-                )
-            }
-            for obj in response['Contents']
-        ]
-        logger.info(f"Retrieved {len(files)} files for user_id: {user_id}")
-        return {"files": files}
+        # Fetch the first page before responding so S3 errors still map to a status code
+        first_page = await pages.__anext__()
     except ClientError as e:
         error_code = e.response['Error']['Code']
         logger.error(f"S3 error for user_id {user_id}: {error_code}, {str(e)}")
         if error_code == 'NoSuchBucket':
             raise HTTPException(status_code=400, detail="S3 bucket does not exist")
+        if error_code == 'InvalidArgument':
+            raise HTTPException(status_code=400, detail="Invalid cursor")
         raise HTTPException(status_code=500, detail=f"Failed to list files: {str(e)}")
-    
+
+    if not stream:
+        await pages.aclose()
+        files = _page_files(bucket_name, first_page)
+        logger.info(f"Retrieved {len(files)} files for user_id: {user_id}")
+        next_cursor = first_page.get("NextContinuationToken") if first_page.get("IsTruncated") else None
+        return {"files": files, "nextCursor": next_cursor}
+
+    async def ndjson():
+        count = 0
+        try:
+            for entry in _page_files(bucket_name, first_page):
+                count += 1
+                yield json.dumps(entry) + "\n"
+            async for page in pages:
+                for entry in _page_files(bucket_name, page):
+                    count += 1
+                    yield json.dumps(entry) + "\n"
+        except ClientError as e:
+            # Headers are already sent; end the stream with an error line
+            logger.error(f"S3 error while streaming files for user_id {user_id}: {str(e)}")
+            yield json.dumps({"error": "Failed to list files"}) + "\n"
+        logger.info(f"Streamed {count} files for user_id: {user_id}")
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@app.get("/list-files/")
+async def list_files(
+    current_user: dict = Depends(get_current_user),
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="nextCursor from the previous page"),
+    stream: bool = Query(False, description="Stream every file as NDJSON"),
+):
+    user_id = current_user.get("user_id")
+    if user_id != current_user["user_id"]:
+        logger.error(f"Unauthorized access attempt: user_id {user_id} does not match {current_user['user_id']}")
+        raise HTTPException(status_code=403, detail="Not authorized to access this user's files")
+
+    return await _list_user_objects(user_id, f"user_{user_id}/", limit, cursor, stream)
+
 @app.get("/list-certificates/")
-async def list_certificates(current_user: dict = Depends(get_current_user)):
+async def list_certificates(
+    current_user: dict = Depends(get_current_user),
+    limit: int = Query(LIST_PAGE_SIZE, ge=1, le=LIST_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="nextCursor from the previous page"),
+    stream: bool = Query(False, description="Stream every certificate as NDJSON"),
+):
     user_id = current_user.get("user_id")
     if user_id != current_user["user_id"]:
         logger.error(f"Unauthorized access attempt: user_id {user_id} does not match {current_user['user_id']}")
         raise HTTPException(status_code=403, detail="Not authorized to access this user's files")
-    
-    s3_client = create_s3_client()
-    bucket_name = os.getenv("BUCKET_NAME")
-    folder_name = f"user_{user_id}/certificates/"
-    
-    try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=folder_name)
-        if 'Contents' not in response:
-            logger.info(f"No files found for user_id: {user_id}")
-            return {"files": []}
-        
-        files = [
-            {
-                "key": obj['Key'],
-                "lastModified": obj['LastModified'].isoformat(),
-                "size": obj['Size'],
-                "url": s3_client.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': bucket_name, 'Key': obj['Key']},
-                    ExpiresIn=3600
-                )
-            }
-            for obj in response['Contents']
-        ]
-        logger.info(f"Retrieved {len(files)} files for user_id: {user_id}")
-        return {"files": files}
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        logger.error(f"S3 error for user_id {user_id}: {error_code}, {str(e)}")
-        if error_code == 'NoSuchBucket':
-            raise HTTPException(status_code=400, detail="S3 bucket does not exist")
-        raise HTTPException(status_code=500, detail=f"Failed to list files: {str(e)}")
+
+    return await _list_user_objects(user_id, f"user_{user_id}/certificates/", limit, cursor, stream)
 
     
 @app.get("/fetch-invitations-details")
-async def fetch_invitations_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def fetch_invitations_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         print("Admin Email, ", admin_email)
         cursor = db.cursor()
@@ -448,11 +644,11 @@ async def fetch_invitations_details(db: psycopg2.extensions.connection = Depends
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 @app.post("/store-invitation-details")
-async def store_invitation_details(employee_data: EmployeeData, db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def store_invitation_details(employee_data: EmployeeData, db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         # Check if the user already exists
         print(f"Checking if user {employee_data.email} exists in the database.")
-        user_exists = await check_user_exists(employee_data.email, db)
+        user_exists = check_user_exists(employee_data.email, db)
         
         gen_uuid = str(uuid.uuid4())
         consent = False
@@ -510,7 +706,7 @@ async def store_invitation_details(employee_data: EmployeeData, db: psycopg2.ext
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 @app.post("/send-expiry-email")
-async def send_expiry_email(cscscarddetails: CSCSCard, db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def send_expiry_email(cscscarddetails: CSCSCard, db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         # Initialize SES client
         ses_client = boto3.client(
@@ -635,7 +831,7 @@ async def send_expiry_email(cscscarddetails: CSCSCard, db: psycopg2.extensions.c
 #             raise Exception(f"Failed to initialize SES client: {e}")
 #         # Check if the user already exists
 #         print(f"Checking if user {employee_data.email} exists in the database.")
-#         user_exists = await check_user_exists(employee_data.email, db)
+#         user_exists = check_user_exists(employee_data.email, db)
 #         if user_exists:
 #             gen_uuid = str(uuid.uuid4())
 #             consent = False
@@ -701,7 +897,7 @@ async def send_expiry_email(cscscarddetails: CSCSCard, db: psycopg2.extensions.c
     
 
 @app.get("/fetch_user_profile/{ref_id}", response_model=UserDetails)
-async def fetch_user_profile(ref_id: str, 
+def fetch_user_profile(ref_id: str, 
                              db = Depends(get_db)):
     res = {
         "ref_id": ref_id,
@@ -782,7 +978,7 @@ async def fetch_user_profile(ref_id: str,
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
         
 @app.get("/fetch_active_users/")
-async def fetch_active_users(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def fetch_active_users(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         cursor = db.cursor()
         cursor.execute(
@@ -800,7 +996,7 @@ async def fetch_active_users(db: psycopg2.extensions.connection = Depends(get_db
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 @app.get("/fetch_pending_users/")
-async def fetch_pending_users(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def fetch_pending_users(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         cursor = db.cursor()
         cursor.execute(
@@ -819,7 +1015,7 @@ async def fetch_pending_users(db: psycopg2.extensions.connection = Depends(get_d
 
 
 @app.get("/fetch_expired_card_details/")
-async def fetch_expired_card_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def fetch_expired_card_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         cursor = db.cursor()
         cursor.execute(
@@ -837,7 +1033,7 @@ async def fetch_expired_card_details(db: psycopg2.extensions.connection = Depend
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 @app.get("/fetch_active_cscs_card_details/")
-async def fetch_active_cscs_card_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def fetch_active_cscs_card_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         cursor = db.cursor()
         cursor.execute(
@@ -855,7 +1051,7 @@ async def fetch_active_cscs_card_details(db: psycopg2.extensions.connection = De
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 @app.get("/fetch_all_cscs_card_details/")
-async def fetch_all_cscs_card_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
+def fetch_all_cscs_card_details(db: psycopg2.extensions.connection = Depends(get_db), admin_email: str = Depends(get_admin_email)):
     try:
         cursor = db.cursor()
         cursor.execute(
@@ -874,7 +1070,7 @@ async def fetch_all_cscs_card_details(db: psycopg2.extensions.connection = Depen
 
 
 @app.get("/filter_active_cards/")
-async def filter_active_cards(
+def filter_active_cards(
     db: psycopg2.extensions.connection = Depends(get_db),
     admin_email: str = Depends(get_admin_email),
     expiry_in_days: Optional[int] = Query(None, description="Filter by cards expiring within X days"),
@@ -0,0 +1,181 @@
+"""
+Presigned URL cache for the AWS service
+Signs S3 GET URLs locally (SigV4 query signing) and reuses them per expiry window
+"""
+import os
+import hmac
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List, Tuple
+from urllib.parse import quote
+
+from s3_client import get_s3_client
+
+MAX_PRESIGN_EXPIRY = 7 * 24 * 3600  # SigV4 limit
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+class SigV4Presigner:
+    """
+    Presigns GET object URLs without going through the botocore request pipeline.
+
+    The per-day signing key is derived once and reused, so each URL costs one
+    SHA-256 of the canonical request and one HMAC. Uses virtual-hosted URLs on
+    AWS and path-style URLs when an endpoint override (MinIO, moto) is set.
+    """
+
+    def __init__(self, access_key: str, secret_key: str, region: str,
+                 endpoint_url: Optional[str] = None, session_token: Optional[str] = None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.endpoint_url = endpoint_url.rstrip("/") if endpoint_url else None
+        self.session_token = session_token
+        self._signing_keys: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _signing_key(self, datestamp: str) -> bytes:
+        key = self._signing_keys.get(datestamp)
+        if key is None:
+            key = _hmac(("AWS4" + self.secret_key).encode("utf-8"), datestamp)
+            key = _hmac(_hmac(_hmac(key, self.region), "s3"), "aws4_request")
+            with self._lock:
+                self._signing_keys = {datestamp: key}
+        return key
+
+    def _location(self, bucket: str, key: str) -> Tuple[str, str, str]:
+        """(scheme://host, host, canonical path) for an object"""
+        encoded_key = quote(key, safe="/~")
+        if self.endpoint_url:
+            host = self.endpoint_url.split("://", 1)[1]
+            return self.endpoint_url, host, f"/{bucket}/{encoded_key}"
+        if "." in bucket:
+            host = f"s3.{self.region}.amazonaws.com"
+            return f"https://{host}", host, f"/{bucket}/{encoded_key}"
+        host = f"{bucket}.s3.{self.region}.amazonaws.com"
+        return f"https://{host}", host, f"/{encoded_key}"
+
+    def presign_get(self, bucket: str, key: str, expires_in: int, signed_at: datetime) -> str:
+        base, host, path = self._location(bucket, key)
+        amz_date = signed_at.strftime("%Y%m%dT%H%M%SZ")
+        datestamp = amz_date[:8]
+        scope = f"{datestamp}/{self.region}/s3/aws4_request"
+        params = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{scope}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires_in),
+            "X-Amz-SignedHeaders": "host",
+        }
+        if self.session_token:
+            params["X-Amz-Security-Token"] = self.session_token
+        query = "&".join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                         for k, v in sorted(params.items()))
+        canonical_request = f"GET\n{path}\n{query}\nhost:{host}\n\nhost\nUNSIGNED-PAYLOAD"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest(),
+        ])
+        signature = hmac.new(self._signing_key(datestamp), string_to_sign.encode("utf-8"),
+                             hashlib.sha256).hexdigest()
+        return f"{base}{path}?{query}&X-Amz-Signature={signature}"
+
+
+class PresignCache:
+    """
+    Caches presigned GET URLs keyed by (bucket, key, expires_in, window).
+
+    Time is cut into PRESIGN_REUSE_SECONDS windows. A URL is signed as of the
+    start of its window and valid for expires_in + the window length, so every
+    URL handed out still has at least expires_in seconds left, and all workers
+    produce the same URL within a window (which also lets browsers cache it).
+    """
+
+    def __init__(self, reuse_seconds: Optional[int] = None, max_size: Optional[int] = None):
+        self.reuse_seconds = reuse_seconds or int(os.getenv("PRESIGN_REUSE_SECONDS", "900"))
+        self.max_size = max_size or int(os.getenv("PRESIGN_CACHE_SIZE", "50000"))
+        self._entries: "OrderedDict[Tuple[str, str, int, int], str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._signer = self._make_signer()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _make_signer() -> Optional[SigV4Presigner]:
+        access_key = os.getenv("AWS_ACCESS_KEY")
+        secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+        if not access_key or not secret_key:
+            return None
+        return SigV4Presigner(access_key, secret_key,
+                              os.getenv("S3_REGION", "eu-north-1"),
+                              os.getenv("S3_ENDPOINT_URL") or None)
+
+    def _sign(self, bucket: str, key: str, expires_in: int, window: int) -> str:
+        lifetime = min(expires_in + self.reuse_seconds, MAX_PRESIGN_EXPIRY)
+        if self._signer is None:
+            # No static keys (e.g. instance role): fall back to the client's signer
+            return get_s3_client().generate_presigned_url(
+                "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=lifetime)
+        signed_at = datetime.fromtimestamp(window * self.reuse_seconds, tz=timezone.utc)
+        return self._signer.presign_get(bucket, key, lifetime, signed_at)
+
+    def urls(self, bucket: str, keys: List[str], expires_in: int = 3600) -> List[str]:
+        """Presigned GET URLs for many keys of one bucket, in order"""
+        window = int(datetime.now(timezone.utc).timestamp()) // self.reuse_seconds
+        result: List[Optional[str]] = []
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                cache_key = (bucket, key, expires_in, window)
+                url = self._entries.get(cache_key)
+                if url is None:
+                    missing.append(i)
+                else:
+                    self._entries.move_to_end(cache_key)
+                result.append(url)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        signed = [(i, self._sign(bucket, keys[i], expires_in, window)) for i in missing]
+
+        with self._lock:
+            for i, url in signed:
+                result[i] = url
+                self._entries[(bucket, keys[i], expires_in, window)] = url
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+
+    def url(self, bucket: str, key: str, expires_in: int = 3600) -> str:
+        return self.urls(bucket, [key], expires_in)[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "reuse_seconds": self.reuse_seconds,
+                "local_signer": self._signer is not None,
+            }
+
+
+_presign_cache: Optional[PresignCache] = None
+_presign_lock = threading.Lock()
+
+
+def get_presign_cache() -> PresignCache:
+    """Return the process-wide presign cache"""
+    global _presign_cache
+    if _presign_cache is None:
+        with _presign_lock:
+            if _presign_cache is None:
+                _presign_cache = PresignCache()
+    return _presign_cache
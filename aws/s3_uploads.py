@@ -0,0 +1,130 @@
+"""
+Streaming S3 uploads for the AWS service
+Multipart uploads with parallel parts and SHA-256 checksums computed on the fly
+"""
+import os
+import base64
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Optional, Dict, Any, List
+
+from s3_client import s3_call
+
+logger = logging.getLogger(__name__)
+
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3 minimum for every part but the last
+MAX_PARTS = 10000
+UPLOAD_PART_SIZE = max(MIN_PART_SIZE, int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024))))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+
+
+def sha256_b64(body: bytes) -> str:
+    """Base64 SHA-256, the form S3 expects in ChecksumSHA256"""
+    return base64.b64encode(hashlib.sha256(body).digest()).decode("ascii")
+
+
+def upload_part(s3_client, bucket: str, key: str, upload_id: str, part_number: int,
+                body: bytes, checksum: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Upload one part with its SHA-256 checksum (blocking; run through s3_call).
+
+    S3 rejects the part if the body does not match the checksum, so a part
+    corrupted in transit is never stored.
+    """
+    checksum = checksum or sha256_b64(body)
+    response = s3_client.upload_part(
+        Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+        Body=body, ChecksumSHA256=checksum,
+    )
+    return {"PartNumber": part_number, "ETag": response["ETag"], "ChecksumSHA256": checksum}
+
+
+async def iter_upload_file(file, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """Read an UploadFile in chunks instead of all at once"""
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+async def stream_upload(s3_client, bucket: str, key: str, chunks: AsyncIterator[bytes],
+                        content_type: Optional[str] = None,
+                        part_size: int = UPLOAD_PART_SIZE,
+                        concurrency: int = UPLOAD_CONCURRENCY) -> Dict[str, Any]:
+    """
+    Upload a stream of chunks to S3 without holding the whole body.
+
+    Bodies smaller than one part go out as a single put_object. Larger ones
+    become a multipart upload with up to `concurrency` parts in flight, so
+    memory stays within part_size * (concurrency + 1). A failed upload is
+    aborted so no orphaned parts are billed.
+
+    Returns the size, the SHA-256 of the whole body (hex) and the part count.
+    """
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    size = 0
+    upload_id: Optional[str] = None
+    part_number = 0
+    parts: List[Dict[str, Any]] = []
+    tasks: List[asyncio.Task] = []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(number: int, body: bytes):
+        try:
+            parts.append(await s3_call(upload_part, s3_client, bucket, key, upload_id, number, body))
+        finally:
+            slots.release()
+
+    try:
+        async for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+            buffer += chunk
+            while len(buffer) >= part_size:
+                if upload_id is None:
+                    extra = {"ContentType": content_type} if content_type else {}
+                    created = await s3_call(s3_client.create_multipart_upload, Bucket=bucket, Key=key,
+                                            ChecksumAlgorithm="SHA256", **extra)
+                    upload_id = created["UploadId"]
+                part_number += 1
+                if part_number > MAX_PARTS:
+                    raise ValueError("Upload exceeds the maximum number of parts")
+                body = bytes(buffer[:part_size])
+                del buffer[:part_size]
+                await slots.acquire()
+                for task in tasks:
+                    if task.done() and task.exception():
+                        raise task.exception()
+                tasks.append(asyncio.create_task(send(part_number, body)))
+
+        if upload_id is None:
+            body = bytes(buffer)
+            extra = {"ContentType": content_type} if content_type else {}
+            await s3_call(s3_client.put_object, Bucket=bucket, Key=key, Body=body,
+                          ChecksumSHA256=base64.b64encode(digest.digest()).decode("ascii"), **extra)
+            return {"size": size, "sha256": digest.hexdigest(), "parts": 1}
+
+        if buffer:
+            part_number += 1
+            await slots.acquire()
+            tasks.append(asyncio.create_task(send(part_number, bytes(buffer))))
+            buffer.clear()
+        await asyncio.gather(*tasks)
+
+        parts.sort(key=lambda part: part["PartNumber"])
+        await s3_call(s3_client.complete_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id,
+                      MultipartUpload={"Parts": parts})
+        return {"size": size, "sha256": digest.hexdigest(), "parts": len(parts)}
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if upload_id is not None:
+            try:
+                await s3_call(s3_client.abort_multipart_upload, Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception as e:
+                logger.error(f"Failed to abort multipart upload {upload_id} for {key}: {e}")
+        raise
@@ -20,15 +20,26 @@ logger = logging.getLogger(__name__)
 import psycopg2                                             # type: ignore
 from psycopg2 import connect, Error as psycopg2Error     # type: ignore
 from psycopg2.extras import RealDictCursor    # type: ignore
-from psycopg2.pool import ThreadedConnectionPool         # type: ignore
 from browser_use import Agent, BrowserSession         # type: ignore        
 from browser_use.llm import ChatOpenAI                  # type: ignore
 from dotenv import load_dotenv                      # type: ignore                
 from fastapi.middleware.cors import CORSMiddleware  # type: ignore
 from browser_use import Controller  # type: ignore
 from typing import Union, Dict, Any
+from fastapi.concurrency import run_in_threadpool  # type: ignore
+import sys
 load_dotenv()
 
+# Add the shared auth directory to the Python path
+auth_path = os.path.join(os.path.dirname(__file__), 'auth')
+sys.path.append(auth_path)
+
+# Pool sizing and statement timeout come from DB_MIN_CONN / DB_MAX_CONN / DB_STATEMENT_TIMEOUT_MS
+from db_pool import get_db, get_pool
+from jwt_auth import get_authenticator
+
+authenticator = get_authenticator()
+
 logging.getLogger().setLevel(logging.WARNING)
 
 # Optionally, configure browser_use logger specifically
@@ -56,97 +67,19 @@ AUTH_SERVICE_BASE = os.getenv("AUTH_SERVICE_BASE", "http://login_register_user:8
 AUTH_url = os.getenv("AUTH_URL", f"{AUTH_SERVICE_BASE}/user-login")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=AUTH_url, auto_error=False)
 
-# Database connection pool
-DB_MIN_CONN = int(os.getenv("DB_MIN_CONN", "1"))
-DB_MAX_CONN = int(os.getenv("DB_MAX_CONN", "10"))
-DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
-
-db_pool: ThreadedConnectionPool | None = None
-
-def init_db_pool() -> None:
-    global db_pool
-    if db_pool is None:
-        db_pool = ThreadedConnectionPool(
-            minconn=DB_MIN_CONN,
-            maxconn=DB_MAX_CONN,
-            dsn=(
-                f"dbname={os.getenv('DB_NAME')} "
-                f"user={os.getenv('DB_USER')} "
-                f"password={os.getenv('DB_PASSWORD')} "
-                f"host={os.getenv('DB_HOST')} "
-                f"port={os.getenv('DB_PORT')}"
-            ),
-            cursor_factory=RealDictCursor,
-        )
-
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),  # Default PostgreSQL port
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Error connecting to database: {e}")
-
-def get_db():
-    # Prefer pooled connection if available
-    init_db_pool()
-    if db_pool is None:
-        conn = connect_db()
-    else:
-        conn = db_pool.getconn()
-    try:
-        # Set a per-connection statement timeout (milliseconds)
-        with conn.cursor() as c:
-            c.execute("SET statement_timeout TO %s", (DB_STATEMENT_TIMEOUT_MS,))
-        yield conn
-    finally:
-        try:
-            if db_pool is None:
-                conn.close()
-            else:
-                db_pool.putconn(conn)
-        except Exception:
-            try:
-                conn.close()
-            except Exception:
-                pass
-
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    if token is None:
-        logger.error("No token provided in Authorization header")
-        raise credentials_exception
-    try:
-        # Pass the token directly to the auth service for validation
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {token}"}
-            logger.info("Calling auth service /user/me")
-            response = await client.get(f"{AUTH_SERVICE_BASE}/user/me", headers=headers)
-            logger.info(f"/user/me response status: {response.status_code}")
-            if response.status_code != 200:
-                logger.error(f"Auth service returned status {response.status_code}")
-                raise credentials_exception
-            user_data = response.json()
-            return {"username": user_data["username"], "user_id": user_data["user_id"]}
-    except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP error in get_current_user: {str(e)}")
-        raise credentials_exception
-    except Exception as e:
-        logger.error(f"Error in get_current_user: {str(e)}")
-        raise credentials_exception
-
-
-        
+@app.get("/health/db")
+async def database_health():
+    """Database pool health and saturation metrics"""
+    result = await run_in_threadpool(get_pool().health_check)
+    return JSONResponse(status_code=200 if result["healthy"] else 503, content=result)
+
+def get_current_user(token: str = Depends(oauth2_scheme), db = Depends(get_db)):  # type: ignore
+    """Verify the bearer token locally: signature, revocation and user claims.
+
+    Cache misses are looked up on the request's own connection (get_db is
+    cached per request), not a second one from the pool.
+    """
+    return authenticator.require_user(token, db)
 
 class Agreement(BaseModel):
     ref_id : str
@@ -180,7 +113,7 @@ def validate_file_extension(filename: str) -> bool:
 
 
 @app.get("/invitations")
-async def get_invitations(
+def get_invitations(
     current_user: dict = Depends(get_current_user),
     db = Depends(get_db)  # type: ignore
 ):
@@ -209,7 +142,7 @@ async def get_invitations(
 
 
 @app.get("/updates")
-async def get_updates(
+def get_updates(
     current_user: dict = Depends(get_current_user),
     db = Depends(get_db)  # type: ignore
 ):
@@ -239,7 +172,7 @@ async def get_updates(
 
 
 @app.get("/updates/{ref_id}")
-async def get_ref_id_updates(
+def get_ref_id_updates(
     ref_id: str,
     current_user: dict = Depends(get_current_user),
     db = Depends(get_db)  # type: ignore
@@ -266,7 +199,7 @@ async def get_ref_id_updates(
 
 
 @app.post("/agreement/accept")
-async def accept_agreement_update(
+def accept_agreement_update(
     agreement: Agreement,
     current_user: dict = Depends(get_current_user),
     db = Depends(get_db)  # type: ignore
@@ -288,7 +221,7 @@ async def accept_agreement_update(
     return {"message": "Update accepted successfully"}
 
 @app.post("/agreement/reject")
-async def reject_agreement_update(
+def reject_agreement_update(
     agreement: Agreement,
     current_user: dict = Depends(get_current_user),
     db = Depends(get_db)  # type: ignore
@@ -313,7 +246,7 @@ async def reject_agreement_update(
 
 
 @app.get("/verified-active-cards/", response_model=active_cards)
-async def get_verified_active_cards(
+def get_verified_active_cards(
     current_user: dict = Depends(get_current_user),
     db = Depends(get_db)  # type: ignore
 ):
@@ -336,7 +269,7 @@ async def get_verified_active_cards(
 
 # Check if any user cards expire within the next N days (configurable)
 @app.get("/expiry-check/", response_model=active_cards)
-async def check_expiry_dates(
+def check_expiry_dates(
     current_user: dict = Depends(get_current_user),
     db = Depends(get_db)  # type: ignore
 ):
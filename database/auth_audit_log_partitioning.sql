@@ -0,0 +1,98 @@
+-- =============================================
+-- MIGRATION: PARTITION auth_audit_log BY MONTH
+-- =============================================
+-- Converts an existing unpartitioned auth_audit_log into the monthly
+-- range-partitioned layout defined in enhanced_auth_schema.sql.
+--
+-- Run enhanced_auth_schema.sql first (it defines the partition functions and
+-- is a no-op for the existing table), then run this file once:
+--   psql -d certcheck -f database/auth_audit_log_partitioning.sql
+--
+-- The copy runs inside one transaction and holds an exclusive lock on the old
+-- table for its duration; schedule it in a quiet window. Rows older than the
+-- retention period are not copied.
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'auth_audit_log'
+    ) THEN
+        RAISE EXCEPTION 'auth_audit_log is already partitioned';
+    END IF;
+END $$;
+
+LOCK TABLE auth_audit_log IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE auth_audit_log RENAME TO auth_audit_log_unpartitioned;
+ALTER INDEX IF EXISTS auth_audit_log_pkey RENAME TO auth_audit_log_unpartitioned_pkey;
+ALTER INDEX IF EXISTS idx_audit_log_user RENAME TO idx_audit_log_unpartitioned_user;
+ALTER INDEX IF EXISTS idx_audit_log_action RENAME TO idx_audit_log_unpartitioned_action;
+ALTER INDEX IF EXISTS idx_audit_log_success RENAME TO idx_audit_log_unpartitioned_success;
+ALTER INDEX IF EXISTS idx_audit_log_created_at RENAME TO idx_audit_log_unpartitioned_created_at;
+ALTER INDEX IF EXISTS idx_audit_log_failed_login RENAME TO idx_audit_log_unpartitioned_failed_login;
+
+CREATE TABLE auth_audit_log (
+    log_id BIGSERIAL,
+    user_id INTEGER,
+    user_type VARCHAR(10) CHECK (user_type IN ('user', 'admin')),
+    username VARCHAR(255),
+    action VARCHAR(50) NOT NULL,
+    ip_address INET,
+    user_agent TEXT,
+    success BOOLEAN NOT NULL,
+    details JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (log_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX idx_audit_log_user ON auth_audit_log(user_id, created_at);
+CREATE INDEX idx_audit_log_action ON auth_audit_log(action, created_at);
+CREATE INDEX idx_audit_log_success ON auth_audit_log(success, created_at);
+CREATE INDEX idx_audit_log_created_at ON auth_audit_log(created_at);
+CREATE INDEX idx_audit_log_failed_login ON auth_audit_log(username, user_type, created_at)
+    WHERE success = FALSE AND action IN ('login_failed', 'login_attempt');
+
+-- One partition per month that still has rows within retention, plus the months ahead
+DO $$
+DECLARE
+    month_start DATE;
+    partition_name TEXT;
+BEGIN
+    FOR month_start IN
+        SELECT DISTINCT date_trunc('month', created_at)::DATE
+        FROM auth_audit_log_unpartitioned
+        WHERE created_at >= LOCALTIMESTAMP - INTERVAL '90 days'
+    LOOP
+        partition_name := 'auth_audit_log_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF auth_audit_log FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::DATE
+            );
+        END IF;
+    END LOOP;
+END $$;
+
+SELECT ensure_auth_audit_log_partitions();
+
+CREATE TABLE auth_audit_log_default PARTITION OF auth_audit_log DEFAULT;
+
+INSERT INTO auth_audit_log (log_id, user_id, user_type, username, action, ip_address, user_agent, success, details, created_at)
+SELECT log_id, user_id, user_type, COALESCE(username, details->'details'->>'username'),
+       action, ip_address, user_agent, success, details,
+       COALESCE(created_at, LOCALTIMESTAMP)
+FROM auth_audit_log_unpartitioned
+WHERE created_at >= LOCALTIMESTAMP - INTERVAL '90 days' OR created_at IS NULL;
+
+SELECT setval(
+    pg_get_serial_sequence('auth_audit_log', 'log_id'),
+    GREATEST((SELECT COALESCE(MAX(log_id), 0) FROM auth_audit_log_unpartitioned), 1)
+);
+
+DROP TABLE auth_audit_log_unpartitioned;
+
+COMMIT;
@@ -16,6 +16,8 @@ CREATE TABLE IF NOT EXISTS token_blacklist (
 -- Index for fast cleanup of expired tokens
 CREATE INDEX IF NOT EXISTS idx_token_blacklist_expires ON token_blacklist(expires_at);
 CREATE INDEX IF NOT EXISTS idx_token_blacklist_user ON token_blacklist(user_id, user_type);
+-- Index for incremental polling by service-side blacklist caches
+CREATE INDEX IF NOT EXISTS idx_token_blacklist_revoked ON token_blacklist(revoked_at);
 
 -- =============================================
 -- REFRESH TOKENS TABLE
@@ -24,7 +26,8 @@ CREATE TABLE IF NOT EXISTS refresh_tokens (
     token_id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL,
     user_type VARCHAR(10) NOT NULL CHECK (user_type IN ('user', 'admin')),
-    token_hash VARCHAR(255) NOT NULL, -- bcrypt hashed refresh token
+    selector VARCHAR(32), -- public lookup half of "selector.verifier" tokens (NULL for legacy tokens)
+    token_hash VARCHAR(255) NOT NULL, -- HMAC-SHA256 of the verifier (bcrypt for legacy tokens)
     jti VARCHAR(36) UNIQUE NOT NULL,
     expires_at TIMESTAMP NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -38,7 +41,12 @@ CREATE TABLE IF NOT EXISTS refresh_tokens (
 -- FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
 -- FOREIGN KEY (user_id) REFERENCES admins(admin_id) ON DELETE CASCADE
 
+-- Migration: existing deployments predate the selector column. Rows without a
+-- selector are legacy bcrypt-hashed tokens and age out within REFRESH_TOKEN_EXPIRE_DAYS.
+ALTER TABLE refresh_tokens ADD COLUMN IF NOT EXISTS selector VARCHAR(32);
+
 -- Indexes for performance
+CREATE UNIQUE INDEX IF NOT EXISTS idx_refresh_tokens_selector ON refresh_tokens(selector);
 CREATE INDEX IF NOT EXISTS idx_refresh_tokens_user ON refresh_tokens(user_id, user_type, expires_at);
 CREATE INDEX IF NOT EXISTS idx_refresh_tokens_jti ON refresh_tokens(jti);
 CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires ON refresh_tokens(expires_at);
@@ -64,24 +72,184 @@ CREATE INDEX IF NOT EXISTS idx_rate_limits_expires ON rate_limits(expires_at);
 -- =============================================
 -- AUDIT LOG TABLE
 -- =============================================
+-- Range-partitioned by month on created_at. Retention detaches and drops
+-- whole partitions instead of DELETEing rows. Existing unpartitioned tables
+-- are converted by database/auth_audit_log_partitioning.sql.
 CREATE TABLE IF NOT EXISTS auth_audit_log (
-    log_id SERIAL PRIMARY KEY,
+    log_id BIGSERIAL,
     user_id INTEGER,
     user_type VARCHAR(10) CHECK (user_type IN ('user', 'admin')),
+    username VARCHAR(255),
     action VARCHAR(50) NOT NULL,
     ip_address INET,
     user_agent TEXT,
     success BOOLEAN NOT NULL,
     details JSONB,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (log_id, created_at)
+) PARTITION BY RANGE (created_at);
 
--- Indexes for audit log queries
+-- Username attempted, copied out of details at write time for lockout lookups
+ALTER TABLE auth_audit_log ADD COLUMN IF NOT EXISTS username VARCHAR(255);
+
+-- Indexes for audit log queries (created on every partition)
 CREATE INDEX IF NOT EXISTS idx_audit_log_user ON auth_audit_log(user_id, created_at);
 CREATE INDEX IF NOT EXISTS idx_audit_log_action ON auth_audit_log(action, created_at);
 CREATE INDEX IF NOT EXISTS idx_audit_log_success ON auth_audit_log(success, created_at);
 CREATE INDEX IF NOT EXISTS idx_audit_log_created_at ON auth_audit_log(created_at);
 
+-- Failed logins by username (get_failed_login_attempts). Existing rows can be
+-- backfilled with:
+--   UPDATE auth_audit_log SET username = details->'details'->>'username'
+--   WHERE username IS NULL AND details->'details' ? 'username';
+CREATE INDEX IF NOT EXISTS idx_audit_log_failed_login
+ON auth_audit_log(username, user_type, created_at)
+WHERE success = FALSE AND action IN ('login_failed', 'login_attempt');
+
+-- Create monthly partitions auth_audit_log_pYYYYMM from the current month
+-- through months_ahead months ahead, plus any month that already has rows in
+-- auth_audit_log_default (a missed run or clock skew). Those rows are moved
+-- into the new partition: PostgreSQL refuses to create a partition whose
+-- range overlaps rows held by the default, so the default is detached for
+-- the move and reattached afterwards. Safe to call repeatedly.
+CREATE OR REPLACE FUNCTION ensure_auth_audit_log_partitions(months_ahead INTEGER DEFAULT 3)
+RETURNS INTEGER AS $$
+DECLARE
+    created_count INTEGER := 0;
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    has_default BOOLEAN := to_regclass('auth_audit_log_default') IS NOT NULL;
+    has_rows BOOLEAN := FALSE;
+    column_list TEXT := 'log_id, user_id, user_type, username, action, ip_address, user_agent, success, details, created_at';
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'auth_audit_log'
+    ) THEN
+        RAISE NOTICE 'auth_audit_log is not partitioned; run auth_audit_log_partitioning.sql';
+        RETURN 0;
+    END IF;
+
+    -- Dynamic so the function also runs before the default partition exists
+    FOR month_start IN EXECUTE
+        'SELECT (date_trunc(''month'', LOCALTIMESTAMP) + make_interval(months => i))::DATE '
+        'FROM generate_series(0, $1) AS i'
+        || CASE WHEN has_default
+                THEN ' UNION SELECT date_trunc(''month'', created_at)::DATE FROM auth_audit_log_default'
+                ELSE '' END
+        || ' ORDER BY 1'
+        USING months_ahead
+    LOOP
+        month_end := (month_start + INTERVAL '1 month')::DATE;
+        partition_name := 'auth_audit_log_p' || to_char(month_start, 'YYYYMM');
+        IF to_regclass(partition_name) IS NOT NULL THEN
+            CONTINUE;
+        END IF;
+
+        IF has_default THEN
+            has_rows := EXISTS (
+                SELECT 1 FROM auth_audit_log_default
+                WHERE created_at >= month_start AND created_at < month_end
+            );
+        END IF;
+
+        IF has_rows THEN
+            ALTER TABLE auth_audit_log DETACH PARTITION auth_audit_log_default;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF auth_audit_log FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            -- Through the parent, so columns are matched by name and rows route to the new partition
+            EXECUTE format(
+                'INSERT INTO auth_audit_log (%s) SELECT %s FROM auth_audit_log_default '
+                'WHERE created_at >= %L AND created_at < %L',
+                column_list, column_list, month_start, month_end
+            );
+            DELETE FROM auth_audit_log_default
+            WHERE created_at >= month_start AND created_at < month_end;
+            ALTER TABLE auth_audit_log ATTACH PARTITION auth_audit_log_default DEFAULT;
+        ELSE
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF auth_audit_log FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+        END IF;
+        created_count := created_count + 1;
+    END LOOP;
+
+    RETURN created_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach and drop monthly partitions whose whole range is older than
+-- retention_days, and delete expired rows from the default partition.
+-- Returns the number of rows removed; for dropped partitions this is the
+-- planner estimate (pg_class.reltuples), so no partition is scanned to count it.
+CREATE OR REPLACE FUNCTION drop_auth_audit_log_partitions(retention_days INTEGER DEFAULT 90)
+RETURNS INTEGER AS $$
+DECLARE
+    dropped_rows INTEGER := 0;
+    partition_rows INTEGER;
+    part RECORD;
+    cutoff TIMESTAMP := LOCALTIMESTAMP - make_interval(days => retention_days);
+BEGIN
+    FOR part IN
+        SELECT c.relname, GREATEST(c.reltuples, 0)::INTEGER AS estimated_rows
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'auth_audit_log'
+        AND c.relname ~ '^auth_audit_log_p[0-9]{6}$'
+    LOOP
+        -- Upper bound of auth_audit_log_pYYYYMM is the first day of the next month
+        IF to_date(right(part.relname, 6), 'YYYYMM') + INTERVAL '1 month' <= cutoff THEN
+            EXECUTE format('ALTER TABLE auth_audit_log DETACH PARTITION %I', part.relname);
+            EXECUTE format('DROP TABLE %I', part.relname);
+            dropped_rows := dropped_rows + part.estimated_rows;
+        END IF;
+    END LOOP;
+
+    -- Rows that landed in the default partition are not covered by the drops above
+    IF to_regclass('auth_audit_log_default') IS NOT NULL THEN
+        DELETE FROM auth_audit_log_default WHERE created_at < cutoff;
+        GET DIAGNOSTICS partition_rows = ROW_COUNT;
+        dropped_rows := dropped_rows + partition_rows;
+    END IF;
+
+    RETURN dropped_rows;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Catch-all for rows outside the pre-created months (e.g. clock skew)
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_partitioned_table pt
+        JOIN pg_class c ON c.oid = pt.partrelid
+        WHERE c.relname = 'auth_audit_log'
+    ) THEN
+        CREATE TABLE IF NOT EXISTS auth_audit_log_default PARTITION OF auth_audit_log DEFAULT;
+    END IF;
+END $$;
+
+SELECT ensure_auth_audit_log_partitions();
+
+-- Per-day rollup of auth_audit_log for get_audit_statistics. Maintained by the
+-- audit writer in the same transaction as the audit rows; user_sketch and
+-- ip_sketch are serialized HyperLogLog sketches (auth/hyperloglog.py).
+CREATE TABLE IF NOT EXISTS auth_audit_daily_rollup (
+    day DATE NOT NULL,
+    action VARCHAR(50) NOT NULL,
+    success BOOLEAN NOT NULL,
+    event_count BIGINT NOT NULL DEFAULT 0,
+    user_sketch BYTEA,
+    ip_sketch BYTEA,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (day, action, success)
+);
+
 -- =============================================
 -- UPDATE EXISTING TABLES
 -- =============================================
@@ -129,10 +297,10 @@ BEGIN
     GET DIAGNOSTICS temp_count = ROW_COUNT;
     deleted_count := deleted_count + temp_count;
     
-    -- Clean up old audit logs (keep last 90 days)
-    DELETE FROM auth_audit_log WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '90 days';
-    GET DIAGNOSTICS temp_count = ROW_COUNT;
-    deleted_count := deleted_count + temp_count;
+    -- Clean up old audit logs (keep last 90 days) by dropping whole partitions
+    PERFORM ensure_auth_audit_log_partitions();
+    deleted_count := deleted_count + drop_auth_audit_log_partitions(90);
+    DELETE FROM auth_audit_daily_rollup WHERE day < CURRENT_DATE - 90;
     
     RETURN deleted_count;
 END;
@@ -183,7 +351,9 @@ ON CONFLICT (identifier, endpoint, window_start) DO NOTHING;
 -- GRANT SELECT, INSERT, UPDATE, DELETE ON refresh_tokens TO your_app_user;
 -- GRANT SELECT, INSERT, UPDATE, DELETE ON rate_limits TO your_app_user;
 -- GRANT SELECT, INSERT ON auth_audit_log TO your_app_user;
+-- GRANT SELECT, INSERT, UPDATE, DELETE ON auth_audit_daily_rollup TO your_app_user;
 -- GRANT USAGE, SELECT ON SEQUENCE token_blacklist_jti_seq TO your_app_user;
 -- GRANT USAGE, SELECT ON SEQUENCE refresh_tokens_token_id_seq TO your_app_user;
 -- GRANT USAGE, SELECT ON SEQUENCE rate_limits_id_seq TO your_app_user;
 -- GRANT USAGE, SELECT ON SEQUENCE auth_audit_log_log_id_seq TO your_app_user;
+-- Partition maintenance (ensure/drop_auth_audit_log_partitions) needs the table owner
@@ -0,0 +1,34 @@
+-- =============================================
+-- FACE EMBEDDINGS (VISION SERVICE)
+-- =============================================
+-- Reference (ID photo) embeddings stored by /facial-recognition so a retry
+-- with the same ID image only embeds the selfie. Rows are keyed by the
+-- SHA-256 of the uploaded image bytes, so re-uploading the same document
+-- under another filename still hits, and a new document never reuses stale
+-- vectors.
+--
+-- embeddings holds face_count x dims little-endian float32 values
+-- (2 KB per Facenet512 face); facial_areas holds one detector box per face,
+-- in the same order.
+--
+--   psql -d certcheck -f database/face_embeddings.sql
+CREATE TABLE IF NOT EXISTS face_embeddings (
+    embedding_id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    id_image_url TEXT NOT NULL,
+    content_sha256 CHAR(64) NOT NULL,
+    model_name VARCHAR(50) NOT NULL,
+    detector_backend VARCHAR(30) NOT NULL,
+    dims SMALLINT NOT NULL,
+    face_count SMALLINT NOT NULL,
+    embeddings BYTEA NOT NULL,
+    facial_areas JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (user_id, content_sha256, model_name, detector_backend),
+    CHECK (octet_length(embeddings) = face_count * dims * 4)
+);
+
+CREATE INDEX IF NOT EXISTS idx_face_embeddings_image ON face_embeddings(user_id, id_image_url);
+-- For pruning embeddings of ID images nobody has verified against in a while
+CREATE INDEX IF NOT EXISTS idx_face_embeddings_last_used ON face_embeddings(last_used_at);
@@ -56,6 +56,27 @@ const CertificateUpload = () => {
     }
   };
 
+  // Upload the file straight to S3 with a presigned POST policy, then have the
+  // vision service read it from S3, so the bytes cross our network only once.
+  const uploadDirectToS3 = async (file: File) => {
+    const authHeaders = { Authorization: `Bearer ${token}` };
+    const { data: policy } = await apiClient.post(
+      '/aws/presigned-upload/',
+      { filename: file.name, folder: 'certificates' },
+      { headers: authHeaders },
+    );
+
+    const s3Form = new FormData();
+    Object.entries(policy.fields as Record<string, string>).forEach(([name, value]) => s3Form.append(name, value));
+    s3Form.append('file', file);  // must be the last field
+    const s3Response = await fetch(policy.url, { method: 'POST', body: s3Form });
+    if (!s3Response.ok) {
+      throw new Error(`S3 upload failed with status ${s3Response.status}`);
+    }
+
+    return apiClient.post('/vision/cert-to-json/from-s3', { key: policy.key }, { headers: authHeaders });
+  };
+
   const handleUpload = async () => {
     if (!selectedFile) return;
 
@@ -71,15 +92,22 @@ const CertificateUpload = () => {
 
     setIsUploading(true);
     try {
-      const formData = new FormData();
-      formData.append('file', selectedFile);
-      console.log('token:', token);
-      const response = await apiClient.post('/vision/cert-to-json', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-          'Authorization': `Bearer ${token}`,
-        },
-      });
+      let response;
+      try {
+        response = await uploadDirectToS3(selectedFile);
+      } catch (directError: any) {
+        // S3 unreachable (network/CORS): fall back to uploading through the vision service
+        if (directError.response) throw directError;
+        console.warn('Direct upload failed, falling back to proxied upload:', directError);
+        const formData = new FormData();
+        formData.append('file', selectedFile);
+        response = await apiClient.post('/vision/cert-to-json', formData, {
+          headers: {
+            'Content-Type': 'multipart/form-data',
+            'Authorization': `Bearer ${token}`,
+          },
+        });
+      }
 
       console.log('Certificate upload response:', response.data);
 
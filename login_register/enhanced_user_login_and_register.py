@@ -4,7 +4,8 @@ Includes token blacklisting, refresh tokens, rate limiting, and audit logging
 """
 
 from fastapi import FastAPI, Depends, HTTPException, status, Query, Request    # type: ignore
-from fastapi.responses import StreamingResponse    # type: ignore
+from fastapi.responses import StreamingResponse, JSONResponse, Response    # type: ignore
+from fastapi.concurrency import run_in_threadpool    # type: ignore
 from pydantic import BaseModel, EmailStr, Field
 from datetime import date
 import psycopg2                                               # type: ignore
@@ -13,11 +14,10 @@ from fastapi.middleware.cors import CORSMiddleware  # type: ignore
 import re
 import uvicorn                                                # type: ignore
 from jose import JWTError, jwt, ExpiredSignatureError  # type: ignore
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from passlib.context import CryptContext  # type: ignore
 from datetime import datetime, timedelta
 import os
-import bcrypt                   # type: ignore
 from dotenv import load_dotenv  # type: ignore
 from contextlib import asynccontextmanager
 from fastapi.security import OAuth2PasswordBearer   # type: ignore
@@ -40,8 +40,17 @@ sys.path.append(auth_path)
 from token_manager import TokenManager
 from rate_limiter import RateLimiter, rate_limit
 from audit_logger import AuditLogger
+from db_pool import get_db, get_pool
+from blacklist_cache import get_blacklist_cache
+from audit_writer import get_audit_writer
+from kdf_pool import get_kdf_pool, run_kdf, KDFPoolSaturated
 
 # Import security modules (using local implementations)
+from password_hashing import get_password_hasher
+from user_cache import user_cache, IDENTITY_COLUMNS
+from image_cache import (get_image_cache, not_modified, parse_range, iter_file, content_type_for, THUMBNAIL_WIDTHS,
+                         ObjectTooLarge, NotAnImage)
+from s3_client import get_s3_client, s3_call
 from security_rate_limiter import LOGIN_RATE_LIMIT, REGISTER_RATE_LIMIT, GENERAL_RATE_LIMIT
 from file_validator import validate_upload_file
 from security_middleware import SecurityHeadersMiddleware, RequestLoggingMiddleware, get_secure_cors_middleware
@@ -58,17 +67,12 @@ AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY") 
 BUCKET_NAME = os.getenv("BUCKET_NAME")  
 
-# Password hashing functions
+# Password hashing functions (CPU-bound: call through run_kdf from async endpoints)
 def hash_password(password):
-    pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password=pwd_bytes, salt=salt)
-    return hashed_password.decode('utf-8')
+    return get_password_hasher().hash(password)
 
 def verify_password(plain_password, hashed_password):
-    password_byte_enc = plain_password.encode('utf-8')
-    hashed_password_bytes = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(password=password_byte_enc, hashed_password=hashed_password_bytes)
+    return get_password_hasher().verify(plain_password, hashed_password)
 
 def generate_presigned_url(s3_path: str, expiration: int = 3600) -> str:
     """Generate a proxy URL for an S3 object through our image endpoint"""
@@ -95,28 +99,6 @@ def generate_presigned_url(s3_path: str, expiration: int = 3600) -> str:
 def get_password_hash(password):
     return hash_password(password)
 
-# Database connection
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Error connecting to database: {e}")
-
-def get_db():
-    conn = connect_db()
-    try:
-        yield conn
-    finally:
-        conn.close()
-
 # Initialize auth services
 def get_token_manager(conn: connection = Depends(get_db)) -> TokenManager:
     return TokenManager(conn)
@@ -157,12 +139,24 @@ def create_s3_user_folder(user_id: int, bucket_name: str):
 
 # Enhanced token validation
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="user/me")
-async def get_current_user(
+def _load_identity(conn: connection, column: str, value) -> Optional[dict]:
+    """Fetch a user's identity row on the request's connection and cache it"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT {IDENTITY_COLUMNS} FROM users WHERE {column} = %s", (value,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if row:
+        user_cache.put(row)
+    return row
+
+def get_current_user(
     token: str = Depends(oauth2_scheme),
-    token_manager: TokenManager = Depends(get_token_manager)
+    token_manager: TokenManager = Depends(get_token_manager),
+    conn: connection = Depends(get_db)
 ):
-    print(f"🔍 get_current_user called with token: {token}")
-    
+    """Resolve the bearer token to the user's identity row (user_id, names, username, date_of_birth)"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -182,42 +176,40 @@ async def get_current_user(
             # Check if sub is actually a user_id (numeric) or username (email)
             try:
                 user_id = int(user_id_str)
-                print(f"✅ Enhanced token validation successful for user_id: {user_id}")
-                # For enhanced tokens, we need to get username from database
-                conn = connect_db()
-                try:
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT username FROM users WHERE user_id = %s", (user_id,))
-                    user_data = cursor.fetchone()
-                    if not user_data:
-                        print(f"❌ User not found for user_id: {user_id}")
-                        raise credentials_exception
-                    return {"username": user_data["username"]}
-                finally:
-                    cursor.close()
-                    conn.close()
             except ValueError:
                 # If user_id_str is not numeric, it's actually a username (legacy format)
-                print("🔄 Enhanced token manager succeeded but sub is username, trying legacy format...")
-                pass
+                user_id = None
+            if user_id is not None:
+                user_data = user_cache.get(user_id) or _load_identity(conn, "user_id", user_id)
+                if not user_data:
+                    print(f"❌ User not found for user_id: {user_id}")
+                    raise credentials_exception
+                return user_data
         
         # Fallback: Try old token format (direct JWT decode)
-        print("🔄 Trying legacy token format...")
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             print("❌ Username is None in legacy token")
             raise credentials_exception
         
-        print(f"✅ Legacy token validation successful for user: {username}")
-        return {"username": username}
+        user_data = user_cache.get_by_username(username) or _load_identity(conn, "username", username)
+        if not user_data:
+            raise credentials_exception
+        return user_data
         
     except Exception as e:
         print(f"❌ Token validation error: {e}")
         raise credentials_exception
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pick the password hash cost for this host before taking traffic
+    await run_in_threadpool(get_password_hasher().calibrate)
+    yield
+
 # FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # CORS configuration
 origins = [
@@ -240,6 +232,37 @@ app.add_middleware(
 app.add_middleware(SecurityHeadersMiddleware)
 app.add_middleware(RequestLoggingMiddleware)
 
+@app.get("/health/db")
+async def database_health():
+    """Database pool health and saturation metrics"""
+    result = await run_in_threadpool(get_pool().health_check)
+    return JSONResponse(status_code=200 if result["healthy"] else 503, content=result)
+
+@app.get("/health/blacklist-cache")
+async def blacklist_cache_health():
+    """Token blacklist cache hit/miss counters"""
+    return get_blacklist_cache().stats()
+
+@app.get("/health/audit-log")
+async def audit_log_health():
+    """Audit log writer queue depth and write/drop counters"""
+    return get_audit_writer().stats()
+
+@app.get("/health/user-cache")
+async def user_cache_health():
+    """Identity cache size and hit/miss counters for token resolution"""
+    return user_cache.stats()
+
+@app.get("/health/image-cache")
+async def image_cache_health():
+    """Image cache size and hit/miss counters"""
+    return get_image_cache().stats()
+
+@app.get("/health/kdf")
+async def kdf_pool_health():
+    """Password hashing pool queue depth, rejections and queue vs compute time"""
+    return get_kdf_pool().stats()
+
 # Pydantic models
 class UserCreate(BaseModel):
     first_name: str = Field(..., min_length=1, max_length=50)
@@ -310,41 +333,17 @@ class active_cards(BaseModel):
 # Enhanced authentication endpoints
 
 @app.get("/user/me", response_model=UserResponse)
-async def get_user_details(
-    current_user: dict = Depends(get_current_user), 
-    conn: connection = Depends(get_db)
-):
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT user_id, first_name, last_name, username, date_of_birth
-            FROM users
-            WHERE username = %s;
-        """, (current_user["username"],))
-        user_data = cursor.fetchone()
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-        return user_data
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching user data: {e}")
-    finally:
-        cursor.close()
+async def get_user_details(current_user: dict = Depends(get_current_user)):
+    # get_current_user already resolved the identity row (cached, or one query on a miss)
+    return current_user
 
-@app.post("/user-register", response_model=TokenResponse)
-async def register_user(
-    user: UserCreate, 
-    request: Request,
-    conn: connection = Depends(get_db),
-    token_manager: TokenManager = Depends(get_token_manager),
-    rate_limiter: RateLimiter = Depends(get_rate_limiter),
-    audit_logger: AuditLogger = Depends(get_audit_logger)
-):
-    # Check rate limit
-    rate_limit_result = rate_limiter.check_rate_limit(request, "user-register")
+def _enforce_rate_limit(rate_limiter: RateLimiter, audit_logger: AuditLogger, request: Request, endpoint: str):
+    """Raise 429 (and audit it) when the caller is over the endpoint's rate limit"""
+    rate_limit_result = rate_limiter.check_rate_limit(request, endpoint)
     if not rate_limit_result["allowed"]:
         audit_logger.log_rate_limit_exceeded(
             rate_limiter._get_identifier(request), 
-            "user-register", 
+            endpoint, 
             request
         )
         raise HTTPException(
@@ -353,7 +352,15 @@ async def register_user(
             headers={"Retry-After": str(rate_limit_result["retry_after"])}
         )
 
-    # Validation
+# The register, login, reset-password and admin-login endpoints stay async so the
+# password hash waits on the KDF pool rather than a threadpool slot; their
+# database work runs through run_in_threadpool in the helpers below.
+
+def _validate_registration(user: UserCreate, request: Request, rate_limiter: RateLimiter,
+                           audit_logger: AuditLogger):
+    """Rate limit and field checks before the password is hashed"""
+    _enforce_rate_limit(rate_limiter, audit_logger, request, "user-register")
+
     if not all([
         user.first_name.strip(),
         user.last_name.strip(),
@@ -374,9 +381,11 @@ async def register_user(
             detail="Password must be at least 8 characters long and contain at least one uppercase letter, one number, and one special character"
         )
 
+def _create_user(user: UserCreate, hashed_password: str, request: Request, conn: connection,
+                 token_manager: TokenManager, rate_limiter: RateLimiter, audit_logger: AuditLogger) -> TokenResponse:
+    """Insert the new user, create their S3 folder and issue the first token pair"""
+    cursor = conn.cursor()
     try:
-        hashed_password = get_password_hash(user.password)
-        cursor = conn.cursor()
         cursor.execute("""
             INSERT INTO users (first_name, last_name, username, password, date_of_birth)
             VALUES (%s, %s, %s, %s, %s)
@@ -399,7 +408,8 @@ async def register_user(
             user_id=new_user["user_id"], 
             user_type="user",
             ip_address=rate_limiter._get_identifier(request),
-            user_agent=request.headers.get("User-Agent")
+            user_agent=request.headers.get("User-Agent"),
+            username=new_user["username"]
         )
         
         # Log successful registration
@@ -427,101 +437,111 @@ async def register_user(
     finally:
         cursor.close()
 
-@app.post("/user-login", response_model=TokenResponse)
-async def login_user(
-    user: LoginRequest, 
+@app.post("/user-register", response_model=TokenResponse)
+async def register_user(
+    user: UserCreate, 
     request: Request,
     conn: connection = Depends(get_db),
     token_manager: TokenManager = Depends(get_token_manager),
     rate_limiter: RateLimiter = Depends(get_rate_limiter),
     audit_logger: AuditLogger = Depends(get_audit_logger)
 ):
-    # Check rate limit
-    rate_limit_result = rate_limiter.check_rate_limit(request, "user-login")
-    if not rate_limit_result["allowed"]:
-        audit_logger.log_rate_limit_exceeded(
-            rate_limiter._get_identifier(request), 
-            "user-login", 
-            request
-        )
-        raise HTTPException(
-            status_code=429, 
-            detail="Rate limit exceeded. Please try again later.",
-            headers={"Retry-After": str(rate_limit_result["retry_after"])}
-        )
+    await run_in_threadpool(_validate_registration, user, request, rate_limiter, audit_logger)
+    hashed_password = await run_kdf(get_password_hash, user.password)
+    return await run_in_threadpool(_create_user, user, hashed_password, request, conn,
+                                   token_manager, rate_limiter, audit_logger)
+
+def _load_login_user(user: LoginRequest, request: Request, conn: connection,
+                     rate_limiter: RateLimiter, audit_logger: AuditLogger) -> dict:
+    """Rate limit, then fetch the user row and reject unknown, inactive or locked accounts"""
+    _enforce_rate_limit(rate_limiter, audit_logger, request, "user-login")
 
+    cursor = conn.cursor()
     try:
-        cursor = conn.cursor()
+        # One read: the user row, lock state and latest verification status
         cursor.execute("""
-            SELECT user_id, first_name, last_name, username, password, date_of_birth, 
-                   failed_login_attempts, locked_until, is_active
-            FROM users
-            WHERE username = %s;
+            SELECT u.user_id, u.username, u.password, u.failed_login_attempts,
+                   u.locked_until, u.is_active, v.status AS verification_status
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT status
+                FROM id_verifications
+                WHERE user_id = u.user_id
+                ORDER BY created_at DESC
+                LIMIT 1
+            ) v ON TRUE
+            WHERE u.username = %s;
         """, (user.username,))
         user_data = cursor.fetchone()
+        # End the read transaction so the connection is not left idle in
+        # transaction while the password is hashed
+        conn.rollback()
+    except psycopg2.Error as e:
+        audit_logger.log_failed_login(user.username, "user", request, f"database_error: {e}")
+        raise HTTPException(status_code=500, detail=f"Error during login: {e}")
+    finally:
+        cursor.close()
         
-        if not user_data:
-            audit_logger.log_failed_login(user.username, "user", request, "user_not_found")
-            raise HTTPException(status_code=401, detail="Invalid credentials!")
-        
-        # Check if account is active
-        if not user_data.get("is_active", True):
-            audit_logger.log_failed_login(user.username, "user", request, "account_inactive")
-            raise HTTPException(status_code=401, detail="Account is inactive!")
-        
-        # Check if account is locked
-        if user_data.get("locked_until") and datetime.utcnow() < user_data["locked_until"]:
-            audit_logger.log_failed_login(user.username, "user", request, "account_locked")
-            raise HTTPException(status_code=423, detail="Account temporarily locked due to too many failed attempts!")
-        
-        # Verify password
-        if not verify_password(user.password, user_data["password"]):
-            # Increment failed attempts
-            new_attempts = user_data.get("failed_login_attempts", 0) + 1
-            lock_until = None
-            
-            if new_attempts >= 5:  # Lock after 5 failed attempts
-                lock_until = datetime.utcnow() + timedelta(minutes=15)
-                audit_logger.log_account_locked(user_data["user_id"], "user", request, "too_many_failed_attempts")
-            
+    if not user_data:
+        audit_logger.log_failed_login(user.username, "user", request, "user_not_found")
+        raise HTTPException(status_code=401, detail="Invalid credentials!")
+    
+    # Check if account is active
+    if not user_data.get("is_active", True):
+        audit_logger.log_failed_login(user.username, "user", request, "account_inactive")
+        raise HTTPException(status_code=401, detail="Account is inactive!")
+    
+    # Check if account is locked
+    if user_data.get("locked_until") and datetime.utcnow() < user_data["locked_until"]:
+        audit_logger.log_failed_login(user.username, "user", request, "account_locked")
+        raise HTTPException(status_code=423, detail="Account temporarily locked due to too many failed attempts!")
+    return user_data
+
+def _finish_login(user: LoginRequest, user_data: dict, password_ok: bool, upgraded_hash: Optional[str],
+                  request: Request, conn: connection, token_manager: TokenManager,
+                  rate_limiter: RateLimiter, audit_logger: AuditLogger) -> TokenResponse:
+    """Record the failed attempt, or reset the counters and issue a token pair"""
+    cursor = conn.cursor()
+    try:
+        if not password_ok:
+            # Increment failed attempts atomically; lock after 5
             cursor.execute("""
                 UPDATE users 
-                SET failed_login_attempts = %s, locked_until = %s
+                SET failed_login_attempts = COALESCE(failed_login_attempts, 0) + 1,
+                    locked_until = CASE WHEN COALESCE(failed_login_attempts, 0) + 1 >= 5
+                                        THEN %s ELSE locked_until END
                 WHERE user_id = %s
-            """, (new_attempts, lock_until, user_data["user_id"]))
+                RETURNING failed_login_attempts
+            """, (datetime.utcnow() + timedelta(minutes=15), user_data["user_id"]))
+            attempts_row = cursor.fetchone()
             conn.commit()
             
+            if attempts_row and attempts_row["failed_login_attempts"] >= 5:
+                audit_logger.log_account_locked(user_data["user_id"], "user", request, "too_many_failed_attempts")
             audit_logger.log_failed_login(user.username, "user", request, "invalid_password")
             raise HTTPException(status_code=401, detail="Invalid credentials!")
         
-        # Reset failed attempts on successful login
+        # One write transaction: reset counters (and upgrade the hash) plus the new refresh token
         cursor.execute("""
             UPDATE users 
-            SET failed_login_attempts = 0, locked_until = NULL, last_login = CURRENT_TIMESTAMP
+            SET failed_login_attempts = 0, locked_until = NULL, last_login = CURRENT_TIMESTAMP,
+                password = COALESCE(%s, password)
             WHERE user_id = %s
-        """, (user_data["user_id"],))
-        conn.commit()
-        
-        # Create token pair
+        """, (upgraded_hash, user_data["user_id"]))
         tokens = token_manager.create_token_pair(
             user_id=user_data["user_id"], 
             user_type="user",
             ip_address=rate_limiter._get_identifier(request),
-            user_agent=request.headers.get("User-Agent")
+            user_agent=request.headers.get("User-Agent"),
+            username=user_data["username"],
+            commit=False
         )
+        conn.commit()
         
-        # Get verification status
-        cursor.execute("""
-            SELECT status
-            FROM id_verifications
-            WHERE user_id = %s
-            ORDER BY created_at DESC
-            LIMIT 1;
-        """, (user_data["user_id"],))
-        verification_row = cursor.fetchone()
-        verification_status = 1 if verification_row and verification_row["status"].lower() == "approved" else 0
+        status_value = user_data["verification_status"]
+        verification_status = 1 if status_value and status_value.lower() == "approved" else 0
         
-        # Log successful login
+        # Log successful login (queued for the batched audit writer)
         audit_logger.log_successful_login(
             user_data["user_id"], 
             "user", 
@@ -545,31 +565,40 @@ async def login_user(
     finally:
         cursor.close()
 
+@app.post("/user-login", response_model=TokenResponse)
+async def login_user(
+    user: LoginRequest, 
+    request: Request,
+    conn: connection = Depends(get_db),
+    token_manager: TokenManager = Depends(get_token_manager),
+    rate_limiter: RateLimiter = Depends(get_rate_limiter),
+    audit_logger: AuditLogger = Depends(get_audit_logger)
+):
+    user_data = await run_in_threadpool(_load_login_user, user, request, conn, rate_limiter, audit_logger)
+    # Verify password; hashes made with an older scheme or lower cost come back upgraded
+    password_ok, upgraded_hash = await run_kdf(
+        get_password_hasher().verify_and_update, user.password, user_data["password"]
+    )
+    return await run_in_threadpool(_finish_login, user, user_data, password_ok, upgraded_hash, request, conn,
+                                   token_manager, rate_limiter, audit_logger)
+
 @app.post("/refresh-token", response_model=TokenResponse)
-async def refresh_access_token(
+def refresh_access_token(
     request: RefreshTokenRequest,
     req: Request,
     token_manager: TokenManager = Depends(get_token_manager),
     rate_limiter: RateLimiter = Depends(get_rate_limiter),
     audit_logger: AuditLogger = Depends(get_audit_logger)
 ):
-    # Check rate limit
-    rate_limit_result = rate_limiter.check_rate_limit(req, "refresh-token")
-    if not rate_limit_result["allowed"]:
-        audit_logger.log_rate_limit_exceeded(
-            rate_limiter._get_identifier(req), 
-            "refresh-token", 
-            req
-        )
-        raise HTTPException(
-            status_code=429, 
-            detail="Rate limit exceeded. Please try again later.",
-            headers={"Retry-After": str(rate_limit_result["retry_after"])}
-        )
+    _enforce_rate_limit(rate_limiter, audit_logger, req, "refresh-token")
 
     try:
-        # Verify refresh token
-        token_data = token_manager.verify_refresh_token(request.refresh_token)
+        # Legacy tokens are bcrypt-checked on the KDF pool
+        try:
+            token_data = token_manager.verify_refresh_token(request.refresh_token)
+        except KDFPoolSaturated:
+            raise HTTPException(status_code=503, detail="Server is busy, please try again shortly",
+                                headers={"Retry-After": "1"})
         if not token_data:
             audit_logger.log_token_refresh(0, "user", req, False)
             raise HTTPException(status_code=401, detail="Invalid refresh token")
@@ -579,7 +608,8 @@ async def refresh_access_token(
             user_id=token_data["user_id"], 
             user_type=token_data["user_type"],
             ip_address=rate_limiter._get_identifier(req),
-            user_agent=req.headers.get("User-Agent")
+            user_agent=req.headers.get("User-Agent"),
+            username=token_data.get("username")
         )
         
         # Log successful refresh
@@ -604,7 +634,7 @@ async def refresh_access_token(
         raise HTTPException(status_code=500, detail=f"Error refreshing token: {e}")
 
 @app.post("/logout")
-async def logout(
+def logout(
     current_user: dict = Depends(get_current_user),
     request: Request = None,
     token: str = Depends(oauth2_scheme),
@@ -650,26 +680,14 @@ async def logout(
 
 # Password reset endpoints
 @app.post("/forgot-password/")
-async def forget_password(
+def forget_password(
     request: ForgotPasswordRequest,
     req: Request,
     conn: connection = Depends(get_db),
     rate_limiter: RateLimiter = Depends(get_rate_limiter),
     audit_logger: AuditLogger = Depends(get_audit_logger)
 ):
-    # Check rate limit
-    rate_limit_result = rate_limiter.check_rate_limit(req, "forgot-password")
-    if not rate_limit_result["allowed"]:
-        audit_logger.log_rate_limit_exceeded(
-            rate_limiter._get_identifier(req), 
-            "forgot-password", 
-            req
-        )
-        raise HTTPException(
-            status_code=429, 
-            detail="Rate limit exceeded. Please try again later.",
-            headers={"Retry-After": str(rate_limit_result["retry_after"])}
-        )
+    _enforce_rate_limit(rate_limiter, audit_logger, req, "forgot-password")
 
     try:
         print("Initiating password reset for:", request.email)
@@ -709,6 +727,36 @@ async def forget_password(
     finally:
         cursor.close()
 
+def _store_reset_password(username: str, hashed_password: str, req: Request, conn: connection,
+                          audit_logger: AuditLogger) -> dict:
+    """Save the new hash, clear the lockout and drop the cached identity"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE users
+            SET password = %s, failed_login_attempts = 0, locked_until = NULL
+            WHERE username = %s;
+        """, (hashed_password, username))
+        
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        conn.commit()
+        user_cache.invalidate(username=username)
+        
+        # Log successful password reset
+        audit_logger.log_password_reset_complete(
+            int(username), "user", req, True, username
+        )
+        
+        return {"success": True, "message": "Password has been reset successfully."}
+        
+    except psycopg2.Error as e:
+        conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error resetting password: {e}")
+    finally:
+        cursor.close()
+
 @app.post("/reset-password/")
 async def reset_password(
     request: ResetPasswordRequest,
@@ -717,19 +765,7 @@ async def reset_password(
     rate_limiter: RateLimiter = Depends(get_rate_limiter),
     audit_logger: AuditLogger = Depends(get_audit_logger)
 ):
-    # Check rate limit
-    rate_limit_result = rate_limiter.check_rate_limit(req, "reset-password")
-    if not rate_limit_result["allowed"]:
-        audit_logger.log_rate_limit_exceeded(
-            rate_limiter._get_identifier(req), 
-            "reset-password", 
-            req
-        )
-        raise HTTPException(
-            status_code=429, 
-            detail="Rate limit exceeded. Please try again later.",
-            headers={"Retry-After": str(rate_limit_result["retry_after"])}
-        )
+    await run_in_threadpool(_enforce_rate_limit, rate_limiter, audit_logger, req, "reset-password")
 
     token = request.token
     new_password = request.new_password.strip()
@@ -743,45 +779,22 @@ async def reset_password(
     try:
         # Verify reset token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        purpose = payload.get("purpose")
-        
-        if username is None or purpose != "password_reset":
-            raise HTTPException(status_code=400, detail="Invalid token")
-
-        hashed_password = get_password_hash(new_password)
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE users
-            SET password = %s, failed_login_attempts = 0, locked_until = NULL
-            WHERE username = %s;
-        """, (hashed_password, username))
-        
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        conn.commit()
-        
-        # Log successful password reset
-        audit_logger.log_password_reset_complete(
-            int(username), "user", req, True, username
-        )
-        
-        return {"success": True, "message": "Password has been reset successfully."}
-        
     except ExpiredSignatureError:
         raise HTTPException(status_code=400, detail="Token has expired")
     except JWTError:
         raise HTTPException(status_code=400, detail="Invalid token")
-    except psycopg2.Error as e:
-        conn.rollback()
-        raise HTTPException(status_code=500, detail=f"Error resetting password: {e}")
-    finally:
-        cursor.close()
+    username: str = payload.get("sub")
+    purpose = payload.get("purpose")
+    
+    if username is None or purpose != "password_reset":
+        raise HTTPException(status_code=400, detail="Invalid token")
+
+    hashed_password = await run_kdf(get_password_hash, new_password)
+    return await run_in_threadpool(_store_reset_password, username, hashed_password, req, conn, audit_logger)
 
 # Cleanup endpoint for maintenance
 @app.post("/cleanup-expired-tokens")
-async def cleanup_expired_tokens(
+def cleanup_expired_tokens(
     token_manager: TokenManager = Depends(get_token_manager),
     rate_limiter: RateLimiter = Depends(get_rate_limiter),
     audit_logger: AuditLogger = Depends(get_audit_logger)
@@ -809,7 +822,7 @@ async def cleanup_expired_tokens(
 
 # Keep existing endpoints for backward compatibility
 @app.get("/user/profile/", response_model=UserProfile)
-async def get_user_profile(
+def get_user_profile(
     current_user: dict = Depends(get_current_user), 
     conn: connection = Depends(get_db)
 ):
@@ -866,7 +879,7 @@ async def get_user_profile(
         cursor.close()
 
 @app.get("/public/profile/{user_id}", response_model=UserProfile)
-async def get_user_profile_by_id(
+def get_user_profile_by_id(
     user_id: str, 
     conn: connection = Depends(get_db)
 ):
@@ -923,7 +936,7 @@ async def get_user_profile_by_id(
         cursor.close()
 
 @app.get("/public/verified-cards/{user_id}", response_model=active_cards)
-async def get_verified_cards(
+def get_verified_cards(
     user_id: str, 
     conn: connection = Depends(get_db)
 ):
@@ -975,54 +988,56 @@ async def get_verified_cards(
     finally:
         cursor.close()
 
-@app.post("/admin-login", response_model=AdminResponse)
-async def login_admin(login: LoginRequest, conn: connection = Depends(get_db)):
+def _load_admin(email: str, conn: connection) -> Optional[dict]:
+    """Admin row, password hash included, for the login email"""
+    cursor = conn.cursor()
     try:
-        print("Initiating admin login for:", login.username)
-        cursor = conn.cursor()
         cursor.execute("""
             SELECT admin_id, first_name, last_name, employee_id, email, password, date_of_birth
             FROM admins
             WHERE email = %s;
-        """, (login.username,))
-        admin_data = cursor.fetchone()
-        
-        if not admin_data:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        # Verify password using bcrypt
-        if not verify_password(login.password, admin_data["password"]):
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        print(f"Admin login successful for: {admin_data['email']}")
-        
-        # Generate JWT token for admin
-        token_data = {
-            "sub": admin_data["email"],  # Use email as subject
-            "admin_id": admin_data["admin_id"],
-            "type": "admin",
-            "iat": datetime.utcnow(),
-            "exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        }
-        token = jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
-        
-        return AdminResponse(
-            admin_id=admin_data["admin_id"],
-            first_name=admin_data["first_name"],
-            last_name=admin_data["last_name"],
-            employee_id=admin_data["employee_id"],
-            email=admin_data["email"],
-            date_of_birth=admin_data["date_of_birth"],
-            token=token
-        )
-        
+        """, (email,))
+        return cursor.fetchone()
     except psycopg2.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     finally:
         cursor.close()
 
+@app.post("/admin-login", response_model=AdminResponse)
+async def login_admin(login: LoginRequest, conn: connection = Depends(get_db)):
+    print("Initiating admin login for:", login.username)
+    admin_data = await run_in_threadpool(_load_admin, login.username, conn)
+    if not admin_data:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Verify password (any supported hash scheme)
+    if not await run_kdf(verify_password, login.password, admin_data["password"]):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    print(f"Admin login successful for: {admin_data['email']}")
+    
+    # Generate JWT token for admin
+    token_data = {
+        "sub": admin_data["email"],  # Use email as subject
+        "admin_id": admin_data["admin_id"],
+        "type": "admin",
+        "iat": datetime.utcnow(),
+        "exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    }
+    token = jwt.encode(token_data, SECRET_KEY, algorithm=ALGORITHM)
+    
+    return AdminResponse(
+        admin_id=admin_data["admin_id"],
+        first_name=admin_data["first_name"],
+        last_name=admin_data["last_name"],
+        employee_id=admin_data["employee_id"],
+        email=admin_data["email"],
+        date_of_birth=admin_data["date_of_birth"],
+        token=token
+    )
+
 @app.get("/admin/me", response_model=AdminResponse)
-async def get_admin_me(token: str = Depends(oauth2_scheme), conn: connection = Depends(get_db)):
+def get_admin_me(token: str = Depends(oauth2_scheme), conn: connection = Depends(get_db)):
     try:
         # Decode JWT token
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -1061,44 +1076,30 @@ async def get_admin_me(token: str = Depends(oauth2_scheme), conn: connection = D
         cursor.close()
 
 @app.get("/api/image/{file_key:path}")
-async def serve_image(file_key: str):
-    """Serve images from S3 bucket"""
+async def serve_image(
+    file_key: str,
+    request: Request,
+    w: Optional[int] = Query(None, description=f"Thumbnail width, one of {THUMBNAIL_WIDTHS}"),
+):
+    """Serve images from S3 through the local image cache (conditional and Range requests supported)"""
+    if w is not None and w not in THUMBNAIL_WIDTHS:
+        raise HTTPException(status_code=400, detail=f"w must be one of {', '.join(map(str, THUMBNAIL_WIDTHS))}")
     try:
-        # Create S3 client
-        s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION', 'us-east-1')
-        )
-        
-        bucket_name = os.getenv('BUCKET_NAME', 'certcheck-users')
-        
-        # Get the object from S3
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        
-        # Determine content type based on file extension
-        content_type = 'image/jpeg'  # default
-        if file_key.lower().endswith('.png'):
-            content_type = 'image/png'
-        elif file_key.lower().endswith('.gif'):
-            content_type = 'image/gif'
-        elif file_key.lower().endswith('.webp'):
-            content_type = 'image/webp'
-        
-        # Return the image as a streaming response
-        return StreamingResponse(
-            response['Body'].iter_chunks(chunk_size=8192),
-            media_type=content_type,
-            headers={
-                'Cache-Control': 'public, max-age=3600',
-                'Content-Disposition': f'inline; filename="{file_key.split("/")[-1]}"'
-            }
-        )
-        
+        meta, image_file = await run_in_threadpool(get_image_cache().open, file_key, w)
+    except ObjectTooLarge as e:
+        # Too large for the cache: stream the GET the cache already opened, unless the
+        # client wants a 304 or a range, which S3 answers without sending the whole body
+        if w is None and not any(request.headers.get(h) for h in ('if-none-match', 'if-modified-since', 'range')):
+            return _s3_image_response(file_key, e.s3_response)
+        e.s3_response['Body'].close()
+        if w is not None:
+            raise HTTPException(status_code=400, detail="Image too large for a thumbnail")
+        return await _stream_image_from_s3(file_key, request)
+    except NotAnImage:
+        raise HTTPException(status_code=400, detail="Thumbnails are only available for images")
     except ClientError as e:
         error_code = e.response['Error']['Code']
-        if error_code == 'NoSuchKey':
+        if error_code in ('NoSuchKey', '404'):
             raise HTTPException(status_code=404, detail="Image not found")
         elif error_code == 'NoSuchBucket':
             raise HTTPException(status_code=400, detail="S3 bucket does not exist")
@@ -1106,5 +1107,76 @@ async def serve_image(file_key: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error serving image: {str(e)}")
 
+    headers = {
+        'Cache-Control': 'public, max-age=3600',
+        'Content-Disposition': f'inline; filename="{file_key.split("/")[-1]}"',
+        'ETag': meta["etag"],
+        'Last-Modified': meta["last_modified"],
+        'Accept-Ranges': 'bytes',
+    }
+    if not_modified(meta, request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        image_file.close()
+        return Response(status_code=304, headers=headers)
+
+    size = meta["size"]
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range in (meta["etag"], meta["last_modified"]):
+        try:
+            byte_range = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            image_file.close()
+            return Response(status_code=416, headers={'Content-Range': f'bytes */{size}'})
+
+    if byte_range is None:
+        headers['Content-Length'] = str(size)
+        return StreamingResponse(iter_file(image_file, 0, size), media_type=meta["content_type"], headers=headers)
+    start, end = byte_range
+    headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+    return StreamingResponse(iter_file(image_file, start, end - start + 1), status_code=206,
+                             media_type=meta["content_type"], headers=headers)
+
+
+async def _stream_image_from_s3(file_key: str, request: Request):
+    """Pass an uncached object through from S3, forwarding conditional and Range headers"""
+    params = {'Bucket': os.getenv('BUCKET_NAME', 'certcheck-users'), 'Key': file_key}
+    for header, param in (('if-none-match', 'IfNoneMatch'), ('if-modified-since', 'IfModifiedSince'),
+                          ('range', 'Range')):
+        if request.headers.get(header):
+            params[param] = request.headers[header]
+    try:
+        response = await s3_call(get_s3_client().get_object, **params)
+    except ClientError as e:
+        error_code = e.response['Error']['Code']
+        if error_code in ('304', 'NotModified'):
+            return Response(status_code=304)
+        if error_code in ('NoSuchKey', '404'):
+            raise HTTPException(status_code=404, detail="Image not found")
+        if error_code == 'InvalidRange':
+            return Response(status_code=416)
+        raise HTTPException(status_code=500, detail=f"Failed to serve image: {str(e)}")
+    return _s3_image_response(file_key, response)
+
+
+def _s3_image_response(file_key: str, response: Dict[str, Any]) -> StreamingResponse:
+    """Stream an S3 get_object response body to the client"""
+    headers = {
+        'Cache-Control': 'public, max-age=3600',
+        'Content-Disposition': f'inline; filename="{file_key.split("/")[-1]}"',
+        'ETag': response['ETag'],
+        'Accept-Ranges': 'bytes',
+        'Content-Length': str(response['ContentLength']),
+    }
+    if response.get('ContentRange'):
+        headers['Content-Range'] = response['ContentRange']
+    return StreamingResponse(
+        response['Body'].iter_chunks(chunk_size=64 * 1024),
+        status_code=206 if response.get('ContentRange') else 200,
+        media_type=content_type_for(file_key, response.get('ContentType')),
+        headers=headers,
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,371 @@
+"""
+Image Cache for the login service
+Bounded on-disk LRU of S3 images and their thumbnails, served by /api/image
+"""
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Optional, Dict, Any, Tuple, List
+
+from botocore.exceptions import ClientError     # type: ignore
+from PIL import Image, UnidentifiedImageError   # type: ignore
+
+from s3_client import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = (64, 128, 256, 512)
+
+CONTENT_TYPES = {
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+}
+
+
+class ObjectTooLarge(ValueError):
+    """The object is over IMAGE_CACHE_MAX_OBJECT_BYTES; s3_response is the unread GET, for the caller to stream or close"""
+
+    def __init__(self, key: str, s3_response: Dict[str, Any]):
+        super().__init__(f"{key} is too large to cache")
+        self.s3_response = s3_response
+
+
+class NotAnImage(ValueError):
+    """A thumbnail was requested for an object PIL cannot open"""
+
+
+def content_type_for(key: str, s3_content_type: Optional[str] = None) -> str:
+    if s3_content_type and s3_content_type.startswith("image/"):
+        return s3_content_type
+    return CONTENT_TYPES.get(os.path.splitext(key)[1].lower(), 'image/jpeg')
+
+
+class ImageCache:
+    """
+    Keeps hot S3 images (profile photos, mostly) on local disk.
+
+    Entries are served without touching S3 for IMAGE_CACHE_TTL seconds, then
+    revalidated with a conditional GET (If-None-Match on the stored ETag), so
+    an unchanged object costs one 304 from S3 and no transfer. Thumbnails are
+    generated from the cached original on first request and cached alongside
+    it. The least recently used entries are deleted once the cache exceeds
+    IMAGE_CACHE_MAX_BYTES; objects over IMAGE_CACHE_MAX_OBJECT_BYTES are not
+    cached at all.
+
+    Each entry is a data file plus a JSON sidecar, written via rename, so
+    several workers can share IMAGE_CACHE_DIR.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None, max_object_bytes: Optional[int] = None):
+        self.directory = directory or os.getenv("IMAGE_CACHE_DIR", "/tmp/certcheck-image-cache")
+        self.max_bytes = max_bytes or int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.ttl = ttl if ttl is not None else float(os.getenv("IMAGE_CACHE_TTL", "300"))
+        self.max_object_bytes = max_object_bytes or int(os.getenv("IMAGE_CACHE_MAX_OBJECT_BYTES",
+                                                                  str(10 * 1024 * 1024)))
+        self.bucket = os.getenv("BUCKET_NAME", "certcheck-users")
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        # name -> [lock, holders and waiters]; dropped when the count reaches zero
+        self._key_locks: Dict[str, List[Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    # ------------------------------------------------------------------ disk
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @staticmethod
+    def _name(key: str, width: Optional[int]) -> str:
+        return hashlib.sha256(f"{key}|{width or ''}".encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        """Rebuild the LRU from sidecars left by earlier runs, oldest access first"""
+        found = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(self._path(filename)) as f:
+                    meta = json.load(f)
+                found.append((os.path.getmtime(self._path(filename)), meta))
+            except (OSError, ValueError):
+                continue
+        for _, meta in sorted(found, key=lambda item: item[0]):
+            self._entries[meta["name"]] = meta
+            self._size += meta["size"]
+        self._evict()
+
+    def _store(self, name: str, data: bytes, meta: Dict[str, Any]) -> Dict[str, Any]:
+        meta = dict(meta, name=name, size=len(data), fetched_at=time.time())
+        tmp = self._path(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(name))
+        self._write_meta(meta)
+        with self._lock:
+            previous = self._entries.pop(name, None)
+            if previous:
+                self._size -= previous["size"]
+            self._entries[name] = meta
+            self._size += meta["size"]
+            self._evict()
+        return meta
+
+    def _write_meta(self, meta: Dict[str, Any]):
+        tmp = self._path(f"{meta['name']}.{os.getpid()}.{threading.get_ident()}.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(f"{meta['name']}.json"))
+
+    def _evict(self):
+        """Drop least recently used entries beyond max_bytes (caller holds the lock)"""
+        while self._size > self.max_bytes and self._entries:
+            name, meta = self._entries.popitem(last=False)
+            self._size -= meta["size"]
+            for path in (self._path(name), self._path(f"{name}.json")):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def _lookup(self, name: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            meta = self._entries.get(name)
+            if meta is not None:
+                self._entries.move_to_end(name)
+        if meta is not None and not os.path.exists(self._path(name)):
+            # Evicted by another worker sharing the directory
+            with self._lock:
+                if self._entries.pop(name, None) is not None:
+                    self._size -= meta["size"]
+            return None
+        return meta
+
+    @contextmanager
+    def _key_lock(self, name: str):
+        """Serialise fills of one entry; the lock is forgotten once nobody holds or waits for it"""
+        with self._lock:
+            entry = self._key_locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[name]
+
+    # -------------------------------------------------------------------- S3
+
+    def _fetch(self, key: str, etag: Optional[str] = None) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        """GET the object, or None if it still matches etag. Raises ObjectTooLarge before reading the body."""
+        params = {"Bucket": self.bucket, "Key": key}
+        if etag:
+            params["IfNoneMatch"] = etag
+        try:
+            response = get_s3_client().get_object(**params)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("304", "NotModified"):
+                return None
+            raise
+        if response["ContentLength"] > self.max_object_bytes:
+            raise ObjectTooLarge(key, response)
+        body = response["Body"]
+        try:
+            data = body.read()
+        finally:
+            body.close()
+        return data, {
+            "key": key,
+            "width": None,
+            "etag": response["ETag"],
+            "last_modified": format_datetime(response["LastModified"].astimezone(timezone.utc), usegmt=True),
+            "content_type": content_type_for(key, response.get("ContentType")),
+        }
+
+    def _original(self, key: str) -> Dict[str, Any]:
+        name = self._name(key, None)
+        meta = self._lookup(name)
+        if meta is not None and time.time() - meta["fetched_at"] < self.ttl:
+            self.hits += 1
+            return meta
+        with self._key_lock(name):
+            # Another request may have filled or revalidated it while we waited
+            meta = self._lookup(name)
+            if meta is not None and time.time() - meta["fetched_at"] < self.ttl:
+                self.hits += 1
+                return meta
+            fetched = self._fetch(key, meta["etag"] if meta else None)
+            if fetched is None:
+                self.revalidations += 1
+                meta = dict(meta, fetched_at=time.time())
+                self._write_meta(meta)
+                with self._lock:
+                    if name in self._entries:
+                        self._entries[name] = meta
+                return meta
+            self.misses += 1
+            data, new_meta = fetched
+            if meta is not None and meta["etag"] != new_meta["etag"]:
+                self._drop_thumbnails(key)
+            return self._store(name, data, new_meta)
+
+    def _drop_thumbnails(self, key: str):
+        with self._lock:
+            for width in THUMBNAIL_WIDTHS:
+                name = self._name(key, width)
+                meta = self._entries.pop(name, None)
+                if meta is not None:
+                    self._size -= meta["size"]
+                    for path in (self._path(name), self._path(f"{name}.json")):
+                        try:
+                            os.unlink(path)
+                        except FileNotFoundError:
+                            pass
+
+    def _thumbnail(self, key: str, width: int, original: Dict[str, Any]) -> Dict[str, Any]:
+        name = self._name(key, width)
+        etag = f'"{original["etag"].strip(chr(34))}-w{width}"'
+        meta = self._lookup(name)
+        if meta is not None and meta["etag"] == etag:
+            return meta
+        with self._key_lock(name):
+            meta = self._lookup(name)
+            if meta is not None and meta["etag"] == etag:
+                return meta
+            try:
+                image = Image.open(self._path(original["name"]))
+            except UnidentifiedImageError:
+                raise NotAnImage(f"{key} is not an image")
+            with image:
+                image.thumbnail((width, width * 4))
+                output = io.BytesIO()
+                if original["content_type"] == "image/png":
+                    image.save(output, "PNG", optimize=True)
+                    content_type = "image/png"
+                else:
+                    image.convert("RGB").save(output, "JPEG", quality=85, optimize=True)
+                    content_type = "image/jpeg"
+            return self._store(name, output.getvalue(), {
+                "key": key,
+                "width": width,
+                "etag": etag,
+                "last_modified": original["last_modified"],
+                "content_type": content_type,
+            })
+
+    # ---------------------------------------------------------------- public
+
+    def open(self, key: str, width: Optional[int] = None):
+        """
+        (metadata, open binary file) of the cached image or thumbnail.
+
+        Blocking; raises ClientError from S3, ObjectTooLarge for objects too
+        large to cache and NotAnImage for thumbnails of non-images. The file is
+        opened here so an eviction by another worker cannot remove it
+        mid-response.
+        """
+        for _ in range(2):
+            meta = self._original(key)
+            if width:
+                meta = self._thumbnail(key, width, meta)
+            try:
+                return meta, open(self._path(meta["name"]), "rb")
+            except FileNotFoundError:
+                continue
+        raise FileNotFoundError(f"Cached image for {key} disappeared")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "ttl_seconds": self.ttl,
+            }
+
+
+def not_modified(meta: Dict[str, Any], if_none_match: Optional[str], if_modified_since: Optional[str]) -> bool:
+    """RFC 9110 conditional GET: If-None-Match wins over If-Modified-Since"""
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        etag = meta["etag"]
+        return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            modified = parsedate_to_datetime(meta["last_modified"])
+        except (TypeError, ValueError):
+            return False
+        return modified <= since
+    return False
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive for a single "bytes=" range, None to serve the whole
+    body (no header, or multiple ranges). Raises ValueError if unsatisfiable.
+    """
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start_text, _, end_text = range_header[6:].strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            start = max(size - int(end_text), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def iter_file(f, start: int, length: int, chunk_size: int = 64 * 1024):
+    """Yield length bytes of an open file from start, closing it when done"""
+    with f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+_image_cache: Optional[ImageCache] = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> ImageCache:
+    """Return the process-wide image cache"""
+    global _image_cache
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache()
+    return _image_cache
@@ -0,0 +1,198 @@
+"""
+Password Hashing for the login service
+Versioned password hashes with cost calibrated to a latency budget and transparent upgrades
+"""
+import os
+import time
+import base64
+import hashlib
+import hmac
+import secrets
+import statistics
+import threading
+import logging
+from typing import Optional, Tuple
+
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+# Lowest costs ever selected, whatever the hardware measures; bcrypt never
+# calibrates below the fixed 12 rounds used before calibration existed
+BCRYPT_MIN_ROUNDS = 12
+BCRYPT_MAX_ROUNDS = 16
+SCRYPT_MIN_LOG_N = 14
+SCRYPT_MAX_LOG_N = 20
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+SCHEMES = ("bcrypt", "scrypt")
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+
+def hash_bcrypt(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def hash_scrypt(password: str, log_n: int) -> str:
+    """scrypt hash in $scrypt$ln=<log2 N>,r=<r>,p=<p>$<salt>$<key> form"""
+    salt = secrets.token_bytes(16)
+    key = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=1 << log_n, r=SCRYPT_R, p=SCRYPT_P,
+                         maxmem=_scrypt_maxmem(log_n, SCRYPT_R), dklen=32)
+    return f"$scrypt$ln={log_n},r={SCRYPT_R},p={SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+
+def _scrypt_maxmem(log_n: int, r: int) -> int:
+    # scrypt needs 128 * r * N bytes; leave headroom over OpenSSL's 32 MiB default
+    return 128 * r * (1 << log_n) * 2
+
+
+def parse_hash(stored: str) -> Tuple[str, int]:
+    """Return (scheme, cost) for a stored hash; cost is bcrypt rounds or scrypt log2(N)"""
+    if stored.startswith("$scrypt$"):
+        params = dict(item.split("=") for item in stored.split("$")[2].split(","))
+        return "scrypt", int(params["ln"])
+    if stored.startswith(("$2a$", "$2b$", "$2y$")):
+        return "bcrypt", int(stored.split("$")[2])
+    raise ValueError("Unrecognised password hash format")
+
+
+def verify_hash(password: str, stored: str) -> bool:
+    """Check a password against a hash of any supported scheme"""
+    try:
+        scheme, cost = parse_hash(stored)
+        if scheme == "bcrypt":
+            return bcrypt.checkpw(password.encode("utf-8"), stored.encode("utf-8"))
+        _, _, params, salt, key = stored.split("$")
+        params = dict(item.split("=") for item in params.split(","))
+        r, p = int(params["r"]), int(params["p"])
+        expected = _b64decode(key)
+        derived = hashlib.scrypt(password.encode("utf-8"), salt=_b64decode(salt), n=1 << cost,
+                                 r=r, p=p, maxmem=_scrypt_maxmem(cost, r), dklen=len(expected))
+        return hmac.compare_digest(derived, expected)
+    except (ValueError, KeyError):
+        return False
+
+
+class PasswordHasher:
+    """
+    Hashes new passwords with the configured scheme and cost, and verifies
+    hashes of any scheme and cost ever issued.
+
+    PASSWORD_HASH_SCHEME selects bcrypt (default) or scrypt (memory-hard,
+    from the standard library). The cost is PASSWORD_HASH_COST if set,
+    otherwise calibrate() picks the highest cost whose hash time on this host
+    stays within PASSWORD_HASH_TARGET_MS. Stored hashes record their own
+    scheme and cost, so a hash made under other settings still verifies, and
+    verify_and_update() returns a replacement whenever the stored hash is
+    weaker than (or a different scheme from) the current setting.
+
+    Workers calibrate independently and may settle one step apart; only
+    weaker hashes are upgraded, so that never causes repeated rehashing.
+    """
+
+    def __init__(self, scheme: Optional[str] = None, cost: Optional[int] = None,
+                 target_ms: Optional[float] = None):
+        self.scheme = (scheme or os.getenv("PASSWORD_HASH_SCHEME", "bcrypt")).lower()
+        if self.scheme not in SCHEMES:
+            raise ValueError(f"PASSWORD_HASH_SCHEME must be one of {', '.join(SCHEMES)}")
+        configured_cost = os.getenv("PASSWORD_HASH_COST")
+        self.cost = cost if cost is not None else (int(configured_cost) if configured_cost else None)
+        self.target_ms = target_ms if target_ms is not None else float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+        self.calibrated_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def min_cost(self) -> int:
+        return BCRYPT_MIN_ROUNDS if self.scheme == "bcrypt" else SCRYPT_MIN_LOG_N
+
+    @property
+    def max_cost(self) -> int:
+        return BCRYPT_MAX_ROUNDS if self.scheme == "bcrypt" else SCRYPT_MAX_LOG_N
+
+    def _hash_with(self, password: str, cost: int) -> str:
+        if self.scheme == "bcrypt":
+            return hash_bcrypt(password, cost)
+        return hash_scrypt(password, cost)
+
+    def measure(self, cost: int, samples: int = 3) -> float:
+        """Median milliseconds to hash one password at the given cost"""
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            self._hash_with("calibration-password", cost)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def calibrate(self) -> int:
+        """Pick the highest cost within the target budget (no-op if PASSWORD_HASH_COST is set)"""
+        with self._lock:
+            if self.cost is not None:
+                return self.cost
+            cost = self.min_cost
+            elapsed = self.measure(cost)
+            # Each step doubles the work, so stop once the next one would exceed the budget
+            while cost < self.max_cost and elapsed * 2 <= self.target_ms:
+                cost += 1
+                elapsed = self.measure(cost)
+            self.cost = cost
+            self.calibrated_ms = elapsed
+            logger.info(f"Password hashing calibrated: {self.scheme} cost {cost} "
+                        f"({elapsed:.0f} ms, target {self.target_ms:.0f} ms)")
+            return cost
+
+    def hash(self, password: str) -> str:
+        """Hash a new password with the current scheme and cost"""
+        if self.cost is None:
+            self.calibrate()
+        return self._hash_with(password, self.cost)
+
+    def verify(self, password: str, stored: str) -> bool:
+        return verify_hash(password, stored)
+
+    def needs_rehash(self, stored: str) -> bool:
+        """True if the stored hash uses another scheme or a lower cost than the current setting"""
+        if self.cost is None:
+            self.calibrate()
+        try:
+            scheme, cost = parse_hash(stored)
+        except (ValueError, KeyError):
+            return True
+        return scheme != self.scheme or cost < self.cost
+
+    def verify_and_update(self, password: str, stored: str) -> Tuple[bool, Optional[str]]:
+        """Verify, and when the password is correct but the hash is outdated, return a new hash"""
+        if not self.verify(password, stored):
+            return False, None
+        if self.needs_rehash(stored):
+            return True, self.hash(password)
+        return True, None
+
+    def settings(self):
+        return {
+            "scheme": self.scheme,
+            "cost": self.cost,
+            "target_ms": self.target_ms,
+            "calibrated_ms": round(self.calibrated_ms, 1) if self.calibrated_ms is not None else None,
+        }
+
+
+_password_hasher: Optional[PasswordHasher] = None
+_password_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Return the process-wide password hasher"""
+    global _password_hasher
+    if _password_hasher is None:
+        with _password_hasher_lock:
+            if _password_hasher is None:
+                _password_hasher = PasswordHasher()
+    return _password_hasher
@@ -1,36 +1,148 @@
 """
 Rate Limiter for API endpoints
-Implements in-memory rate limiting with configurable limits
+Implements sliding-window-counter rate limiting shared across workers via Redis,
+with an in-process fallback
 """
+import os
 import time
-from typing import Dict, Tuple
-from collections import defaultdict, deque
+import threading
+from typing import Dict, Tuple, List
+from collections import OrderedDict
 import asyncio
 from fastapi import HTTPException, Request
 import logging
 
+try:
+    # Shared auth module (auth/ is on sys.path when run from the login service)
+    from redis_client import get_redis
+except ImportError:
+    get_redis = None
+
 logger = logging.getLogger(__name__)
 
+
+def _estimate(previous: int, current: int, elapsed_fraction: float) -> float:
+    """Sliding-window estimate: the previous window's count weighted by how much of it still overlaps"""
+    return previous * (1.0 - elapsed_fraction) + current
+
+
+class MemoryRateLimiter:
+    """
+    Per-process sliding-window counter.
+
+    Each key holds a fixed-size record [window_index, previous_count, current_count],
+    so memory per client is constant regardless of request rate. Records are
+    rolled forward lazily when touched, and each call also inspects a bounded
+    number of keys in round-robin order, dropping those idle for two windows,
+    so cleanup is amortised O(1) and never walks the whole table on the
+    request path.
+    """
+
+    SWEEP_BATCH = 8
+
+    def __init__(self):
+        self.counters: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._windows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _sweep(self, now: float):
+        """Examine up to SWEEP_BATCH keys from the front: drop stale ones, rotate live ones to the back"""
+        for _ in range(min(self.SWEEP_BATCH, len(self.counters))):
+            key, record = next(iter(self.counters.items()))
+            if int(now // self._windows[key]) - record[0] >= 2:
+                del self.counters[key]
+                del self._windows[key]
+            else:
+                self.counters.move_to_end(key)
+
+    def is_allowed(self, key: str, max_requests: int, window_seconds: int) -> Tuple[bool, int]:
+        now = time.time()
+        window_index = int(now // window_seconds)
+        elapsed_fraction = (now % window_seconds) / window_seconds
+
+        with self._lock:
+            record = self.counters.get(key)
+            if record is None:
+                record = [window_index, 0, 0]
+                self.counters[key] = record
+                self._windows[key] = window_seconds
+            else:
+                # Lazy expiry: roll the buckets forward to the current window
+                gap = window_index - record[0]
+                if gap == 1:
+                    record[:] = [window_index, record[2], 0]
+                elif gap > 1:
+                    record[:] = [window_index, 0, 0]
+
+            estimate = _estimate(record[1], record[2], elapsed_fraction)
+            if estimate >= max_requests:
+                allowed, remaining = False, 0
+            else:
+                record[2] += 1
+                allowed, remaining = True, max(0, int(max_requests - estimate - 1))
+
+            self._sweep(now)
+        return allowed, remaining
+
+
+# Same algorithm in Redis: two counters per key, each expiring after two windows,
+# read and incremented in one atomic script so every worker shares the limit
+SLIDING_COUNTER_LUA = """
+local current_key = KEYS[1]
+local previous_key = KEYS[2]
+local max_requests = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local elapsed_fraction = tonumber(ARGV[3])
+local previous = tonumber(redis.call('GET', previous_key) or '0')
+local current = tonumber(redis.call('GET', current_key) or '0')
+local estimate = previous * (1 - elapsed_fraction) + current
+if estimate >= max_requests then
+    return {0, 0}
+end
+redis.call('INCR', current_key)
+redis.call('EXPIRE', current_key, window * 2)
+return {1, math.floor(max_requests - estimate - 1)}
+"""
+
+
+class RedisRateLimiter:
+    """Sliding-window counter in Redis, shared by every worker and replica"""
+
+    KEY_PREFIX = "security_rate_limit:"
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._script = redis_client.register_script(SLIDING_COUNTER_LUA)
+
+    def is_allowed(self, key: str, max_requests: int, window_seconds: int) -> Tuple[bool, int]:
+        now = time.time()
+        window_index = int(now // window_seconds)
+        elapsed_fraction = (now % window_seconds) / window_seconds
+        base = f"{self.KEY_PREFIX}{key}"
+        allowed, remaining = self._script(
+            keys=[f"{base}:{window_index}", f"{base}:{window_index - 1}"],
+            args=[max_requests, window_seconds, repr(elapsed_fraction)]
+        )
+        return bool(int(allowed)), max(0, int(remaining))
+
+
 class RateLimiter:
+    """Uses Redis when available (SECURITY_RATE_LIMIT_BACKEND=redis), else per-process memory"""
+
+    # After a Redis failure, use the in-process limiter for this many seconds
+    REDIS_RETRY_SECONDS = 30
+
     def __init__(self):
-        # Store request timestamps for each IP
-        self.requests: Dict[str, deque] = defaultdict(deque)
-        # Cleanup old entries every 5 minutes
-        self.last_cleanup = time.time()
-    
-    def cleanup_old_entries(self):
-        """Remove old request timestamps to prevent memory leaks"""
-        current_time = time.time()
-        if current_time - self.last_cleanup > 300:  # 5 minutes
-            cutoff_time = current_time - 3600  # Remove entries older than 1 hour
-            for ip in list(self.requests.keys()):
-                # Remove old timestamps
-                while self.requests[ip] and self.requests[ip][0] < cutoff_time:
-                    self.requests[ip].popleft()
-                # Remove empty entries
-                if not self.requests[ip]:
-                    del self.requests[ip]
-            self.last_cleanup = current_time
+        self.memory = MemoryRateLimiter()
+        self.redis = None
+        self._redis_down_until = 0.0
+        backend = os.getenv("SECURITY_RATE_LIMIT_BACKEND", "redis").lower()
+        if backend == "redis" and get_redis is not None:
+            redis_client = get_redis()
+            if redis_client is not None:
+                self.redis = RedisRateLimiter(redis_client)
+        if self.redis is None:
+            logger.info("Security rate limiter using per-process memory; limits are per worker")
     
     def is_allowed(self, ip: str, max_requests: int, window_seconds: int) -> Tuple[bool, int]:
         """
@@ -44,28 +156,15 @@ class RateLimiter:
         Returns:
             Tuple of (is_allowed, remaining_requests)
         """
-        current_time = time.time()
-        cutoff_time = current_time - window_seconds
-        
-        # Cleanup old entries periodically
-        self.cleanup_old_entries()
-        
-        # Get request timestamps for this IP
-        ip_requests = self.requests[ip]
-        
-        # Remove old timestamps outside the window
-        while ip_requests and ip_requests[0] < cutoff_time:
-            ip_requests.popleft()
-        
-        # Check if under limit
-        if len(ip_requests) < max_requests:
-            # Add current request timestamp
-            ip_requests.append(current_time)
-            remaining = max_requests - len(ip_requests)
-            return True, remaining
-        else:
-            remaining = 0
-            return False, remaining
+        # Different limits for the same IP get separate counters
+        key = f"{window_seconds}:{max_requests}:{ip}"
+        if self.redis is not None and time.monotonic() >= self._redis_down_until:
+            try:
+                return self.redis.is_allowed(key, max_requests, window_seconds)
+            except Exception as e:
+                self._redis_down_until = time.monotonic() + self.REDIS_RETRY_SECONDS
+                logger.warning(f"Redis rate limiter unavailable, falling back to memory: {e}")
+        return self.memory.is_allowed(key, max_requests, window_seconds)
 
 # Global rate limiter instance
 rate_limiter = RateLimiter()
@@ -0,0 +1,90 @@
+"""
+User Identity Cache for the login service
+Per-process LRU+TTL cache of users rows used to resolve access tokens
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+IDENTITY_COLUMNS = "user_id, first_name, last_name, username, date_of_birth"
+
+
+class UserCache:
+    """
+    Caches identity rows (IDENTITY_COLUMNS) by user_id, with a username
+    index for legacy tokens whose subject is the username.
+
+    Entries expire after USER_CACHE_TTL seconds and the least recently used
+    are evicted beyond USER_CACHE_SIZE. Endpoints that change a user row call
+    invalidate(); other workers pick the change up when their entry expires.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_size: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("USER_CACHE_TTL", "60"))
+        self.max_size = max_size or int(os.getenv("USER_CACHE_SIZE", "10000"))
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._by_username: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._remove(user_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(entry[1])
+
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            user_id = self._by_username.get(username)
+        if user_id is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        return self.get(user_id)
+
+    def put(self, row: Dict[str, Any]):
+        user = dict(row)
+        with self._lock:
+            self._remove(user["user_id"])
+            self._entries[user["user_id"]] = (time.monotonic() + self.ttl, user)
+            self._by_username[user["username"]] = user["user_id"]
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, user_id: int):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None and self._by_username.get(entry[1]["username"]) == user_id:
+            del self._by_username[entry[1]["username"]]
+
+    def invalidate(self, user_id: Optional[int] = None, username: Optional[str] = None):
+        """Drop a user's entry (by id or username) after their row changes"""
+        with self._lock:
+            if user_id is None and username is not None:
+                user_id = self._by_username.get(username)
+            if user_id is not None:
+                self._remove(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "ttl_seconds": self.ttl,
+            }
+
+
+user_cache = UserCache()
@@ -18,6 +18,13 @@ from fastapi.security import OAuth2PasswordBearer   # type: ignore
 import boto3                      # type: ignore  
 from psycopg2.extensions import connection      # type: ignore
 from botocore.config import Config              #type: ignore
+import sys
+
+# Add the shared auth directory to the Python path
+auth_path = os.path.join(os.path.dirname(__file__), 'auth')
+sys.path.append(auth_path)
+
+from db_pool import get_db
 from typing import Union
 
 load_dotenv()
@@ -70,28 +77,6 @@ def is_valid_password(password: str) -> bool:
         return False
     return True
 
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),  # Default PostgreSQL port
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Error connecting to database: {e}")
-
-def get_db():
-    conn = connect_db()
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-
 def create_s3_user_folder(user_id: int, bucket_name: str ):
     try:
         s3_client = boto3.client(
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark batched Facenet512 embeddings (face_inference.embed_batch) on CPU.
+
+Detects the faces in the given images once, repeats the aligned crops up to
+--faces, then times embedding them:
+  represent:  DeepFace.represent once per face (the verify_pair path)
+  batch N:    embed_batch with N crops stacked per forward pass
+and the vectorised distance step for the resulting pairs. Reports images/sec,
+where an image is one aligned face; detection is not included (it runs per
+image either way). The GPU is hidden so the numbers match the CPU-only
+vision containers.
+
+Usage:
+  python scripts/bench_face_batch.py --images id_card.jpg selfie.jpg --faces 256
+  python scripts/bench_face_batch.py --images photos/*.jpg --batch-sizes 1 16 64 --detector opencv
+"""
+
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "vision_models"))
+
+import cv2  # type: ignore
+
+import face_inference
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched face embeddings on CPU")
+    parser.add_argument("--images", nargs="+", required=True, help="Images with at least one face")
+    parser.add_argument("--faces", type=int, default=256, help="Aligned faces to embed per run")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 16, 32, 64])
+    parser.add_argument("--detector", default=face_inference.FACE_DETECTOR_BACKEND)
+    parser.add_argument("--skip-represent", action="store_true", help="Skip the one-at-a-time baseline")
+    args = parser.parse_args()
+
+    print("Loading models...")
+    face_inference._init_worker()
+
+    crops = []
+    for path in args.images:
+        img = cv2.imread(path)
+        if img is None:
+            sys.exit(f"Could not read {path}")
+        crops += [face["face"] for face in face_inference._detect(img, args.detector, anti_spoofing=False)]
+    crops = (crops * (args.faces // len(crops) + 1))[:args.faces]
+    print(f"{len(crops)} aligned faces from {len(args.images)} images ({args.detector})")
+
+    # Warm up the graph for every input shape before timing
+    for batch_size in args.batch_sizes:
+        face_inference.embed_batch(crops[:batch_size], "Facenet512", batch_size)
+    face_inference._embed(crops[0], "Facenet512")
+
+    print(f"{'mode':<14} {'seconds':>9} {'images/s':>10} {'distances ms':>13}")
+    if not args.skip_represent:
+        _, seconds = timed(lambda: [face_inference._embed(crop, "Facenet512") for crop in crops])
+        print(f"{'represent':<14} {seconds:>9.2f} {len(crops) / seconds:>10.1f} {'-':>13}")
+    for batch_size in args.batch_sizes:
+        embeddings, seconds = timed(face_inference.embed_batch, crops, "Facenet512", batch_size)
+        half = len(embeddings) // 2
+        _, distance_seconds = timed(face_inference.paired_cosine_distances, embeddings[:half], embeddings[half:2 * half])
+        print(f"{f'batch {batch_size}':<14} {seconds:>9.2f} {len(crops) / seconds:>10.1f} "
+              f"{distance_seconds * 1000:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark the /facial-recognition inference path: previous vs single-pass pipeline.
+
+previous: extract_faces(ref, opencv), extract_faces(selfie, opencv, anti_spoofing),
+          verify(ref, selfie, Facenet512, retinaface): 4 detector passes, 3 decodes
+          per image pair
+current:  face_inference.verify_pair: one in-memory decode of the upload bytes and
+          one detector pass per image, aligned crops reused for anti-spoofing and
+          Facenet512 embeddings
+
+Runs in-process on one core (no pool, no HTTP), with models loaded before
+timing, so the numbers are per-request latency as seen by one face worker.
+Needs the vision service dependencies (deepface, tensorflow, opencv).
+
+Usage:
+  python scripts/bench_face_pipeline.py --ref id_card.jpg --selfie selfie.jpg --iterations 20
+  python scripts/bench_face_pipeline.py --ref id.jpg --selfie me.jpg --detector opencv
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "vision_models"))
+
+from deepface import DeepFace  # type: ignore
+
+import face_inference
+
+
+def previous_pipeline(ref: str, selfie: str, detector: str):
+    DeepFace.extract_faces(ref, detector_backend="opencv")
+    DeepFace.extract_faces(selfie, detector_backend="opencv", anti_spoofing=True)
+    return DeepFace.verify(img1_path=ref, img2_path=selfie, model_name="Facenet512",
+                           detector_backend="retinaface", threshold=0.5)
+
+
+_uploads = {}
+
+
+def current_pipeline(ref: str, selfie: str, detector: str):
+    # The endpoint already holds the upload bytes; read them once, outside the timing
+    for path in (ref, selfie):
+        if path not in _uploads:
+            with open(path, "rb") as f:
+                _uploads[path] = f.read()
+    return face_inference.verify_pair(_uploads[ref], _uploads[selfie], detector, "Facenet512", 0.5)
+
+
+def measure(fn, ref: str, selfie: str, detector: str, iterations: int):
+    timings = []
+    result = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = fn(ref, selfie, detector)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "mean": statistics.fmean(timings),
+        "distance": result["distance"],
+        "verified": result["verified"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the face verification pipeline")
+    parser.add_argument("--ref", required=True, help="ID document image")
+    parser.add_argument("--selfie", required=True, help="Live capture image")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--detector", default=face_inference.FACE_DETECTOR_BACKEND,
+                        help="Detector for the single-pass pipeline")
+    args = parser.parse_args()
+
+    print("Loading models...")
+    face_inference._init_worker()
+    for fn in (previous_pipeline, current_pipeline):
+        fn(args.ref, args.selfie, args.detector)
+
+    results = {
+        "previous": measure(previous_pipeline, args.ref, args.selfie, args.detector, args.iterations),
+        f"current ({args.detector})": measure(current_pipeline, args.ref, args.selfie, args.detector, args.iterations),
+    }
+    print(f"{'pipeline':<26} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} {'distance':>9} verified")
+    for name, r in results.items():
+        print(f"{name:<26} {r['p50']:>9.1f} {r['p95']:>9.1f} {r['mean']:>9.1f} {r['distance']:>9.4f} {r['verified']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark failed-login lookups by username as auth_audit_log grows.
+
+Builds a scratch copy of the partitioned audit log in its own schema, loads it
+in steps up to tens of millions of rows, and after each step times:
+
+  - json:   the previous filter on details->'details'->>'username' (no index)
+  - column: the current filter on the username column (idx_audit_log_failed_login)
+
+The scratch schema is dropped at the end unless --keep is given.
+
+Usage:
+  DB_HOST=localhost DB_NAME=certcheck DB_USER=... DB_PASSWORD=... \
+    python scripts/bench_failed_login_lookup.py --sizes 1000000,10000000,30000000
+"""
+
+import os
+import time
+import argparse
+import statistics
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SCHEMA = "bench_audit"
+
+JSON_QUERY = f"""
+    SELECT log_id, ip_address, user_agent, details, created_at
+    FROM {SCHEMA}.auth_audit_log
+    WHERE user_type = %s
+    AND action IN ('login_failed', 'login_attempt')
+    AND success = FALSE
+    AND details->'details'->>'username' = %s
+    AND created_at > LOCALTIMESTAMP - make_interval(hours => %s)
+    ORDER BY created_at DESC
+"""
+
+COLUMN_QUERY = f"""
+    SELECT log_id, ip_address, user_agent, details, created_at
+    FROM {SCHEMA}.auth_audit_log
+    WHERE username = %s
+    AND user_type = %s
+    AND action IN ('login_failed', 'login_attempt')
+    AND success = FALSE
+    AND created_at > LOCALTIMESTAMP - make_interval(hours => %s)
+    ORDER BY created_at DESC
+"""
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432"),
+    )
+
+
+def create_schema(cursor, months: int):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    cursor.execute(f"""
+        CREATE TABLE {SCHEMA}.auth_audit_log (
+            log_id BIGSERIAL,
+            user_id INTEGER,
+            user_type VARCHAR(10),
+            username VARCHAR(255),
+            action VARCHAR(50) NOT NULL,
+            ip_address INET,
+            user_agent TEXT,
+            success BOOLEAN NOT NULL,
+            details JSONB,
+            created_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (log_id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    cursor.execute(f"CREATE INDEX ON {SCHEMA}.auth_audit_log(created_at)")
+    cursor.execute(f"""
+        CREATE INDEX idx_audit_log_failed_login ON {SCHEMA}.auth_audit_log(username, user_type, created_at)
+        WHERE success = FALSE AND action IN ('login_failed', 'login_attempt')
+    """)
+    cursor.execute(f"""
+        DO $$
+        DECLARE month_start DATE;
+        BEGIN
+            FOR i IN -{months + 1}..1 LOOP
+                month_start := (date_trunc('month', LOCALTIMESTAMP) + make_interval(months => i))::DATE;
+                EXECUTE format(
+                    'CREATE TABLE {SCHEMA}.%I PARTITION OF {SCHEMA}.auth_audit_log FOR VALUES FROM (%L) TO (%L)',
+                    'auth_audit_log_p' || to_char(month_start, 'YYYYMM'),
+                    month_start, (month_start + INTERVAL '1 month')::DATE
+                );
+            END LOOP;
+        END $$
+    """)
+
+
+def load_rows(cursor, start: int, stop: int, users: int, months: int):
+    """Insert rows start..stop-1 spread over the last `months` months"""
+    cursor.execute(f"""
+        INSERT INTO {SCHEMA}.auth_audit_log
+            (user_id, user_type, username, action, ip_address, user_agent, success, details, created_at)
+        SELECT
+            CASE WHEN g %% 4 = 0 THEN NULL ELSE g %% %(users)s END,
+            'user',
+            'user' || (g %% %(users)s),
+            CASE g %% 4 WHEN 0 THEN 'login_failed' WHEN 1 THEN 'login_success'
+                       WHEN 2 THEN 'token_created' ELSE 'logout' END,
+            ('10.' || (g %% 250) || '.' || (g %% 199) || '.' || (g %% 97))::INET,
+            'bench',
+            g %% 4 <> 0,
+            jsonb_build_object('details', jsonb_build_object('username', 'user' || (g %% %(users)s))),
+            LOCALTIMESTAMP - (random() * %(months)s * INTERVAL '30 days')
+        FROM generate_series(%(start)s, %(stop)s - 1) AS g
+    """, {"users": users, "months": months, "start": start, "stop": stop})
+    cursor.execute(f"ANALYZE {SCHEMA}.auth_audit_log")
+
+
+def time_query(cursor, query: str, params, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(query, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark failed-login lookups by username")
+    parser.add_argument("--sizes", default="1000000,10000000,30000000",
+                        help="Comma-separated total row counts to measure at")
+    parser.add_argument("--users", type=int, default=100000, help="Distinct usernames")
+    parser.add_argument("--months", type=int, default=3, help="Months of history to spread rows over")
+    parser.add_argument("--hours", type=int, default=24, help="Lookup window")
+    parser.add_argument("--repeat", type=int, default=20, help="Lookups per measurement")
+    parser.add_argument("--skip-json", action="store_true", help="Only time the indexed query")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch schema")
+    args = parser.parse_args()
+
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+    conn = connect()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        create_schema(cursor, args.months)
+        loaded = 0
+        print(f"{'rows':>12}  {'json ms':>10}  {'column ms':>10}")
+        for size in sizes:
+            load_rows(cursor, loaded, size, args.users, args.months)
+            loaded = size
+            username = f"user{args.users // 2}"
+            json_ms = (None if args.skip_json else
+                       time_query(cursor, JSON_QUERY, ("user", username, args.hours), max(1, args.repeat // 10)))
+            column_ms = time_query(cursor, COLUMN_QUERY, (username, "user", args.hours), args.repeat)
+            json_text = "-" if json_ms is None else f"{json_ms:.2f}"
+            print(f"{loaded:>12,}  {json_text:>10}  {column_ms:>10.2f}")
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
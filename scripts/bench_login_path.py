@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark the database side of /user-login: previous vs current query plan.
+
+previous: SELECT user, UPDATE counters, COMMIT, INSERT refresh token, COMMIT,
+          SELECT latest id_verifications row
+current:  SELECT user + latest verification (LATERAL), end read transaction,
+          UPDATE counters + INSERT refresh token, one COMMIT
+
+Password hashing is left out: it is identical for both and would dominate.
+Run against a database with the production schema; the gap grows with the
+round-trip time to the server, so measure from where the service runs. A
+scratch user is created and removed (with its refresh tokens) at the end.
+
+Usage:
+  DB_HOST=... DB_NAME=certcheck DB_USER=... DB_PASSWORD=... \
+    python scripts/bench_login_path.py --iterations 500
+"""
+
+import os
+import time
+import uuid
+import argparse
+import secrets
+import statistics
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB_NAME"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432"),
+        cursor_factory=RealDictCursor,
+    )
+
+
+def insert_refresh_token(cursor, user_id: int):
+    cursor.execute("""
+        INSERT INTO refresh_tokens (user_id, user_type, selector, token_hash, jti, expires_at, ip_address, user_agent)
+        VALUES (%s, 'user', %s, %s, %s, %s, '127.0.0.1', 'bench')
+        RETURNING token_id
+    """, (user_id, secrets.token_hex(12), secrets.token_hex(32), str(uuid.uuid4()),
+          datetime.utcnow() + timedelta(days=7)))
+
+
+def previous_login(conn, username: str):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT user_id, first_name, last_name, username, password, date_of_birth,
+                   failed_login_attempts, locked_until, is_active
+            FROM users
+            WHERE username = %s;
+        """, (username,))
+        user_data = cursor.fetchone()
+        cursor.execute("""
+            UPDATE users
+            SET failed_login_attempts = 0, locked_until = NULL, last_login = CURRENT_TIMESTAMP
+            WHERE user_id = %s
+        """, (user_data["user_id"],))
+        conn.commit()
+        insert_refresh_token(cursor, user_data["user_id"])
+        conn.commit()
+        cursor.execute("""
+            SELECT status
+            FROM id_verifications
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+            LIMIT 1;
+        """, (user_data["user_id"],))
+        cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def current_login(conn, username: str):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT u.user_id, u.username, u.password, u.failed_login_attempts,
+                   u.locked_until, u.is_active, v.status AS verification_status
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT status
+                FROM id_verifications
+                WHERE user_id = u.user_id
+                ORDER BY created_at DESC
+                LIMIT 1
+            ) v ON TRUE
+            WHERE u.username = %s;
+        """, (username,))
+        user_data = cursor.fetchone()
+        conn.rollback()
+        cursor.execute("""
+            UPDATE users
+            SET failed_login_attempts = 0, locked_until = NULL, last_login = CURRENT_TIMESTAMP,
+                password = COALESCE(%s, password)
+            WHERE user_id = %s
+        """, (None, user_data["user_id"]))
+        insert_refresh_token(cursor, user_data["user_id"])
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def measure(fn, conn, username: str, iterations: int):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(conn, username)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "mean": statistics.fmean(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /user-login database path")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = connect()
+    username = f"bench_login_{secrets.token_hex(4)}"
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO users (first_name, last_name, username, password, date_of_birth)
+        VALUES ('Bench', 'User', %s, 'x', '1990-01-01')
+        RETURNING user_id
+    """, (username,))
+    user_id = cursor.fetchone()["user_id"]
+    conn.commit()
+    try:
+        for fn in (previous_login, current_login):
+            measure(fn, conn, username, args.warmup)
+        results = {
+            "previous": measure(previous_login, conn, username, args.iterations),
+            "current": measure(current_login, conn, username, args.iterations),
+        }
+        print(f"{'path':<10} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+        for name, r in results.items():
+            print(f"{name:<10} {r['p50']:>8.2f} {r['p95']:>8.2f} {r['mean']:>8.2f}")
+    finally:
+        conn.rollback()
+        cursor.execute("DELETE FROM refresh_tokens WHERE user_id = %s AND user_type = 'user'", (user_id,))
+        cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+        conn.commit()
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
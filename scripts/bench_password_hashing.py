@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark password hashing cost settings for the login service.
+
+For each bcrypt round count and scrypt log2(N) in range, reports the time to
+verify one password and the resulting logins/sec per core; with --threads it
+also measures aggregate throughput with that many concurrent verifications
+(both KDFs release the GIL). Use it to choose PASSWORD_HASH_TARGET_MS, or a
+fixed PASSWORD_HASH_COST, against the login SLO.
+
+Usage:
+  python scripts/bench_password_hashing.py
+  python scripts/bench_password_hashing.py --scheme bcrypt --costs 10-13 --threads 4
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "login_register"))
+from password_hashing import PasswordHasher, SCHEMES  # noqa: E402
+
+DEFAULT_COSTS = {"bcrypt": "10-14", "scrypt": "14-17"}
+
+
+def parse_costs(spec: str):
+    low, _, high = spec.partition("-")
+    return range(int(low), int(high or low) + 1)
+
+
+def time_verify(hasher: PasswordHasher, stored: str, samples: int) -> float:
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.verify("benchmark-password", stored)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def threaded_throughput(hasher: PasswordHasher, stored: str, threads: int, per_thread: int) -> float:
+    def work(_):
+        for _ in range(per_thread):
+            hasher.verify("benchmark-password", stored)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(work, range(threads)))
+    return threads * per_thread / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark password hashing cost settings")
+    parser.add_argument("--scheme", choices=SCHEMES + ("all",), default="all")
+    parser.add_argument("--costs", help="Cost range, e.g. 10-14 (default depends on scheme)")
+    parser.add_argument("--samples", type=int, default=5, help="Verifications timed per setting")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Also measure aggregate throughput with this many threads")
+    args = parser.parse_args()
+
+    schemes = SCHEMES if args.scheme == "all" else (args.scheme,)
+    print(f"{'scheme':<8} {'cost':>4} {'ms/login':>10} {'logins/s/core':>14}"
+          + (f" {'logins/s @' + str(args.threads) + 't':>16}" if args.threads else ""))
+    for scheme in schemes:
+        for cost in parse_costs(args.costs or DEFAULT_COSTS[scheme]):
+            hasher = PasswordHasher(scheme=scheme, cost=cost)
+            stored = hasher.hash("benchmark-password")
+            ms = time_verify(hasher, stored, args.samples)
+            line = f"{scheme:<8} {cost:>4} {ms:>10.1f} {1000 / ms:>14.1f}"
+            if args.threads:
+                rate = threaded_throughput(hasher, stored, args.threads, max(1, args.samples // 2))
+                line += f" {rate:>16.1f}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark S3 upload and list throughput: client per request vs the shared client.
+
+per-request: a new boto3 client for every call (the previous create_s3_client),
+             blocking call made directly in the coroutine
+shared:      auth/s3_client.py: one client with a sized keep-alive pool, calls
+             run on the S3 executor via s3_call
+
+Runs against moto's standalone server by default (pip install "moto[server]"),
+or any S3-compatible endpoint such as MinIO via --endpoint.
+
+Usage:
+  python scripts/bench_s3_client.py --requests 400 --concurrency 32
+  python scripts/bench_s3_client.py --endpoint http://localhost:9000 --bucket bench
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+import boto3                                    # type: ignore
+from botocore.config import Config              # type: ignore
+
+PAYLOAD = b"%PDF-1.4\n" + os.urandom(64 * 1024)
+
+
+def per_request_client(endpoint: str):
+    return boto3.client(
+        "s3",
+        config=Config(signature_version="s3v4"),
+        region_name="eu-north-1",
+        endpoint_url=endpoint,
+        aws_access_key_id="bench",
+        aws_secret_access_key="bench",
+    )
+
+
+async def run(label: str, op, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await op(i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {requests / elapsed:>10.1f} req/s  ({elapsed:.2f}s)")
+
+
+async def main_async(args):
+    os.environ["S3_ENDPOINT_URL"] = args.endpoint
+    os.environ["AWS_ACCESS_KEY"] = "bench"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "bench"
+    sys.path.append(os.path.join(os.path.dirname(__file__), "..", "auth"))
+    from s3_client import get_s3_client, s3_call
+
+    setup = per_request_client(args.endpoint)
+    try:
+        setup.create_bucket(Bucket=args.bucket,
+                            CreateBucketConfiguration={"LocationConstraint": "eu-north-1"})
+    except setup.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    async def upload_per_request(i):
+        per_request_client(args.endpoint).put_object(
+            Bucket=args.bucket, Key=f"user_1/per_request_{i}.pdf", Body=PAYLOAD, ContentType="application/pdf")
+
+    async def list_per_request(i):
+        per_request_client(args.endpoint).list_objects_v2(Bucket=args.bucket, Prefix="user_1/")
+
+    shared = get_s3_client()
+
+    async def upload_shared(i):
+        await s3_call(shared.put_object, Bucket=args.bucket, Key=f"user_1/shared_{i}.pdf",
+                      Body=PAYLOAD, ContentType="application/pdf")
+
+    async def list_shared(i):
+        await s3_call(shared.list_objects_v2, Bucket=args.bucket, Prefix="user_1/")
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, endpoint {args.endpoint}")
+    await run("upload per-request", upload_per_request, args.requests, args.concurrency)
+    await run("upload shared", upload_shared, args.requests, args.concurrency)
+    await run("list per-request", list_per_request, args.requests, args.concurrency)
+    await run("list shared", list_shared, args.requests, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request vs shared S3 clients")
+    parser.add_argument("--endpoint", help="S3-compatible endpoint (default: start a moto server)")
+    parser.add_argument("--bucket", default="certcheck-bench")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    server = None
+    if not args.endpoint:
+        from moto.server import ThreadedMotoServer  # type: ignore
+        server = ThreadedMotoServer(port=0)
+        server.start()
+        host, port = server.get_host_and_port()
+        args.endpoint = f"http://{host}:{port}"
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        if server:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
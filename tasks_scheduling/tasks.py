@@ -17,6 +17,13 @@ from psycopg2 import errors
 from redis import Redis
 from urllib.parse import urlparse
 from celery.result import AsyncResult
+import sys
+
+# Add the shared auth directory to the Python path
+auth_path = os.path.join(os.path.dirname(__file__), 'auth')
+sys.path.append(auth_path)
+
+from db_pool import get_db, get_pool, PoolTimeoutError
 
 cel_log = get_task_logger(__name__)
 
@@ -46,29 +53,14 @@ redis_client = Redis(
 
 
 def connect_db():
+    """Check out a pooled connection; return it with get_pool().putconn()"""
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),  # Default PostgreSQL port
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except psycopg2.Error as e:
+        return get_pool().getconn()
+    except (psycopg2.Error, PoolTimeoutError) as e:
         logger.error(f"Error connecting to database: {e}")
         raise HTTPException(status_code=500, detail=f"Error connecting to database: {e}")
 
 
-def get_db():
-    conn = connect_db()
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-
 class ValidationRequest(BaseModel):
     scheme: str
     first_name: Optional[str]
@@ -327,7 +319,7 @@ def validate_cscs_card(self, username: str, request: Dict[str, Any]):
                 logger.error(f"Non-duplicate database error for {username}: {str(e)}")
                 self.retry(exc=e, countdown=60)
         finally:
-            db.close()
+            get_pool().putconn(db)
     except Exception as e:
         logger.error(f"Task failed for {username}: {str(e)}")
         self.retry(exc=e, countdown=60)  # Retry after 60 seconds, up to 3 times
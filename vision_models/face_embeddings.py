@@ -0,0 +1,88 @@
+"""
+Face Embedding Store for the Vision Models API
+Persists reference (ID photo) embeddings so re-verification only embeds the selfie
+"""
+
+import json
+import hashlib
+from typing import Optional, Dict, Any, List
+
+import psycopg2  # type: ignore
+from psycopg2.extras import RealDictCursor  # type: ignore
+
+
+def content_hash(image_bytes: bytes) -> str:
+    """Key for an ID image: the same document re-uploaded maps to the same embeddings"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class FaceEmbeddingStore:
+    """
+    face_embeddings rows keyed by (user_id, content_sha256, model_name,
+    detector_backend). embeddings is the float32 little-endian matrix
+    (face_count x dims) returned by face_inference.verify_pair, 2 KB per
+    Facenet512 face.
+    """
+
+    def __init__(self, db_connection):
+        self.db_connection = db_connection
+
+    def _get_cursor(self):
+        """Get database cursor with proper error handling"""
+        try:
+            return self.db_connection.cursor(cursor_factory=RealDictCursor)
+        except psycopg2.Error as e:
+            raise Exception(f"Database connection error: {e}")
+
+    def get(self, user_id: int, content_sha256: str, model_name: str,
+            detector_backend: str) -> Optional[Dict[str, Any]]:
+        """Stored embeddings for an ID image (bumping last_used_at), or None"""
+        cursor = self._get_cursor()
+        try:
+            cursor.execute("""
+                UPDATE face_embeddings
+                SET last_used_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s AND content_sha256 = %s AND model_name = %s AND detector_backend = %s
+                RETURNING embeddings, dims, face_count, facial_areas
+            """, (user_id, content_sha256, model_name, detector_backend))
+            row = cursor.fetchone()
+            self.db_connection.commit()
+            if not row:
+                return None
+            return {
+                "embeddings": bytes(row["embeddings"]),
+                "dims": row["dims"],
+                "face_count": row["face_count"],
+                "facial_areas": row["facial_areas"],
+            }
+        except psycopg2.Error as e:
+            self.db_connection.rollback()
+            raise Exception(f"Failed to read face embeddings: {e}")
+        finally:
+            cursor.close()
+
+    def put(self, user_id: int, id_image_url: str, content_sha256: str, model_name: str,
+            detector_backend: str, embeddings: bytes, dims: int, facial_areas: List[Dict[str, Any]]):
+        """Store (or replace) the embeddings for an ID image"""
+        cursor = self._get_cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO face_embeddings
+                    (user_id, id_image_url, content_sha256, model_name, detector_backend,
+                     dims, face_count, embeddings, facial_areas)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, content_sha256, model_name, detector_backend) DO UPDATE
+                SET id_image_url = EXCLUDED.id_image_url,
+                    dims = EXCLUDED.dims,
+                    face_count = EXCLUDED.face_count,
+                    embeddings = EXCLUDED.embeddings,
+                    facial_areas = EXCLUDED.facial_areas,
+                    last_used_at = CURRENT_TIMESTAMP
+            """, (user_id, id_image_url, content_sha256, model_name, detector_backend,
+                  dims, len(facial_areas), psycopg2.Binary(embeddings), json.dumps(facial_areas)))
+            self.db_connection.commit()
+        except psycopg2.Error as e:
+            self.db_connection.rollback()
+            raise Exception(f"Failed to store face embeddings: {e}")
+        finally:
+            cursor.close()
@@ -0,0 +1,419 @@
+"""
+Face Inference Pool for the Vision Models API
+Runs DeepFace in worker processes with preloaded models, bounded queueing and per-request timeouts
+"""
+
+import os
+import time
+import asyncio
+import threading
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any, Callable, List, Tuple
+
+from fastapi import HTTPException  # type: ignore
+from dotenv import load_dotenv  # type: ignore
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WARMUP_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sixfaces410.jpg")
+
+# Detector for the single-pass verification pipeline (opencv, retinaface, mtcnn, ...)
+FACE_DETECTOR_BACKEND = os.getenv("FACE_DETECTOR_BACKEND", "retinaface")
+# Aligned faces per embedding forward pass in bulk re-verification
+FACE_BATCH_SIZE = int(os.getenv("FACE_BATCH_SIZE") or 32)
+
+
+# ------------------------------------------------------------------ worker side
+# These run inside the pool processes; DeepFace is imported there only.
+
+def _init_worker():
+    """Load the models once per worker so requests never pay for it"""
+    from deepface import DeepFace  # type: ignore
+    try:
+        DeepFace.build_model("Facenet512")
+        if os.path.exists(WARMUP_IMAGE):
+            # Loads the detector and the anti-spoofing models
+            DeepFace.extract_faces(WARMUP_IMAGE, detector_backend=FACE_DETECTOR_BACKEND,
+                                   anti_spoofing=True, enforce_detection=False)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Face worker {os.getpid()} failed to preload models: {e}")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _detect(img, detector_backend: str, anti_spoofing: bool) -> List[Dict[str, Any]]:
+    """One detector pass; faces come back aligned, as BGR pixels in 0-255"""
+    from deepface import DeepFace  # type: ignore
+    return DeepFace.extract_faces(img, detector_backend=detector_backend, align=True,
+                                  color_face="bgr", normalize_face=False, anti_spoofing=anti_spoofing)
+
+
+def _embed(face, model_name: str):
+    """Embedding of an already detected and aligned crop"""
+    from deepface import DeepFace  # type: ignore
+    result = DeepFace.represent(face, model_name=model_name, detector_backend="skip", enforce_detection=False)
+    return result[0]["embedding"]
+
+
+def _decode(image_bytes: bytes):
+    """BGR array of an encoded image, without a temp file"""
+    import cv2  # type: ignore
+    import numpy as np  # type: ignore
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+
+def _plain(value):
+    """Facial areas with numpy scalars turned into JSON-friendly Python values"""
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value.item() if hasattr(value, "item") else value
+
+
+def embed_faces(img, detector_backend: str, model_name: str, anti_spoofing: bool = False):
+    """
+    (float32 matrix with one embedding per detected face, faces without crops).
+    Raises ValueError when no face is found or, with anti_spoofing, a face is judged fake.
+    """
+    import numpy as np  # type: ignore
+    faces = _detect(img, detector_backend, anti_spoofing=anti_spoofing)
+    # extract_faces only flags spoofs (is_real), it does not raise on them
+    if anti_spoofing and any(not face.get("is_real", True) for face in faces):
+        raise ValueError("Spoof detected in the comparison image")
+    matrix = np.asarray([_embed(face["face"], model_name) for face in faces], dtype=np.float32)
+    return matrix, [_plain({k: v for k, v in face.items() if k != "face"}) for face in faces]
+
+
+def closest_pair(ref_matrix, comp_matrix):
+    """(cosine distance, ref index, comp index) of the closest faces, vectorised"""
+    import numpy as np  # type: ignore
+    ref = ref_matrix / np.linalg.norm(ref_matrix, axis=1, keepdims=True)
+    comp = comp_matrix / np.linalg.norm(comp_matrix, axis=1, keepdims=True)
+    distances = 1.0 - ref @ comp.T
+    i, j = np.unravel_index(int(np.argmin(distances)), distances.shape)
+    return float(distances[i, j]), int(i), int(j)
+
+
+def verify_pair(ref_image: Optional[bytes], comp_image: bytes, detector_backend: str = FACE_DETECTOR_BACKEND,
+                model_name: str = "Facenet512", threshold: float = 0.5, anti_spoofing: bool = True,
+                ref_embeddings: Optional[bytes] = None,
+                ref_facial_areas: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Single-pass replacement for extract_faces + extract_faces(anti_spoofing) + verify.
+
+    Each image is decoded once and run through the detector once. The
+    anti-spoofing model scores the comparison image's detected faces, and the
+    aligned crops go straight to the embedding model. The result has the
+    same shape as DeepFace.verify (cosine distance, closest pair of faces).
+
+    With ref_embeddings (float32 bytes from an earlier result, see
+    face_embeddings.py) the reference image is not touched at all. Otherwise
+    the result carries "ref_embeddings", "ref_dims" and "ref_facial_areas"
+    so the caller can store them.
+
+    Images are the encoded upload bytes, decoded in memory and handed to the
+    detector as arrays.
+
+    Raises ValueError when no face is found in an image or a spoof is detected.
+    """
+    import numpy as np  # type: ignore
+
+    started_at = time.perf_counter()
+    try:
+        comp_img = _decode(comp_image)
+    except ValueError:
+        raise ValueError("Could not decode the comparison image")
+
+    computed_ref = ref_embeddings is None
+    if computed_ref:
+        try:
+            ref_img = _decode(ref_image)
+        except ValueError:
+            raise ValueError("Could not decode the reference image")
+        # enforce_detection (the default) raises ValueError when an image has no face
+        ref_matrix, ref_faces = embed_faces(ref_img, detector_backend, model_name)
+        ref_facial_areas = [face["facial_area"] for face in ref_faces]
+    else:
+        ref_matrix = np.frombuffer(ref_embeddings, dtype="<f4").reshape(len(ref_facial_areas), -1)
+
+    # With anti_spoofing, embed_faces raises ValueError when any face is judged fake
+    comp_matrix, comp_faces = embed_faces(comp_img, detector_backend, model_name, anti_spoofing=anti_spoofing)
+
+    distance, i, j = closest_pair(ref_matrix, comp_matrix)
+    result = {
+        "verified": distance <= threshold,
+        "distance": distance,
+        "threshold": threshold,
+        "model": model_name,
+        "detector_backend": detector_backend,
+        "similarity_metric": "cosine",
+        "facial_areas": {"img1": ref_facial_areas[i], "img2": comp_faces[j]["facial_area"]},
+        "is_real": comp_faces[j].get("is_real", True),
+        "antispoof_score": comp_faces[j].get("antispoof_score"),
+        "time": round(time.perf_counter() - started_at, 2),
+    }
+    if computed_ref:
+        result["ref_embeddings"] = ref_matrix.astype("<f4").tobytes()
+        result["ref_dims"] = int(ref_matrix.shape[1])
+        result["ref_facial_areas"] = ref_facial_areas
+    return result
+
+
+def _largest_face(faces: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return max(faces, key=lambda face: face["facial_area"]["w"] * face["facial_area"]["h"])
+
+
+def _preprocess(face, target_size):
+    """
+    The input DeepFace.represent(detector_backend="skip") builds for an aligned
+    crop, as a (1, h, w, 3) array. represent flips the crop to RGB and back, so
+    the model sees it in BGR, as _detect returns it; resize_image scales to 0-1.
+    """
+    from deepface.modules import preprocessing  # type: ignore
+    img = preprocessing.resize_image(img=face, target_size=(target_size[1], target_size[0]))
+    return preprocessing.normalize_input(img=img, normalization="base")
+
+
+def embed_batch(faces, model_name: str = "Facenet512", batch_size: int = FACE_BATCH_SIZE):
+    """
+    float32 matrix with one embedding per aligned crop. Crops are stacked into
+    one tensor per forward pass instead of calling represent once per face.
+    """
+    import numpy as np  # type: ignore
+    from deepface import DeepFace  # type: ignore
+    model = DeepFace.build_model(model_name)
+    outputs = []
+    for start in range(0, len(faces), batch_size):
+        batch = np.concatenate([_preprocess(face, model.input_shape) for face in faces[start:start + batch_size]])
+        outputs.append(model.model(batch, training=False).numpy())
+    if not outputs:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.concatenate(outputs).astype(np.float32)
+
+
+def paired_cosine_distances(a, b):
+    """Cosine distance between row i of a and row i of b, for every i at once"""
+    import numpy as np  # type: ignore
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return 1.0 - np.einsum("ij,ij->i", a, b)
+
+
+def verify_batch(pairs: List[Tuple[bytes, bytes]], detector_backend: str = FACE_DETECTOR_BACKEND,
+                 model_name: str = "Facenet512", threshold: float = 0.5,
+                 batch_size: int = FACE_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Bulk verify_pair for (reference, comparison) image bytes.
+
+    Detection still runs per image, but the largest face of every image goes
+    through the embedding model batch_size at a time and all distances come
+    from one vectorised step. No anti-spoofing: this re-checks photos that
+    passed it when they were captured. A pair whose images cannot be decoded
+    or have no face gets an "error" instead of failing the batch.
+    """
+    started_at = time.perf_counter()
+    crops = []
+    results: List[Dict[str, Any]] = []
+    for ref_bytes, comp_bytes in pairs:
+        try:
+            ref_face = _largest_face(_detect(_decode(ref_bytes), detector_backend, anti_spoofing=False))
+            comp_face = _largest_face(_detect(_decode(comp_bytes), detector_backend, anti_spoofing=False))
+        except ValueError as e:
+            results.append({"error": str(e)})
+            continue
+        crops += [ref_face["face"], comp_face["face"]]
+        results.append({"facial_areas": {"img1": _plain(ref_face["facial_area"]),
+                                         "img2": _plain(comp_face["facial_area"])}})
+    detected_at = time.perf_counter()
+
+    if crops:
+        embeddings = embed_batch(crops, model_name, batch_size)
+        distances = paired_cosine_distances(embeddings[0::2], embeddings[1::2])
+        for result, distance in zip((r for r in results if "error" not in r), distances.tolist()):
+            result.update(verified=distance <= threshold, distance=distance)
+    finished_at = time.perf_counter()
+
+    return {
+        "results": results,
+        "model": model_name,
+        "detector_backend": detector_backend,
+        "threshold": threshold,
+        "batch_size": batch_size,
+        "faces_embedded": len(crops),
+        "detect_seconds": round(detected_at - started_at, 3),
+        "embed_seconds": round(finished_at - detected_at, 3),
+    }
+
+
+# ------------------------------------------------------------------ API side
+
+class FaceInferenceSaturated(Exception):
+    """Raised when the face inference queue is already at its depth limit"""
+    pass
+
+
+class FaceInferencePool:
+    """
+    Process pool for DeepFace detection and verification.
+
+    DeepFace holds the GIL for much of its work, so threads would not scale
+    and running it inline blocks the event loop for seconds. Each of
+    FACE_POOL_WORKERS processes (spawned, so TensorFlow is never forked)
+    loads the models once at start. At most FACE_POOL_MAX_QUEUE jobs wait
+    behind the running ones; further submissions are rejected straight away
+    (503). A caller stops waiting after FACE_POOL_TIMEOUT seconds (504). A
+    running job cannot be interrupted, so its slot stays taken until it
+    finishes, which keeps admission control honest under overload.
+    """
+
+    SAMPLE_SIZE = 1000
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        # Empty values in the env file mean "use the default"
+        self.max_workers = max_workers or int(os.getenv("FACE_POOL_WORKERS") or max(1, (os.cpu_count() or 2) // 2))
+        self.max_queue = (max_queue if max_queue is not None
+                          else int(os.getenv("FACE_POOL_MAX_QUEUE") or self.max_workers * 4))
+        self.timeout = timeout or float(os.getenv("FACE_POOL_TIMEOUT") or 60)
+        self._executor = self._new_executor()
+
+        self._lock = threading.Lock()
+        self._pending = 0  # queued + running
+        self._submitted = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._latency_ms: "deque[float]" = deque(maxlen=self.SAMPLE_SIZE)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker)
+
+    async def warmup(self):
+        """Start every worker (and load its models) before the first request"""
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _ping)
+                                      for _ in range(self.max_workers)))
+        logger.info(f"Face inference pool ready: {len(set(pids))} workers")
+
+    def _reserve(self):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise FaceInferenceSaturated(
+                    f"Face inference pool saturated ({self._pending} pending, limit {self.max_workers + self.max_queue})")
+            self._pending += 1
+            self._submitted += 1
+
+    def _done(self, started_at: float, future):
+        with self._lock:
+            self._pending -= 1
+            self._latency_ms.append((time.perf_counter() - started_at) * 1000)
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    async def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """
+        Run a worker function; raises FaceInferenceSaturated when the queue is
+        full and asyncio.TimeoutError when the result takes too long.
+        """
+        self._reserve()
+        started_at = time.perf_counter()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); replace the pool and retry once
+            logger.error("Face inference pool broken, restarting workers")
+            self._executor = self._new_executor()
+            try:
+                future = self._executor.submit(fn, *args)
+            except Exception:
+                with self._lock:
+                    self._pending -= 1
+                raise
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(lambda f: self._done(started_at, f))
+        try:
+            # shield: on timeout stop waiting, but leave the job (and its slot) to finish
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timed_out += 1
+            raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, rejection/timeout counters and end-to-end latency (ms, recent samples)"""
+        with self._lock:
+            latencies = sorted(self._latency_ms)
+            running = min(self._pending, self.max_workers)
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "timeout_seconds": self.timeout,
+                "running": running,
+                "queued": self._pending - running,
+                "submitted": self._submitted,
+                "completed": self._completed,
+                "failed": self._failed,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "latency_ms": {
+                    "avg": round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                    "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3) if latencies else 0.0,
+                    "max": round(latencies[-1], 3) if latencies else 0.0,
+                },
+            }
+
+    def shutdown(self):
+        """Stop the workers, dropping queued jobs"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_face_pool: Optional[FaceInferencePool] = None
+_face_pool_lock = threading.Lock()
+
+
+def get_face_pool() -> FaceInferencePool:
+    """Return the process-wide face inference pool"""
+    global _face_pool
+    if _face_pool is None:
+        with _face_pool_lock:
+            if _face_pool is None:
+                _face_pool = FaceInferencePool()
+    return _face_pool
+
+
+async def run_face_inference(fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+    """Run a worker function on the face pool; 503 when the queue is full, 504 on timeout"""
+    pool = get_face_pool()
+    try:
+        return await pool.run(fn, *args, timeout=timeout)
+    except FaceInferenceSaturated as e:
+        logger.warning(str(e))
+        raise HTTPException(
+            status_code=503,
+            detail="Face verification is busy, please try again shortly",
+            headers={"Retry-After": "5"},
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Face inference timed out after {timeout or pool.timeout}s")
+        raise HTTPException(status_code=504, detail="Face verification timed out, please try again")
@@ -0,0 +1,128 @@
+"""
+Tests for the face verification pipeline (face_inference.py) and the vision endpoints using it
+
+Run from vision_models/:  python -m pytest test_face_inference.py
+Detection and embedding are replaced with fakes; tests needing the real
+DeepFace models are skipped when deepface is not installed.
+"""
+
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "auth"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+import face_inference
+
+
+def _face(is_real=True):
+    return {
+        "face": np.full((160, 160, 3), 128, dtype=np.uint8),
+        "facial_area": {"x": 10, "y": 10, "w": 100, "h": 100},
+        "confidence": 0.99,
+        "is_real": is_real,
+        "antispoof_score": 0.97,
+    }
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    """Decode, detect and embed without OpenCV or DeepFace; the selfie's liveness is set per test"""
+    selfie = {"is_real": True}
+
+    def detect(img, detector_backend, anti_spoofing):
+        if anti_spoofing:
+            return [_face(is_real=selfie["is_real"])]
+        return [{k: v for k, v in _face().items() if k not in ("is_real", "antispoof_score")}]
+
+    monkeypatch.setattr(face_inference, "_decode", lambda image_bytes: np.zeros((200, 200, 3), dtype=np.uint8))
+    monkeypatch.setattr(face_inference, "_detect", detect)
+    monkeypatch.setattr(face_inference, "_embed", lambda face, model_name: [1.0] * 512)
+    return selfie
+
+
+def test_verify_pair_accepts_real_selfie(fake_models):
+    result = face_inference.verify_pair(b"id", b"selfie")
+    assert result["verified"] is True
+    assert result["is_real"] is True
+
+
+def test_verify_pair_rejects_spoofed_selfie(fake_models):
+    fake_models["is_real"] = False
+    with pytest.raises(ValueError, match="Spoof"):
+        face_inference.verify_pair(b"id", b"selfie")
+
+
+def test_verify_pair_rejects_spoof_against_stored_embeddings(fake_models):
+    fake_models["is_real"] = False
+    stored = np.ones((1, 512), dtype="<f4").tobytes()
+    with pytest.raises(ValueError, match="Spoof"):
+        face_inference.verify_pair(None, b"selfie", ref_embeddings=stored,
+                                   ref_facial_areas=[{"x": 0, "y": 0, "w": 1, "h": 1}])
+
+
+def test_facial_recognition_endpoint_rejects_spoofed_selfie(fake_models, monkeypatch):
+    pytest.importorskip("fastapi")
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient  # type: ignore
+    import vision_api
+
+    async def run_inline(fn, *args, timeout=None):
+        return fn(*args)
+
+    monkeypatch.setattr(vision_api, "run_face_inference", run_inline)
+    fake_models["is_real"] = False
+    client = TestClient(vision_api.app)  # no lifespan: the face pool is never started
+    response = client.post("/facial-recognition_test", files={
+        "reference_image": ("id.jpg", b"id", "image/jpeg"),
+        "comparison_image": ("selfie.jpg", b"selfie", "image/jpeg"),
+    })
+    assert response.status_code == 400
+    assert "Spoof" in response.json()["detail"]
+
+
+@pytest.fixture
+def small_facenet(monkeypatch):
+    """A tiny random Keras model standing in for Facenet512 (no weight download), shared by DeepFace and embed_batch"""
+    pytest.importorskip("tensorflow")
+    pytest.importorskip("deepface")
+    import tensorflow as tf  # type: ignore
+    from deepface.models.FacialRecognition import FacialRecognition  # type: ignore
+    from deepface.modules import modeling  # type: ignore
+
+    tf.keras.utils.set_random_seed(0)
+
+    class SmallFacenet(FacialRecognition):
+        def __init__(self):
+            self.model_name = "Facenet512"
+            self.input_shape = (160, 160)
+            self.output_shape = 16
+            self.model = tf.keras.Sequential([
+                tf.keras.Input(shape=(160, 160, 3)),
+                tf.keras.layers.Conv2D(4, 3),
+                tf.keras.layers.GlobalAveragePooling2D(),
+                tf.keras.layers.Dense(16),
+            ])
+
+    model = SmallFacenet()
+    monkeypatch.setattr(modeling, "build_model", lambda task, model_name: model)
+    return model
+
+
+def test_embed_batch_matches_represent(small_facenet):
+    rng = np.random.default_rng(0)
+    # Aligned crops as _detect returns them: BGR, 0-255, not square
+    crops = [rng.integers(0, 256, size=(180, 140, 3)).astype(np.float64) for _ in range(3)]
+    crops[0][:, :, 0] = 255  # strongly blue, so a channel swap changes the embedding
+
+    batched = face_inference.embed_batch(crops, "Facenet512", batch_size=2)
+    one_at_a_time = np.asarray([face_inference._embed(crop, "Facenet512") for crop in crops], dtype=np.float32)
+
+    assert batched.shape == (3, 16)
+    np.testing.assert_allclose(batched, one_at_a_time, rtol=1e-4, atol=1e-5)
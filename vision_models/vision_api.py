@@ -1,4 +1,6 @@
 import os
+import io
+import time
 import base64
 import json     # type: ignore
 from fastapi import FastAPI, File, UploadFile, HTTPException  # type: ignore
@@ -6,17 +8,15 @@ from openai import OpenAI               # type: ignore
 from openai import APIError               # type: ignore
 from dotenv import load_dotenv              # type: ignore
 from pathlib import Path
-import tempfile
 from pydantic import BaseModel      # type: ignore
-from typing import Dict
+from typing import Dict, List, Optional
 from fastapi.middleware.cors import CORSMiddleware  # type: ignore
 # import boto3        # type: ignore
 from fastapi.security import OAuth2PasswordBearer   # type: ignore
 from jose import JWTError, jwt  # type: ignore
+from jose import ExpiredSignatureError      #type: ignore
 from fastapi import Depends, status   # type: ignore
 # from datetime import date
-from deepface import DeepFace  # type: ignore
-from pdf2image import convert_from_path, convert_from_bytes     # type: ignore
 # from pdf2image.exceptions import (                                  # type: ignore
 #     PDFInfoNotInstalledError,
 #     PDFPageCountError,
@@ -27,15 +27,32 @@ import psycopg2                             # type: ignore
 from psycopg2 import connect, Error as psycopg2Error     # type: ignore
 from psycopg2.extras import RealDictCursor                  # type: ignore
 import httpx  # type: ignore
+from botocore.exceptions import ClientError  # type: ignore
 # import datetime
 import logging
-# import asyncio
+import asyncio
 # from fastapi import BackgroundTasks, Request, Response  # type: ignore
 import warnings
 warnings.filterwarnings("ignore", category=UserWarning, module="deepface")  # type: ignore
 from tenacity import retry, stop_after_attempt, wait_fixed, wait_exponential, retry_if_exception_type  # type: ignore
 # from pydantic import ValidationError  # type: ignore
 from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse  # type: ignore
+from fastapi.concurrency import run_in_threadpool  # type: ignore
+import sys
+
+# Add the shared auth directory to the Python path
+auth_path = os.path.join(os.path.dirname(__file__), 'auth')
+sys.path.append(auth_path)
+
+from db_pool import get_db, get_pool, close_pool
+import face_inference
+from face_inference import get_face_pool, run_face_inference
+from face_embeddings import FaceEmbeddingStore, content_hash
+from s3_client import download_to_file
+from jwt_auth import get_authenticator
+
+authenticator = get_authenticator()
 # from playwright_stealth import Stealth # type: ignore
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -55,26 +72,28 @@ ACCESS_TOKEN_EXPIRE_MINUTES = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES")
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+MAX_CERTIFICATE_BYTES = 50 * 1024 * 1024  # largest upload the presigned POST policy allows
+MAX_FACE_IMAGE_BYTES = 20 * 1024 * 1024
+PDF_RENDER_DPI = 200  # pdf2image's default
+PDF_RENDER_TIMEOUT = 60
+# Bulk re-verification: employees per face pool job, and how long one job may take
+FACE_REVERIFY_CHUNK = int(os.getenv("FACE_REVERIFY_CHUNK") or 64)
+FACE_REVERIFY_TIMEOUT = float(os.getenv("FACE_REVERIFY_TIMEOUT") or 600)
+
 @asynccontextmanager
 async def lifespan(app : FastAPI):
     print("Starting up the Vision Models API...")
     logger.info("Starting up the Vision Models API...")
     try:
-        DeepFace.build_model("Facenet512")
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        dummy_image_path = os.path.join(BASE_DIR, "sixfaces410.jpg")
-        if os.path.exists(dummy_image_path):
-            DeepFace.extract_faces(dummy_image_path, detector_backend="retinaface")
-            logger.info("RetinaFace model preloaded successfully")
-            DeepFace.extract_faces(dummy_image_path, detector_backend="opencv")
-            logger.info("OpenCV model preloaded successfully")
-        else:
-            logger.warning("Dummy image not found; skipping RetinaFace preload")
+        # Each face worker loads Facenet512 and the detectors when it starts
+        await get_face_pool().warmup()
         logger.info("DeepFace models preloaded successfully")
     except Exception as e:
         logger.error(f"Failed to preload DeepFace models: {str(e)}")
     yield
     logger.info("Shutting down the Vision Models API...")
+    get_face_pool().shutdown()
+    close_pool()
 
 app = FastAPI(title="Vision Models API", description="API for Vision Models", lifespan=lifespan)
 # origins = [
@@ -90,63 +109,56 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
-def connect_db():
-    try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),  # Default PostgreSQL port
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Error connecting to database: {e}")
+@app.get("/health/db")
+async def database_health():
+    """Database pool health and saturation metrics"""
+    result = await run_in_threadpool(get_pool().health_check)
+    return JSONResponse(status_code=200 if result["healthy"] else 503, content=result)
+
+@app.get("/health/face-inference")
+async def face_inference_health():
+    """Face inference pool queue depth, rejections, timeouts and latency"""
+    return get_face_pool().stats()
 
-def get_db():
-    conn = connect_db()
-    try:
-        yield conn
-    finally:
-        conn.close()
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/user/me", auto_error=False)        # can be written differently
-async def get_current_user(token: str = Depends(oauth2_scheme)):
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    """Verify the bearer token locally: signature, revocation and user claims"""
+    return authenticator.require_user(token)
+
+def get_current_db_user(token: str = Depends(oauth2_scheme), db = Depends(get_db)):
+    """get_current_user for endpoints that already hold a connection: cache misses reuse it"""
+    return authenticator.require_user(token, db)
+
+async def get_token(token: str = Depends(oauth2_scheme)):
+    return token
+
+admin_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="admin-login", auto_error=False)
+async def get_admin_email(token: Optional[str] = Depends(admin_oauth2_scheme)) -> str:
     credentials_exception = HTTPException(
-        status_code=401,
+        status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     if token is None:
-        logger.error("No token provided in Authorization header")
         raise credentials_exception
     try:
-        # t_token = token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            logger.error("JWT payload missing 'sub' claim")
+        payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
+        admin_email: str = payload.get("sub")
+        # User access tokens also carry an email as sub; only admin tokens may pass
+        if admin_email is None or payload.get("type") != "admin":
             raise credentials_exception
-        async with httpx.AsyncClient() as client:
-            headers = {"Authorization": f"Bearer {token}"}
-            logger.info(f"Calling /user/me with headers: {headers}")
-            response = await client.get("http://login_register_container:8000/user/me", headers=headers)
-            logger.info(f"/user/me response: {response.status_code}, {response.text}")
-            if response.status_code != 200:
-                raise credentials_exception
-            user_data = response.json()
-            print("username", username)
-            print("user_id", user_data["user_id"])
-            return {"username": username, "user_id": user_data["user_id"]}
-    except (JWTError, httpx.HTTPStatusError) as e:
-        logger.error(f"Error in get_current_user: {str(e)}")
+        return admin_email
+    except ExpiredSignatureError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has expired",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except JWTError:
         raise credentials_exception
     
-async def get_token(token: str = Depends(oauth2_scheme)):
-    return token
-    
 
 class ImageToJsonResponse(BaseModel):
     json_data: Dict
@@ -165,6 +177,11 @@ class FacialRecognitionResponse(BaseModel):
     facial_areas: Dict[str, Dict]
     error: str = None  # Optional error field for error handling
 
+class FaceReverificationRequest(BaseModel):
+    user_ids: Optional[List[int]] = None  # default: every accepted employee of the admin
+    threshold: float = 0.5
+    batch_size: int = face_inference.FACE_BATCH_SIZE
+
 class ValidationRequest(BaseModel):
     scheme: str
     first_name: str
@@ -196,35 +213,45 @@ async def call_openai_parse(client, model, input_data):
     return client.responses.parse(model=model, input=input_data, text_format=CSCSCardJson)
 
 @retry(
-    stop=stop_after_attempt(10),  # Retry up to 10 times
-    wait=wait_exponential(multiplier=1, min=4, max=60),  # Exponential backoff
-    retry=retry_if_exception_type((RuntimeError, ValueError)),  # Retry on DeepFace runtime or value errors
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    # ValueError (no face, spoof detected) is a property of the images, retrying cannot help
+    retry=retry_if_exception_type(RuntimeError),
     before_sleep=lambda retry_state: logger.info(f"Retrying DeepFace operation: attempt {retry_state.attempt_number}, error: {retry_state.outcome.exception()}")
 )
-async def deepface_verify(img1_path, img2_path, model_name, detector_backend, threshold):
-    return DeepFace.verify(
-        img1_path=img1_path,
-        img2_path=img2_path,
-        model_name=model_name,
-        detector_backend=detector_backend,
-        threshold=threshold
-    )
-
-@retry(
-    stop=stop_after_attempt(10),
-    wait=wait_exponential(multiplier=1, min=4, max=60),
-    retry=retry_if_exception_type((RuntimeError, ValueError)),
-    before_sleep=lambda retry_state: logger.info(f"Retrying DeepFace face extraction: attempt {retry_state.attempt_number}, error: {retry_state.outcome.exception()}")
-)
-async def deepface_extract_faces(img_path, detector_backend, anti_spoofing=False):
-    return DeepFace.extract_faces(img_path, detector_backend=detector_backend, anti_spoofing=anti_spoofing)
+async def deepface_verify_pair(ref_image, comp_image, model_name='Facenet512', threshold=0.5,
+                               ref_embeddings=None, ref_facial_areas=None):
+    """Detect once per image, anti-spoof the comparison image and compare embeddings (face_inference.verify_pair)"""
+    return await run_face_inference(face_inference.verify_pair, ref_image, comp_image,
+                                     face_inference.FACE_DETECTOR_BACKEND, model_name, threshold, True,
+                                     ref_embeddings, ref_facial_areas)
 
 
 # --------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 
-def encode_image(image_file):
-    """Encode image file to base64 string."""
-    return base64.b64encode(image_file.read()).decode("utf-8")
+def encode_image(image_bytes):
+    """Encode image bytes to base64 string, from a memoryview so the upload is not copied first."""
+    return base64.b64encode(memoryview(image_bytes)).decode("ascii")
+
+async def render_pdf_first_page(pdf_bytes) -> bytes:
+    """
+    First page of a PDF as JPEG bytes. pdftoppm (what pdf2image runs) reads the
+    PDF from stdin and writes the JPEG to stdout, so nothing is spooled to disk.
+    Raises ValueError if the PDF cannot be rendered.
+    """
+    process = await asyncio.create_subprocess_exec(
+        "pdftoppm", "-jpeg", "-r", str(PDF_RENDER_DPI), "-f", "1", "-l", "1", "-singlefile", "-",
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(pdf_bytes), PDF_RENDER_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise ValueError("Timed out rendering the PDF")
+    if process.returncode != 0 or not stdout:
+        raise ValueError(stderr.decode(errors="replace").strip() or "No images found in the PDF")
+    return stdout
 
 def validate_image_file(file: UploadFile):
     """Validate image file type."""
@@ -283,14 +310,8 @@ async def image_to_json(file: UploadFile = File(...), current_user: dict = Depen
             raise HTTPException(status_code=resp.status_code, detail=f"Failed to upload file: {resp.text}")
     print("response from upload-file:", resp.status_code, resp.text)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as temp_file:
-        # temp_file.write(await file.read())
-        temp_file.write(file_content)
-        temp_image_path = temp_file.name
-
     try:
-        with open(temp_image_path, "rb") as image_file:
-            base64_image = encode_image(image_file)
+        base64_image = encode_image(file_content)
         input_data=[
                 {
                     "role": "user",
@@ -346,12 +367,10 @@ async def image_to_json(file: UploadFile = File(...), current_user: dict = Depen
         raise HTTPException(status_code=500, detail="Failed to parse JSON output from OpenAI")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
-    finally:
-        os.unlink(temp_image_path)
 
 
 @app.post("/cert-to-json", response_model=CSCSImagetoJsonResponse)
-async def cert_to_json(file: UploadFile = File(...), current_user: dict = Depends(get_current_user), db = Depends(get_db), token = Depends(get_token)):
+async def cert_to_json(file: UploadFile = File(...), current_user: dict = Depends(get_current_db_user), db = Depends(get_db), token = Depends(get_token)):
     # background_tasks = BackgroundTasks()
     print(current_user)
     username = current_user["username"]
@@ -373,10 +392,67 @@ async def cert_to_json(file: UploadFile = File(...), current_user: dict = Depend
         if resp.status_code != 200:
             raise HTTPException(status_code=resp.status_code, detail=f"Failed to upload file: {resp.text}")
     print("response from upload-file:", resp.status_code, resp.text)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_extension}") as temp_file:
-        temp_file.write(file_content)
-        temp_image_path = temp_file.name
+    s3_path = json.loads(resp.text)['s3_path']
+    return await process_certificate(file_content, file_extension, file.filename, s3_path, user_id, username, db)
+
+
+class CertificateFromS3Request(BaseModel):
+    key: str
 
+
+@app.post("/cert-to-json/from-s3", response_model=CSCSImagetoJsonResponse)
+async def cert_to_json_from_s3(request: CertificateFromS3Request, current_user: dict = Depends(get_current_db_user), db = Depends(get_db)):
+    """
+    Process a certificate the client uploaded straight to S3 with a presigned
+    POST from the AWS service. The object is streamed from S3 into memory,
+    so the upload bytes never pass through the AWS service or touch disk.
+    """
+    username = current_user["username"]
+    user_id = current_user["user_id"]
+    if not request.key.startswith(f"user_{user_id}/certificates/"):
+        raise HTTPException(status_code=403, detail="Not authorized to access this file")
+    allowed_extensions = ["png", "jpg", "jpeg", "pdf"]
+    file_extension = request.key.split(".")[-1].lower()
+    if file_extension not in allowed_extensions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Allowed types: {', '.join(allowed_extensions)}"
+        )
+
+    bucket_name = os.getenv("BUCKET_NAME")
+    buffer = io.BytesIO()
+    try:
+        await run_in_threadpool(download_to_file, bucket_name, request.key, buffer, MAX_CERTIFICATE_BYTES)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            raise HTTPException(status_code=404, detail="Certificate not found, upload it first")
+        raise HTTPException(status_code=500, detail=f"Failed to read certificate from S3: {str(e)}")
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    s3_path = f"s3://{bucket_name}/{request.key}"
+    return await process_certificate(buffer.getbuffer(), file_extension, Path(request.key).name, s3_path, user_id, username, db)
+
+
+def _store_certificate(db, user_id: int, filename: str, s3_path: str, output_path: str) -> int:
+    """Insert the certificate and its S3 addresses; returns the certificate_id (blocking)"""
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO certificates (user_id, certificate_name) VALUES (%s, %s) RETURNING certificate_id",
+            (user_id, filename)
+        )
+        cert_id = cursor.fetchone()['certificate_id']
+        cursor.execute(
+            "INSERT INTO cert_details (certificate_id, bucket_address, json_address, user_id) VALUES (%s, %s, %s, %s)",
+            (cert_id, s3_path, output_path, user_id)
+        )
+        db.commit()
+    return cert_id
+
+
+async def process_certificate(content, file_extension: str, filename: str, s3_path: str,
+                              user_id: int, username: str, db):
+    """Extract the card details from the file bytes, store the JSON and certificate rows and queue validation"""
     try:
         input_content = [
             {
@@ -389,22 +465,15 @@ async def cert_to_json(file: UploadFile = File(...), current_user: dict = Depend
             }
         ]
         if file_extension in ["png", "jpg", "jpeg"]:
-            with open(temp_image_path, "rb") as image_file:
-                base64_image = encode_image(image_file)
+            base64_image = encode_image(content)
             input_content.append({
                 "type": "input_image",
                 "image_url": f"data:image/jpeg;base64,{base64_image}",
             })
         elif file_extension == "pdf":
             try:
-                images = convert_from_path(temp_image_path)
-                if not images:
-                    raise HTTPException(status_code=400, detail="No images found in the PDF")
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_image_file:
-                    images[0].save(temp_image_file.name, "JPEG")
-                    with open(temp_image_file.name, "rb") as image_file:
-                        base64_image = encode_image(image_file)
-                    os.unlink(temp_image_file.name) 
+                # Only page 1 is sent to the model, so only page 1 is rendered
+                base64_image = encode_image(await render_pdf_first_page(content))
                 input_content.append({
                     "type": "input_image",
                     "image_url": f"data:image/jpeg;base64,{base64_image}",
@@ -428,7 +497,7 @@ async def cert_to_json(file: UploadFile = File(...), current_user: dict = Depend
         print("CSCS Response:", cscs_response)
         cscs_json = cscs_response.model_dump()
         print("CSCS JSON:", cscs_json)
-        file_name = Path(file.filename).stem
+        file_name = Path(filename).stem
         print("Uploading certificate JSON to S3...")
         async with httpx.AsyncClient() as api_client:
             resp2 = await api_client.post(
@@ -439,23 +508,10 @@ async def cert_to_json(file: UploadFile = File(...), current_user: dict = Depend
                 raise HTTPException(status_code=resp2.status_code, detail=f"Failed to upload JSON file: {resp2.text}")
         print("response from upload-file for JSON:", resp2.status_code, resp2.text)
         try:
-            s3_path_data = json.loads(resp.text)
-            s3_path = s3_path_data['s3_path']
             print("S3 path:", s3_path)
             json_path_data = json.loads(resp2.text)
             output_path = json_path_data['s3_path']
-            with db.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO certificates (user_id, certificate_name) VALUES (%s, %s) RETURNING certificate_id",
-                    (user_id, file.filename)
-                )
-                cert_id = cursor.fetchone()['certificate_id']
-                cursor.execute(
-                    "INSERT INTO cert_details (certificate_id, bucket_address, json_address, user_id) VALUES (%s, %s, %s, %s)",
-                    (cert_id, s3_path, output_path, user_id)
-                )
-                db.commit()
-                cursor.close()
+            cert_id = await run_in_threadpool(_store_certificate, db, user_id, filename, s3_path, output_path)
             validation_request = ValidationRequest(
                                                 scheme=cscs_json.get("scheme", "CSCS"),  # Default to CSCS if not found
                                                 first_name=cscs_json.get("first_name", ""),  # Extract from cscs_json
@@ -481,138 +537,123 @@ async def cert_to_json(file: UploadFile = File(...), current_user: dict = Depend
                 "output_path": output_path
             }
         except psycopg2Error as e:
-            db.rollback()
+            await run_in_threadpool(db.rollback)
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     except json.JSONDecodeError:
         raise HTTPException(status_code=500, detail="Failed to parse JSON output from OpenAI")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
-    finally:
-        os.unlink(temp_image_path)
+
+def _record_id_verification(db, user_id: int, id_image_url: str, realtime_photo_url: str, status: str):
+    """Insert the verification outcome (blocking)"""
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO id_verifications (user_id, id_image_url, realtime_photo_url, status, verified_at) " \
+            "VALUES (%s, %s, %s, %s, NOW())",
+            (user_id, id_image_url, realtime_photo_url, status)
+        )
+    db.commit()
 
 @app.post("/facial-recognition", response_model=FacialRecognitionResponse)
 async def facial_recognition(
     reference_image: UploadFile = File(...),
     comparison_image: UploadFile = File(...),
-    current_user: dict = Depends(get_current_user),
+    current_user: dict = Depends(get_current_db_user),
     db = Depends(get_db) 
 ):
     user_id = current_user["user_id"] 
     logger.info(f"Processing facial recognition for user: {current_user or 'anonymous'}")
 
-    print("Connected to database:", db)
-    cursor = db.cursor()
     validate_image_file(reference_image)
     validate_image_file(comparison_image)
 
-    ref_temp_path = None
-    comp_temp_path = None
-
     id_ref = reference_image.filename
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{reference_image.filename.split('.')[-1]}") as ref_temp_file, \
-         tempfile.NamedTemporaryFile(delete=False, suffix=f".{comparison_image.filename.split('.')[-1]}") as comp_temp_file:
-        
-        ref_temp_path = ref_temp_file.name
-        comp_temp_path = comp_temp_file.name
-        
+    try:
+        ref_image_bytes = await reference_image.read()
+        comp_image_bytes = await comparison_image.read()
+    except Exception as e:
+        logger.error(f"Error reading uploaded images: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to read images: {e}")
+    if not ref_image_bytes or not comp_image_bytes:
+        raise HTTPException(status_code=400, detail="One or both image files are empty or invalid.")
+
+    try:
+        ref_img_path = f"s3://certcheck-users/user_{user_id}/{id_ref}"
+        ref_sha256 = content_hash(ref_image_bytes)
+        embedding_store = FaceEmbeddingStore(db)
+        stored = None
         try:
-            ref_image_bytes = await reference_image.read()
-            comp_image_bytes = await comparison_image.read()
-            # ref_temp_file.write(await reference_image.read())
-            # comp_temp_file.write(await comparison_image.read())
-            if not ref_image_bytes or not comp_image_bytes:
-                raise HTTPException(status_code=400, detail="One or both image files are empty or invalid.")
-            ref_temp_file.write(ref_image_bytes)
-            comp_temp_file.write(comp_image_bytes)
-
-            ref_temp_file.flush()
-            comp_temp_file.flush()
+            stored = await run_in_threadpool(embedding_store.get, user_id, ref_sha256, 'Facenet512',
+                                             face_inference.FACE_DETECTOR_BACKEND)
         except Exception as e:
-            logger.error(f"Error saving temporary files: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to save images: {e}")
-        
+            logger.error(f"Face embedding lookup failed, embedding the ID image: {e}")
         try:
-            print("ref_temp_path:", ref_temp_path)
-            print("comp_temp_path:", comp_temp_path)
-            face1 = await deepface_extract_faces(ref_temp_path, detector_backend='opencv')
-            # face1 = DeepFace.extract_faces(ref_temp_path, detector_backend='opencv')
-            if face1 is None:
-                raise HTTPException(status_code=400, detail="No face detected in the uploaded ID image.")
-            # face2  = DeepFace.extract_faces(comp_temp_path, detector_backend='opencv', anti_spoofing=True)
-            face2 = await deepface_extract_faces(comp_temp_path, detector_backend='opencv', anti_spoofing=True)
-            if face2 is None:
-                raise HTTPException(status_code=400, detail="No face detected in the uploaded comparison image.")
-            result = await deepface_verify(
-                img1_path=ref_temp_path,
-                img2_path=comp_temp_path,
-                model_name='Facenet512',
-                detector_backend='retinaface',
-                threshold=0.5
-            )
-            logger.info(f"Facial recognition result: verified={result['verified']}, distance={result['distance']}")
-            response = FacialRecognitionResponse(
-                verified=result['verified'],
-                distance=result['distance'],
-                threshold=result['threshold'],
-                model=result['model'],
-                detector_backend=result['detector_backend'],
-                facial_areas=result['facial_areas']
-            )
-            async with httpx.AsyncClient() as api_client:
-                resp = await api_client.post(
-                    f"http://aws_container:8001/upload-file/?user_id={user_id}",
-                    files={"file": ("real_time_captured.jpg", open(comp_temp_path, "rb"), comparison_image.content_type) }  # type: ignore,
-                )
-                if resp.status_code != 200:
-                    logger.error(f"Failed to upload file to S3: {resp.status_code}, {resp.text}")
-                    raise HTTPException(status_code=resp.status_code, detail=f"Failed to upload file: {resp.text}")
-                logger.info(f"Response from upload-file: {resp.status_code}, {resp.text}")
-            print("id_ref:", id_ref)
-            ref_img_path = f"s3://certcheck-users/user_{user_id}/{id_ref}"
-            real_img_path = f"s3://certcheck-users/user_{user_id}/real_time_captured.jpg"
-            if response.verified == True:
-                res = "approved"
+            if stored:
+                # Same ID image as an earlier attempt: only the selfie is embedded
+                result = await deepface_verify_pair(None, comp_image_bytes, model_name='Facenet512', threshold=0.5,
+                                                    ref_embeddings=stored["embeddings"],
+                                                    ref_facial_areas=stored["facial_areas"])
             else:
-                res = "rejected"
-            cursor.execute(
-                "INSERT INTO id_verifications (user_id, id_image_url, realtime_photo_url, status, verified_at) " \
-                "VALUES (%s, %s, %s, %s, NOW())",
-                (user_id, ref_img_path, real_img_path, res)
-            )
-            db.commit()
-            json_response = response.model_dump()
-            json_response["user_id"] = user_id
-            json_response["id_image_url"] = ref_img_path
-            json_response["realtime_photo_url"] = real_img_path
-            json_response["status"] = res
-            json_file_name = f"{user_id}_facial_recognition.json"
-            json_temp_path = os.path.join(tempfile.gettempdir(), json_file_name)
-            with open(json_temp_path, "w") as json_file:
-                json.dump(json_response, json_file, indent=4)
-            async with httpx.AsyncClient() as api_client:
-                json_resp = await api_client.post(
-                    f"http://aws_container:8001/upload-file/?user_id={user_id}",
-                    files={"file": (json_file_name, open(json_temp_path, "rb"), "application/json")}
-                )
-                if json_resp.status_code != 200:
-                    logger.error(f"Failed to upload JSON file to S3: {json_resp.status_code}, {json_resp.text}")
-                    raise HTTPException(status_code=json_resp.status_code, detail=f"Failed to upload JSON file: {json_resp.text}")
-                logger.info(f"Response from upload-file for JSON: {json_resp.status_code}, {json_resp.text}")
-            return response
-
-        except Exception as e:
-            logger.error(f"Error during facial recognition: {e}")
-            raise HTTPException(status_code=500, detail=f"Facial recognition error: {str(e)}")
-
-        finally:
+                result = await deepface_verify_pair(ref_image_bytes, comp_image_bytes, model_name='Facenet512', threshold=0.5)
+        except ValueError as e:
+            # No face in one of the images, or the comparison image failed anti-spoofing
+            raise HTTPException(status_code=400, detail=f"Face verification failed: {str(e)}")
+        if not stored:
             try:
-                if os.path.exists(ref_temp_path):
-                    os.unlink(ref_temp_path)
-                if os.path.exists(comp_temp_path):
-                    os.unlink(comp_temp_path)
-                logger.debug(f"Temporary files {ref_temp_path} and {comp_temp_path} deleted.")
+                await run_in_threadpool(embedding_store.put, user_id, ref_img_path, ref_sha256, 'Facenet512',
+                                        face_inference.FACE_DETECTOR_BACKEND, result["ref_embeddings"],
+                                        result["ref_dims"], result["ref_facial_areas"])
             except Exception as e:
-                logger.error(f"Error deleting temporary files: {e}")
+                logger.error(f"Failed to store face embeddings for user {user_id}: {e}")
+        logger.info(f"Facial recognition result: verified={result['verified']}, distance={result['distance']}, "
+                    f"cached_reference={bool(stored)}")
+        response = FacialRecognitionResponse(
+            verified=result['verified'],
+            distance=result['distance'],
+            threshold=result['threshold'],
+            model=result['model'],
+            detector_backend=result['detector_backend'],
+            facial_areas=result['facial_areas']
+        )
+        async with httpx.AsyncClient() as api_client:
+            resp = await api_client.post(
+                f"http://aws_container:8001/upload-file/?user_id={user_id}",
+                files={"file": ("real_time_captured.jpg", comp_image_bytes, comparison_image.content_type) }  # type: ignore,
+            )
+            if resp.status_code != 200:
+                logger.error(f"Failed to upload file to S3: {resp.status_code}, {resp.text}")
+                raise HTTPException(status_code=resp.status_code, detail=f"Failed to upload file: {resp.text}")
+            logger.info(f"Response from upload-file: {resp.status_code}, {resp.text}")
+        print("id_ref:", id_ref)
+        real_img_path = f"s3://certcheck-users/user_{user_id}/real_time_captured.jpg"
+        if response.verified == True:
+            res = "approved"
+        else:
+            res = "rejected"
+        await run_in_threadpool(_record_id_verification, db, user_id, ref_img_path, real_img_path, res)
+        json_response = response.model_dump()
+        json_response["user_id"] = user_id
+        json_response["id_image_url"] = ref_img_path
+        json_response["realtime_photo_url"] = real_img_path
+        json_response["status"] = res
+        json_file_name = f"{user_id}_facial_recognition.json"
+        async with httpx.AsyncClient() as api_client:
+            json_resp = await api_client.post(
+                f"http://aws_container:8001/upload-file/?user_id={user_id}",
+                files={"file": (json_file_name, json.dumps(json_response, indent=4).encode(), "application/json")}
+            )
+            if json_resp.status_code != 200:
+                logger.error(f"Failed to upload JSON file to S3: {json_resp.status_code}, {json_resp.text}")
+                raise HTTPException(status_code=json_resp.status_code, detail=f"Failed to upload JSON file: {json_resp.text}")
+            logger.info(f"Response from upload-file for JSON: {json_resp.status_code}, {json_resp.text}")
+        return response
+
+    except HTTPException:
+        # Keep 400s and the face pool's 503/504 instead of turning them into 500s
+        raise
+    except Exception as e:
+        logger.error(f"Error during facial recognition: {e}")
+        raise HTTPException(status_code=500, detail=f"Facial recognition error: {str(e)}")
 
 
 
@@ -624,68 +665,135 @@ async def facial_recognition_test(
     validate_image_file(reference_image)
     validate_image_file(comparison_image)
 
-    ref_temp_path = None
-    comp_temp_path = None
+    try:
+        ref_image_bytes = await reference_image.read()
+        comp_image_bytes = await comparison_image.read()
+    except Exception as e:
+        logger.error(f"Error reading uploaded images: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to read images: {e}")
+    if not ref_image_bytes or not comp_image_bytes:
+        raise HTTPException(status_code=400, detail="One or both image files are empty or invalid.")
 
-    id_ref = reference_image.filename
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{reference_image.filename.split('.')[-1]}") as ref_temp_file, \
-         tempfile.NamedTemporaryFile(delete=False, suffix=f".{comparison_image.filename.split('.')[-1]}") as comp_temp_file:
-        
-        ref_temp_path = ref_temp_file.name
-        comp_temp_path = comp_temp_file.name
-        
+    try:
         try:
-            ref_image_bytes = await reference_image.read()
-            comp_image_bytes = await comparison_image.read()
-            # ref_temp_file.write(await reference_image.read())
-            # comp_temp_file.write(await comparison_image.read())
-            if not ref_image_bytes or not comp_image_bytes:
-                raise HTTPException(status_code=400, detail="One or both image files are empty or invalid.")
-            ref_temp_file.write(ref_image_bytes)
-            comp_temp_file.write(comp_image_bytes)
-
-            ref_temp_file.flush()
-            comp_temp_file.flush()
-
-            # Check OpenCV can read
-            # if cv2.imread(ref_temp_path) is None or cv2.imread(comp_temp_path) is None:
-            #     raise HTTPException(status_code=400, detail="Failed to read image files using OpenCV.")
+            result = await deepface_verify_pair(ref_image_bytes, comp_image_bytes, model_name='Facenet512', threshold=0.5)
+        except ValueError as e:
+            # No face in one of the images, or the comparison image failed anti-spoofing
+            raise HTTPException(status_code=400, detail=f"Face verification failed: {str(e)}")
+        logger.info(f"Facial recognition result: verified={result['verified']}, distance={result['distance']}")
+        response = FacialRecognitionResponse(
+            verified=result['verified'],
+            distance=result['distance'],
+            threshold=result['threshold'],
+            model=result['model'],
+            detector_backend=result['detector_backend'],
+            facial_areas=result['facial_areas']
+        )
+        print(response)
+        return response
+    except HTTPException:
+        # Keep 400s and the face pool's 503/504 instead of turning them into 500s
+        raise
+    except Exception as e:
+        logger.error(f"Error during facial recognition: {e}")
+        raise HTTPException(status_code=500, detail=f"Facial recognition error: {str(e)}")
 
-        except Exception as e:
-            logger.error(f"Error saving temporary files: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to save images: {e}")
-        
+
+def _download_bytes(s3_url: str) -> bytes:
+    """Body of an s3://bucket/key URL as stored in id_verifications (blocking)"""
+    bucket, _, key = s3_url[len("s3://"):].partition("/")
+    buffer = io.BytesIO()
+    download_to_file(bucket, key, buffer, max_bytes=MAX_FACE_IMAGE_BYTES)
+    return buffer.getvalue()
+
+async def _download_pairs(rows):
+    """(ID image, selfie) bytes per row, or the exception that stopped the download"""
+    async def pair(row):
         try:
-            print("ref_temp_path:", ref_temp_path)
-            print("comp_temp_path:", comp_temp_path)
-            face1 = DeepFace.extract_faces(ref_temp_path, detector_backend='opencv')
-            if face1 is None:
-                raise HTTPException(status_code=400, detail="No face detected in the uploaded ID image.")
-            face2  = DeepFace.extract_faces(comp_temp_path, detector_backend='opencv', anti_spoofing=True)
-            if face2 is None:
-                raise HTTPException(status_code=400, detail="No face detected in the uploaded comparison image.")
-            result = DeepFace.verify(
-                img1_path=ref_temp_path,
-                img2_path=comp_temp_path,
-                model_name='Facenet512',
-                detector_backend='retinaface',
-                threshold=0.5
-            )
-            logger.info(f"Facial recognition result: verified={result['verified']}, distance={result['distance']}")
-            response = FacialRecognitionResponse(
-                verified=result['verified'],
-                distance=result['distance'],
-                threshold=result['threshold'],
-                model=result['model'],
-                detector_backend=result['detector_backend'],
-                facial_areas=result['facial_areas']
-            )
-            print(response)
-            return response
-        except Exception as e:
-            logger.error(f"Error during facial recognition: {e}")
-            raise HTTPException(status_code=500, detail=f"Facial recognition error: {str(e)}")
-        
+            return tuple(await asyncio.gather(run_in_threadpool(_download_bytes, row["id_image_url"]),
+                                              run_in_threadpool(_download_bytes, row["realtime_photo_url"])))
+        except (ClientError, ValueError) as e:
+            return e
+    return await asyncio.gather(*(pair(row) for row in rows))
+
+def _reverification_rows(db, admin_email: str, user_ids):
+    """Latest id_verifications row per employee the admin has accepted (blocking)"""
+    cursor = db.cursor()
+    query = """
+        SELECT DISTINCT ON (v.user_id) v.user_id, u.username, v.id_image_url, v.realtime_photo_url, v.status
+        FROM accepted_data a
+        JOIN users u ON u.username = a.user_email
+        JOIN id_verifications v ON v.user_id = u.user_id
+        WHERE a.admin_email = %s
+    """
+    params = [admin_email]
+    if user_ids:
+        query += " AND v.user_id = ANY(%s)"
+        params.append(user_ids)
+    cursor.execute(query + " ORDER BY v.user_id, v.verified_at DESC NULLS LAST", params)
+    rows = cursor.fetchall()
+    cursor.close()
+    # Read-only; do not sit idle in a transaction while the face pool works
+    db.rollback()
+    return rows
+
+@app.post("/admin/face-reverification")
+async def bulk_face_reverification(
+    request: FaceReverificationRequest,
+    db = Depends(get_db),
+    admin_email: str = Depends(get_admin_email)
+):
+    """
+    Re-check the latest selfie of each accepted employee against their ID image
+    (e.g. after a model upgrade) with batched embeddings. Reports only:
+    id_verifications is not changed.
+    """
+    rows = await run_in_threadpool(_reverification_rows, db, admin_email, request.user_ids)
+
+    batch_size = max(1, min(request.batch_size, 256))
+    chunks = [rows[i:i + FACE_REVERIFY_CHUNK] for i in range(0, len(rows), FACE_REVERIFY_CHUNK)]
+    results = []
+    images = 0
+    inference_seconds = 0.0
+    next_download = asyncio.ensure_future(_download_pairs(chunks[0])) if chunks else None
+    try:
+        for n, chunk in enumerate(chunks):
+            downloaded = await next_download
+            # Fetch the next chunk from S3 while this one is on the face pool
+            next_download = asyncio.ensure_future(_download_pairs(chunks[n + 1])) if n + 1 < len(chunks) else None
+            pairs = [d for d in downloaded if not isinstance(d, Exception)]
+            batch = {"results": []}
+            if pairs:
+                started_at = time.perf_counter()
+                batch = await run_face_inference(face_inference.verify_batch, pairs, face_inference.FACE_DETECTOR_BACKEND,
+                                                 'Facenet512', request.threshold, batch_size,
+                                                 timeout=FACE_REVERIFY_TIMEOUT)
+                inference_seconds += time.perf_counter() - started_at
+                images += 2 * len(pairs)
+            verified = iter(batch["results"])
+            for row, d in zip(chunk, downloaded):
+                outcome = {"error": f"Could not download images: {d}"} if isinstance(d, Exception) else next(verified)
+                results.append(dict(outcome, user_id=row["user_id"], username=row["username"],
+                                    previous_status=row["status"]))
+    finally:
+        if next_download is not None:
+            next_download.cancel()
+
+    logger.info(f"Bulk face re-verification by {admin_email}: {len(results)} employees, {images} images "
+                f"in {inference_seconds:.1f}s")
+    return {
+        "checked": len(results),
+        "verified": sum(1 for r in results if r.get("verified") is True),
+        "rejected": sum(1 for r in results if r.get("verified") is False),
+        "failed": sum(1 for r in results if "error" in r),
+        "model": "Facenet512",
+        "detector_backend": face_inference.FACE_DETECTOR_BACKEND,
+        "threshold": request.threshold,
+        "batch_size": batch_size,
+        "images_per_second": round(images / inference_seconds, 2) if inference_seconds else 0.0,
+        "results": results,
+    }
+
 
 if __name__ == "__main__":
     import uvicorn                          # type: ignore